@@ -0,0 +1,324 @@
+"""Benchmark suite for the hot database and embed paths.
+
+Seeds a scratch database with realistic volumes and times the hot paths of models.py and the embed generators of
+ui.py. Results are written as JSON so runs from different commits can be compared:
+
+    python benchmark.py --db-name nynoir_bench --output bench-before.json
+    python benchmark.py --db-name nynoir_bench --reuse --output bench-after.json --compare bench-before.json
+
+The scratch database is reached with the host and credentials from config.py and must not be the bot's own database.
+Pass --sqlite with a file path instead of --db-name to run entirely in-process.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from settings import config
+import fake_discord
+
+SEED = 5541
+CHUNK_SIZE = 10000
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed(engine, users, transactions, earning_submissions, spending_submissions, admin_transactions):
+    from sqlalchemy import insert, update, bindparam, select
+    from models import Base, User, TransactionLog, EarningSubmission, SpendingSubmission, AdminTransaction, \
+        LocationAlignment, DailyLedgerRollup
+
+    rng = random.Random(SEED)
+    start = datetime.datetime(2023, 1, 1)
+    span = int(datetime.timedelta(days=365).total_seconds())
+    admin_ids = list(range(1, min(users, 25) + 1))
+    guild_id = int(config.DISCORD_SERVER_ID)
+
+    def timestamp():
+        return start + datetime.timedelta(seconds=rng.randrange(span))
+
+    def user_id():
+        # A few heavy posters and a long tail, like a real community
+        return min(int(rng.paretovariate(1.2)), users) if rng.random() < 0.3 else rng.randint(1, users)
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    balances = [0] * (users + 1)
+    with engine.begin() as conn:
+        for chunk in chunks({"id": i, "guild_id": guild_id, "discord_id": str(100000000000000000 + i),
+                             "judgement_points": 0, "visible": rng.random() > 0.05, "is_admin": i in admin_ids}
+                            for i in range(1, users + 1)):
+            conn.execute(insert(User), chunk)
+        for chunk in chunks({"id": i, "guild_id": guild_id, "discord_channel_id": str(200000000000000000 + i),
+                             "timestamp": timestamp(), "user_id": user_id(), "points_lodged": rng.choice([10, 20, 30]),
+                             "act_summary": "Benchmark act summary",
+                             "location_alignment": rng.choice(list(LocationAlignment)), "submitted": True,
+                             "approved": True}
+                            for i in range(1, earning_submissions + 1)):
+            conn.execute(insert(EarningSubmission), chunk)
+        for chunk in chunks({"id": i, "guild_id": guild_id, "discord_channel_id": str(300000000000000000 + i),
+                             "timestamp": timestamp(), "user_id": user_id(), "cost": 200, "ability_requested": "Benchmark ability",
+                             "ability_description": "Description", "ability_limitations": "Limitations",
+                             "cost_weakness": "Weakness", "cost_weakness_description": "Description",
+                             "lore_rule_compliant": True, "submitted": True, "approved": True}
+                            for i in range(1, spending_submissions + 1)):
+            conn.execute(insert(SpendingSubmission), chunk)
+        for chunk in chunks({"id": i, "guild_id": guild_id, "timestamp": timestamp(), "user_id": user_id(),
+                             "admin_user_id": rng.choice(admin_ids), "net_points": rng.randint(-50, 100),
+                             "reason": "Benchmark adjustment"}
+                            for i in range(1, admin_transactions + 1)):
+            conn.execute(insert(AdminTransaction), chunk)
+
+        earning = conn.execute(select(EarningSubmission.id, EarningSubmission.user_id,
+                                      EarningSubmission.points_lodged)).all()
+        spending = conn.execute(select(SpendingSubmission.id, SpendingSubmission.user_id,
+                                       SpendingSubmission.cost)).all()
+        admin = conn.execute(select(AdminTransaction.id, AdminTransaction.user_id,
+                                    AdminTransaction.net_points)).all()
+
+        def transaction_rows():
+            for row in earning:
+                yield {"user_id": row.user_id, "earning_submission_id": row.id, "judgement_points": row.points_lodged}
+            for row in spending:
+                yield {"user_id": row.user_id, "spending_submission_id": row.id, "judgement_points": -row.cost}
+            for row in admin:
+                yield {"user_id": row.user_id, "admin_transaction_id": row.id, "judgement_points": row.net_points}
+            for _ in range(max(transactions - len(earning) - len(spending) - len(admin), 0)):
+                yield {"user_id": user_id(), "judgement_points": rng.choice([10, 15, 20, 30, 40, 60])}
+
+        for chunk in chunks(transaction_rows()):
+            for row in chunk:
+                row["timestamp"] = timestamp()
+                row["guild_id"] = guild_id
+                row.setdefault("earning_submission_id", None)
+                row.setdefault("spending_submission_id", None)
+                row.setdefault("admin_transaction_id", None)
+                balances[row["user_id"]] += row["judgement_points"]
+                row["balance_after"] = balances[row["user_id"]]
+            conn.execute(insert(TransactionLog), chunk)
+
+        stmt = update(User).where(User.id == bindparam("uid")).values(judgement_points=bindparam("points"))
+        for chunk in chunks({"uid": i, "points": balances[i]} for i in range(1, users + 1) if balances[i]):
+            conn.execute(stmt, chunk)
+
+    DailyLedgerRollup.rebuild()
+
+
+def measure(name, fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(int(len(samples) * 0.95), len(samples) - 1)], 3),
+        "max_ms": round(samples[-1], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+    print(f"{name:<55} median {result['median_ms']:>10.3f} ms   p95 {result['p95_ms']:>10.3f} ms")
+    return result
+
+
+def run_benchmarks(iterations):
+    from sqlalchemy import select, func
+    fake_discord.install(fake_discord.FakeBot())
+    import leaderboard_index
+    import ui
+    from db import get_engine
+    from models import User, TransactionLog, EarningSubmission, SpendingSubmission, AdminTransaction, \
+        DailyLedgerRollup
+
+    loop = asyncio.new_event_loop()
+    rng = random.Random(SEED + 1)
+    engine = get_engine()
+    with engine.connect() as conn:
+        user_count = conn.execute(select(func.max(User.id))).scalar()
+        heavy_user_id = conn.execute(select(TransactionLog.user_id).group_by(TransactionLog.user_id)
+                                     .order_by(func.count().desc()).limit(1)).scalar()
+        busy_admin_id = conn.execute(select(AdminTransaction.admin_user_id).group_by(AdminTransaction.admin_user_id)
+                                     .order_by(func.count().desc()).limit(1)).scalar()
+        earning_id = conn.execute(select(func.max(EarningSubmission.id))).scalar()
+        spending_id = conn.execute(select(func.max(SpendingSubmission.id))).scalar()
+        admin_transaction_id = conn.execute(select(func.max(AdminTransaction.id))).scalar()
+    heavy_user = User.get_by_id(heavy_user_id)
+    busy_admin = User.get_by_id(busy_admin_id)
+    leaderboard_pages = last_page(User.count())
+    heavy_user_pages = last_page(TransactionLog.count(heavy_user.id))
+    admin_pages = last_page(AdminTransaction.count(admin_id=busy_admin.id))
+    all_admin_pages = last_page(AdminTransaction.count())
+    user_pages = last_page(User.count(only_visible=False))
+    earning = EarningSubmission.get_by_id(earning_id)
+    spending = SpendingSubmission.get_by_id(spending_id)
+    admin_transaction = AdminTransaction.get_by_id(admin_transaction_id)
+    new_discord_ids = iter(range(900000000000000000, 900000000000000000 + iterations))
+
+    def embed(coro_fn):
+        return lambda: loop.run_until_complete(coro_fn())
+
+    cases = [
+        ("User.get_or_create existing", lambda: User.get_or_create(100000000000000000 + rng.randint(1, user_count))),
+        ("User.get_or_create new", lambda: User.get_or_create(next(new_discord_ids))),
+        ("User.count", lambda: User.count()),
+        ("User.get_leaderboard page 1", lambda: list(User.get_leaderboard(1))),
+        ("User.get_leaderboard middle page", lambda: list(User.get_leaderboard(max(leaderboard_pages // 2, 1)))),
+        ("User.get_leaderboard last page", lambda: list(User.get_leaderboard(leaderboard_pages))),
+        ("User.get_rank", lambda: User.get_rank(heavy_user)),
+        ("User.get_users last page", lambda: list(User.get_users(user_pages))),
+        ("TransactionLog.search_by_user page 1", lambda: list(TransactionLog.search_by_user(heavy_user.id, 1))),
+        ("TransactionLog.search_by_user last page",
+         lambda: list(TransactionLog.search_by_user(heavy_user.id, heavy_user_pages))),
+        ("TransactionLog.balance_as_of",
+         lambda: TransactionLog.balance_as_of(heavy_user.id, datetime.datetime.utcnow())),
+        ("TransactionLog.create_from_earning_submission",
+         lambda: TransactionLog.create_from_earning_submission(earning)),
+        ("TransactionLog.create_from_spending_submission",
+         lambda: TransactionLog.create_from_spending_submission(spending)),
+        ("TransactionLog.create_from_admin_transaction",
+         lambda: TransactionLog.create_from_admin_transaction(admin_transaction)),
+        ("AdminTransaction.search by admin page 1", lambda: list(AdminTransaction.search(admin=busy_admin, page=1))),
+        ("AdminTransaction.search by admin last page",
+         lambda: list(AdminTransaction.search(admin=busy_admin, page=admin_pages))),
+        ("AdminTransaction.search unfiltered last page",
+         lambda: list(AdminTransaction.search(page=all_admin_pages))),
+        ("DailyLedgerRollup.totals all time", lambda: DailyLedgerRollup.totals()),
+        ("DailyLedgerRollup.top_earners all time", lambda: list(DailyLedgerRollup.top_earners())),
+        ("DailyLedgerRollup.totals heavy user", lambda: DailyLedgerRollup.totals(user_id=heavy_user.id)),
+        ("ui.generate_leaderboard_embed page 1", embed(lambda: ui.generate_leaderboard_embed(1))),
+        ("ui.generate_leaderboard_embed last page", embed(lambda: ui.generate_leaderboard_embed(leaderboard_pages))),
+        ("ui.generate_rank_embed", embed(lambda: ui.generate_rank_embed(heavy_user))),
+        ("ui.generate_transaction_log_embed page 1",
+         embed(lambda: ui.generate_transaction_log_embed(1, user=heavy_user))),
+        ("ui.generate_admin_transaction_log_embed page 1",
+         embed(lambda: ui.generate_admin_transaction_log_embed(1))),
+        ("ui.generate_stats_embed all time", embed(lambda: ui.generate_stats_embed("All Time"))),
+        ("ui.generate_users_embed last page", embed(lambda: ui.generate_users_embed(user_pages))),
+        ("ui.generate_earning_embed", embed(lambda: ui.generate_earning_embed(earning, "Benchmark"))),
+        ("ui.generate_spending_embed", embed(lambda: ui.generate_spending_embed(spending, "Benchmark"))),
+        ("ui.generate_admin_transaction_embed",
+         embed(lambda: ui.generate_admin_transaction_embed(admin_transaction, "Benchmark"))),
+    ]
+    # Measured last, as installing the in-memory leaderboard index changes how the leaderboard is served
+    indexed_cases = [
+        ("User.load_leaderboard_index", lambda: User.load_leaderboard_index()),
+        ("User.get_leaderboard last page (index)", lambda: list(User.get_leaderboard(leaderboard_pages))),
+        ("User.get_rank (index)", lambda: User.get_rank(heavy_user)),
+        ("ui.generate_leaderboard_embed last page (index)",
+         embed(lambda: ui.generate_leaderboard_embed(leaderboard_pages))),
+    ]
+    try:
+        return [measure(name, fn, iterations) for name, fn in cases + indexed_cases]
+    finally:
+        leaderboard_index.install(None)
+        loop.close()
+
+
+def last_page(count):
+    return max(math.ceil(count / 10), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if not previous or not previous["median_ms"]:
+            continue
+        change = (result["median_ms"] - previous["median_ms"]) / previous["median_ms"]
+        print(f"{result['name']:<55} {previous['median_ms']:>10.3f} -> {result['median_ms']:>10.3f} ms "
+              f"({change:+.1%})")
+        if change > threshold:
+            regressions.append(result["name"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NY Noir bot against a scratch database")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--db-name", help="Scratch database to seed, never the bot's own database")
+    target.add_argument("--sqlite", help="Path of a scratch SQLite database file to seed instead")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--transactions", type=int, default=2000000)
+    parser.add_argument("--earning-submissions", type=int, default=30000)
+    parser.add_argument("--spending-submissions", type=int, default=10000)
+    parser.add_argument("--admin-transactions", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--reuse", action="store_true", help="Skip seeding and reuse the existing scratch data")
+    parser.add_argument("--output", default="bench.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="A previous JSON result file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative median slowdown reported as a regression when comparing")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        config.DB_DIALECT = "sqlite:///"
+        config.DB_NAME = args.sqlite
+    elif args.db_name == config.DB_NAME:
+        parser.error("--db-name must not be the bot's configured database, it is dropped and re-seeded")
+    else:
+        config.DB_NAME = args.db_name
+
+    from db import get_engine
+    engine = get_engine()
+    dataset = {"users": args.users, "transactions": args.transactions,
+               "earning_submissions": args.earning_submissions,
+               "spending_submissions": args.spending_submissions,
+               "admin_transactions": args.admin_transactions}
+    if not args.reuse:
+        print(f"Seeding {engine.url.render_as_string(hide_password=True)}: {dataset}")
+        start = time.perf_counter()
+        seed(engine, **dataset)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    results = run_benchmarks(args.iterations)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "dialect": engine.dialect.name,
+        "dataset": dataset,
+        "reused": args.reuse,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,66 +1,82 @@
+import asyncio
+import csv
+import datetime
+import io
+import logging
 from typing import Optional
 
 import discord
 from discord import PermissionOverwrite, Permissions, option
+from sqlalchemy.exc import SQLAlchemyError
 
-import config
+from settings import config
 import discord_bot
+import export
+import outbox
+from db import write_in_thread
 from discord_bot import bot
 from discord_permissions import DP
-from exceptions import PaginationError
-from models import User, EarningSubmission, AdminTransaction, TransactionLog, SpendingSubmission
+from exceptions import PaginationError, ConfigurationError
+from models import User, EarningSubmission, AdminTransaction, TransactionLog, SpendingSubmission, LeaderboardSnapshot, \
+    Outbox, GuildSettings, CacheVersion
 from ui import register_views, EarningPointsLodged, generate_leaderboard_embed, LeaderboardPaginationButtons, \
     SpendingAbilityInfoButton, generate_transaction_log_embed, TransactionLogPaginationButtons, generate_earning_embed, \
     generate_spending_embed, generate_admin_transaction_embed, generate_admin_transaction_log_embed, \
-    AdminTransactionLogPaginationButtons, generate_users_embed, UserPaginationButtons
+    AdminTransactionLogPaginationButtons, generate_users_embed, UserPaginationButtons, generate_stats_embed, \
+    generate_leaderboard_history_embed, generate_rank_embed, generate_review_queue_embed, ReviewQueueButtons, \
+    generate_outbox_embed, generate_guild_settings_embed
 
+GUILD_IDS = discord_bot.served_guild_ids()
+logger = logging.getLogger(__name__)
+NOT_SET_UP = "This server has not been set up yet, a server manager needs to run /guild_settings first"
 
-@bot.slash_command(name="earning_submission", guild_ids=[config.DISCORD_SERVER_ID])
+
+@bot.slash_command(name="earning_submission", guild_ids=GUILD_IDS)
 async def earning_submission(ctx):
     await ctx.response.defer(ephemeral=True)
-    user = User.get_or_create(ctx.author.id)
+    if not GuildSettings.is_set_up(ctx.guild_id):
+        await ctx.followup.send(NOT_SET_UP)
+        return
+    user = User.get_or_create(ctx.author.id, ctx.guild_id)
     next_submission_id = EarningSubmission.get_next_id()
-    guild = bot.get_guild(int(config.DISCORD_SERVER_ID))
+    guild = bot.get_guild(ctx.guild_id)
     if guild:
-        role_everyone = await discord_bot.get_role_by_name("@everyone")
-        channel = await (
-            guild.create_text_channel(
-            f"earning-{next_submission_id}",
-                overwrites={
-                    role_everyone: PermissionOverwrite.from_pair(
-                        Permissions.none(),
-                        Permissions.all()
-                    ),
-                    ctx.author: PermissionOverwrite.from_pair(
-                        Permissions(DP.SEND_MESSAGES | DP.VIEW_CHANNEL),
-                        Permissions(~(DP.SEND_MESSAGES | DP.VIEW_CHANNEL))
-                    )
-                },
-                category=await discord_bot.get_or_create_category("submissions")
-            )
-        )
-        EarningSubmission.create(channel.id, user.id)
+        channel = await discord_bot.create_submission_channel(guild, f"earning-{next_submission_id}", ctx.author)
+        EarningSubmission.create(channel.id, user.id, ctx.guild_id)
         await ctx.followup.send(channel.mention)
         await channel.send("How many points would you like to lodge?", view=EarningPointsLodged())
     else:
         await ctx.followup.send("Failed to get Guild")
 
 
-@bot.slash_command(name="balance", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="balance", guild_ids=GUILD_IDS)
 @option("user",
         discord.User,
         required=False,
         description="User to get balance of")
-async def balance(ctx, user: discord.User):
-    if user:
-        db_user = User.get_or_create(user.id)
+@option("as_of",
+        description="Balance at the end of this date instead of now (YYYY-MM-DD, UTC)",
+        required=False)
+async def balance(ctx, user: discord.User, as_of: str = None):
+    if as_of:
+        try:
+            end = datetime.datetime.fromisoformat(as_of) + datetime.timedelta(days=1)
+        except ValueError:
+            await ctx.respond("Dates must be given as `YYYY-MM-DD`", ephemeral=True)
+            return
+        db_user = User.get_or_create(user.id if user else ctx.author.id, ctx.guild_id)
+        points = TransactionLog.balance_as_of(db_user.id, end)
+        owner = f"{user.name}'s" if user else "Your"
+        await ctx.respond(f"{owner} Judgement Point balance at the end of {as_of} was: `{points}`")
+    elif user:
+        db_user = User.get_or_create(user.id, ctx.guild_id)
         await ctx.respond(f"{user.name}'s Judgement Point balance is: `{db_user.judgement_points}`")
     else:
-        db_user = User.get_or_create(ctx.author.id)
+        db_user = User.get_or_create(ctx.author.id, ctx.guild_id)
         await ctx.respond(f"Your Judgement Point balance is: `{db_user.judgement_points}`")
 
 
-@bot.slash_command(name="admin_transaction", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="admin_transaction", guild_ids=GUILD_IDS)
 @option("user",
         discord.User,
         description="User to modify balance of")
@@ -75,12 +91,12 @@ async def balance(ctx, user: discord.User):
         description="The reason this transaction is being performed")
 async def admin_transaction(ctx, user: discord.User, action, amount, reason):
     await ctx.response.defer(ephemeral=True)
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.followup.send("You are not authorized to perform this action")
         return
-    db_user = User.get_or_create(user.id)
-    db_admin_user = User.get_or_create(ctx.author.id)
+    db_user = User.get_or_create(user.id, ctx.guild_id)
+    db_admin_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     result_points = db_user.judgement_points
     description = f", user {user.name}'s balance has "
     if action == "+":
@@ -94,11 +110,100 @@ async def admin_transaction(ctx, user: discord.User, action, amount, reason):
         description += f"been set to {amount} points"
     description += f", balance is now {result_points} points."
     net_points = result_points - db_user.judgement_points
-    admin_transaction_id = AdminTransaction.create(db_user.id, db_admin_user.id, net_points, reason)
+    admin_transaction_id = AdminTransaction.create(db_user.id, db_admin_user.id, net_points, reason, guild_id=ctx.guild_id)
     TransactionLog.create_from_admin_transaction(AdminTransaction.get_by_id(admin_transaction_id))
     await ctx.followup.send("Admin Transaction Performed" + description)
 
-@bot.slash_command(name="admin_transaction_log", guild_ids=[config.DISCORD_SERVER_ID])
+
+def parse_bulk_csv(data, action, amount):
+    adjustments = []
+    for line_number, row in enumerate(csv.reader(io.StringIO(data.decode("utf-8-sig"))), start=1):
+        if not row or not row[0].strip():
+            continue
+        discord_id = row[0].strip().strip("<@!>")
+        if not discord_id.isdigit():
+            if line_number == 1:
+                continue  # Header row
+            raise ValueError(f"Line {line_number}: `{row[0]}` is not a Discord user ID")
+        row_amount = amount
+        if len(row) > 1 and row[1].strip():
+            try:
+                row_amount = int(row[1])
+            except ValueError:
+                raise ValueError(f"Line {line_number}: `{row[1]}` is not a whole number of points")
+        if row_amount is None:
+            raise ValueError(f"Line {line_number}: no amount given and no default `amount` provided")
+        if row_amount < 0:
+            raise ValueError(f"Line {line_number}: amounts must not be negative, use the `-` action instead")
+        adjustments.append((int(discord_id), action, row_amount))
+    return adjustments
+
+
+@bot.slash_command(name="bulk_admin_transaction", guild_ids=GUILD_IDS)
+@option("action",
+        choices=["+", "-", "="],
+        description="Whether to add, remove, or set balance for every user")
+@option("reason",
+        description="The reason this transaction is being performed")
+@option("amount",
+        type=int,
+        min_value=0,
+        description="The amount of points for every user, or for CSV rows without an amount",
+        required=False)
+@option("role",
+        type=discord.Role,
+        description="Apply the transaction to every member of this role",
+        required=False)
+@option("csv_file",
+        type=discord.Attachment,
+        description="A CSV of `discord_id,amount` rows, the amount column is optional",
+        required=False)
+async def bulk_admin_transaction(ctx, action, reason, amount: Optional[int] = None, role: discord.Role = None,
+                                 csv_file: discord.Attachment = None):
+    await ctx.response.defer(ephemeral=True)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
+    if not calling_user.is_admin:
+        await ctx.followup.send("You are not authorized to perform this action")
+        return
+    if role is None and csv_file is None:
+        await ctx.followup.send("Either `role` or `csv_file` must be provided")
+        return
+    adjustments = []
+    if role is not None:
+        if amount is None:
+            await ctx.followup.send("`amount` must be provided when applying a transaction to a role")
+            return
+        if not bot.intents.members:
+            # Without the members intent role.members only holds whoever happens to be cached
+            await ctx.followup.send("Applying a transaction to a role needs DISCORD_MEMBERS_INTENT enabled, "
+                                    "provide a `csv_file` of the role's members instead")
+            return
+        if not ctx.guild.chunked:
+            await ctx.guild.chunk()
+        adjustments += [(member.id, action, amount) for member in role.members if not member.bot]
+    if csv_file is not None:
+        try:
+            adjustments += parse_bulk_csv(await csv_file.read(), action, amount)
+        except (ValueError, UnicodeDecodeError) as e:
+            await ctx.followup.send(f"Unable to read `{csv_file.filename}`: {e}")
+            return
+    if not adjustments:
+        await ctx.followup.send("No users were found to apply the transaction to")
+        return
+    try:
+        results = await write_in_thread(AdminTransaction.create_bulk, calling_user.id, adjustments, reason,
+                                        guild_id=ctx.guild_id)
+    except SQLAlchemyError:
+        logger.exception("Bulk admin transaction failed")
+        await ctx.followup.send("Bulk Admin Transaction failed and no points were changed, please try again")
+        return
+    total = sum(net_points for _, _, net_points, _ in results)
+    await ctx.followup.send(f"Bulk Admin Transaction Performed, {len(results)} transactions for "
+                            f"{len({discord_id for discord_id, _, _, _ in results})} users, "
+                            f"net change of {'+' if total >= 0 else ''}{total} points. Admin Transaction IDs "
+                            f"#{results[0][1]} to #{results[-1][1]}.")
+
+@bot.slash_command(name="admin_transaction_log", guild_ids=GUILD_IDS)
 @option("target_user",
         type=discord.User,
         description="The targeted user to query admin transactions for",
@@ -113,23 +218,23 @@ async def admin_transaction(ctx, user: discord.User, action, amount, reason):
         description="The page of the Admin Transaction Log to view",
         required=False)
 async def admin_transaction_log(ctx, target_user: discord.User=None, admin_user:discord.User=None, page=1):
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.response.send_message("You are not authorized to perform this action")
         return
     db_target_user = None
     if target_user:
-        db_target_user = User.get_or_create(target_user.id)
+        db_target_user = User.get_or_create(target_user.id, ctx.guild_id)
     db_admin_user = None
     if admin_user:
-        db_admin_user = User.get_or_create(admin_user.id)
+        db_admin_user = User.get_or_create(admin_user.id, ctx.guild_id)
     try:
         await ctx.response.defer(ephemeral=True)
-        await ctx.followup.send(embed=await generate_admin_transaction_log_embed(page, target=db_target_user, admin=db_admin_user), view=AdminTransactionLogPaginationButtons())
+        await ctx.followup.send(embed=await generate_admin_transaction_log_embed(page, target=db_target_user, admin=db_admin_user, guild_id=ctx.guild_id), view=AdminTransactionLogPaginationButtons())
     except PaginationError as e:
         await ctx.followup.send(e.message)
 
-@bot.slash_command(name="leaderboard", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="leaderboard", guild_ids=GUILD_IDS)
 @option("page",
         type=int,
         min_value=1,
@@ -140,12 +245,109 @@ async def leaderboard(ctx, page):
     if page is None:
         page = 1
     try:
-        await ctx.respond(embeds=[await generate_leaderboard_embed(page)], view=LeaderboardPaginationButtons())
+        await ctx.respond(embeds=[await generate_leaderboard_embed(page, ctx.guild_id)], view=LeaderboardPaginationButtons())
     except PaginationError as e:
         await ctx.respond(e.message)
 
 
-@bot.slash_command(name="transaction_log", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="review_queue", guild_ids=GUILD_IDS)
+@option("record_type",
+        choices=["Earning Submissions", "Spending Submissions"],
+        description="The type of submission to list")
+async def review_queue(ctx, record_type):
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
+    if not calling_user.is_admin:
+        await ctx.response.send_message("You are not authorized to perform this action")
+        return
+    await ctx.response.defer(ephemeral=True)
+    await ctx.followup.send(embed=await generate_review_queue_embed(record_type, guild_id=ctx.guild_id), view=ReviewQueueButtons())
+
+
+@bot.slash_command(name="outbox", guild_ids=[config.DISCORD_SERVER_ID])  # The outbox is shared by every guild
+@option("retry_dead", bool, description="Queue every dead-lettered entry to be attempted again", required=False)
+async def outbox_status(ctx, retry_dead: bool = False):
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
+    if not calling_user.is_admin:
+        await ctx.response.send_message("You are not authorized to perform this action")
+        return
+    await ctx.response.defer(ephemeral=True)
+    if retry_dead:
+        retried = Outbox.retry_dead()
+        if retried:
+            outbox.wake()
+        await ctx.followup.send(f"Queued {retried} dead-lettered entries to be attempted again")
+    await ctx.followup.send(embed=await generate_outbox_embed())
+
+
+@bot.slash_command(name="rank", guild_ids=GUILD_IDS)
+@option("user", discord.User, description="User to get the Leaderboard rank of", required=False)
+async def rank(ctx, user: discord.User = None):
+    db_user = User.get_or_create(user.id if user else ctx.author.id, ctx.guild_id)
+    if not db_user.visible:
+        await ctx.respond(f"{user.name + ' is' if user else 'You are'} not visible on the Leaderboard")
+        return
+    embed = await generate_rank_embed(db_user)
+    if embed is None:
+        await ctx.respond(f"{user.name + ' is' if user else 'You are'} not on the Leaderboard")
+        return
+    await ctx.respond(embed=embed)
+
+
+@bot.slash_command(name="leaderboard_history", guild_ids=GUILD_IDS)
+@option("period",
+        choices=["Past Week", "Past Month", "Past Year"],
+        description="How far back to compare the Leaderboard with",
+        required=False)
+@option("user", discord.User, description="Show a single user's rank movement instead", required=False)
+@option("page",
+        type=int,
+        min_value=1,
+        description="The page of the Leaderboard History to view",
+        required=False
+)
+async def leaderboard_history(ctx, period="Past Week", user: discord.User = None, page=1):
+    if period is None:
+        period = "Past Week"
+    if page is None:
+        page = 1
+    today = datetime.datetime.utcnow().date()
+    end_day = LeaderboardSnapshot.nearest_day(today, guild_id=ctx.guild_id)
+    if end_day is None:
+        await ctx.respond("No Leaderboard snapshots have been taken yet")
+        return
+    days = {"Past Week": 7, "Past Month": 30, "Past Year": 365}[period]
+    start_day = LeaderboardSnapshot.nearest_day(today - datetime.timedelta(days=days), guild_id=ctx.guild_id) or \
+        LeaderboardSnapshot.first_day(guild_id=ctx.guild_id)
+    db_user = User.get_or_create(user.id, ctx.guild_id) if user else None
+    try:
+        await ctx.respond(embed=await generate_leaderboard_history_embed(page, period, start_day, end_day, user=db_user,
+                                                                   guild_id=ctx.guild_id))
+    except PaginationError as e:
+        await ctx.respond(e.message)
+
+
+@bot.slash_command(name="stats", guild_ids=GUILD_IDS)
+@option("period",
+        choices=["Today", "This Week", "This Month", "This Year", "All Time"],
+        description="The period to total Judgement Points over (UTC)",
+        required=False)
+@option("user", discord.User, description="Show a single user's stats instead of the server's", required=False)
+async def stats(ctx, period="This Month", user: discord.User = None):
+    if period is None:
+        period = "This Month"
+    today = datetime.datetime.utcnow().date()
+    start = {
+        "Today": today,
+        "This Week": today - datetime.timedelta(days=today.weekday()),
+        "This Month": today.replace(day=1),
+        "This Year": today.replace(month=1, day=1),
+        "All Time": None,
+    }[period]
+    db_user = User.get_or_create(user.id, ctx.guild_id) if user else None
+    await ctx.respond(embed=await generate_stats_embed(period, start=start, user=db_user, guild_id=ctx.guild_id))
+
+
+@bot.slash_command(name="transaction_log", guild_ids=GUILD_IDS)
 @option("user", discord.User, description="The user to retrieve the Transaction Log for")
 @option("page",
         type=int,
@@ -154,11 +356,11 @@ async def leaderboard(ctx, page):
         required=False
 )
 async def transaction_log(ctx, user: discord.User, page=1):
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.response.send_message("You are not authorized to perform this action")
         return
-    db_user = User.get_or_create(user.id)
+    db_user = User.get_or_create(user.id, ctx.guild_id)
     try:
         await ctx.response.defer(ephemeral=True)
         await ctx.followup.send(embed=await generate_transaction_log_embed(page, user=db_user), view=TransactionLogPaginationButtons())
@@ -166,7 +368,7 @@ async def transaction_log(ctx, user: discord.User, page=1):
         await ctx.followup.send(e.message)
 
 
-@bot.slash_command(name="inspect", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="inspect", guild_ids=GUILD_IDS)
 @option("record_type",
         choices=["Earning Submission", "Spending Submission", "Admin Transaction"],
         description="The type of record to inspect")
@@ -176,56 +378,43 @@ async def transaction_log(ctx, user: discord.User, page=1):
         description="The ID of the record to inspect")
 async def inspect(ctx, record_type, record_id):
     await ctx.response.defer(ephemeral=True)
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.followup.send("You are not authorized to perform this action")
         return
     if record_type == "Earning Submission":
         submission = EarningSubmission.get_by_id(record_id)
-        if submission:
+        if submission and submission.guild_id == ctx.guild_id:
             await ctx.followup.send(embed=await generate_earning_embed(submission, "Inspecting Earning Submission"))
         else:
             await ctx.followup.send(f"Earning Submission #{record_id} does not exist!")
     elif record_type == "Spending Submission":
         submission = SpendingSubmission.get_by_id(record_id)
-        if submission:
+        if submission and submission.guild_id == ctx.guild_id:
             await ctx.followup.send(embed=await generate_spending_embed(submission, "Inspecting Spending Submission"))
         else:
             await ctx.followup.send(f"Spending Submission #{record_id} does not exist!")
     else:
         transaction = AdminTransaction.get_by_id(record_id)
-        if transaction:
+        if transaction and transaction.guild_id == ctx.guild_id:
             await ctx.followup.send(embed=await generate_admin_transaction_embed(transaction, "Inspecting Admin Transaction"))
         else:
             await ctx.followup.send(f"Admin Transaction #{record_id} does not exist!")
 
 
-@bot.slash_command(name="spending_submission", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="spending_submission", guild_ids=GUILD_IDS)
 async def spending_submission(ctx):
     await ctx.response.defer(ephemeral=True)
-    user = User.get_or_create(ctx.author.id)
+    if not GuildSettings.is_set_up(ctx.guild_id):
+        await ctx.followup.send(NOT_SET_UP)
+        return
+    user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if user.judgement_points >= 200:
         next_submission_id = SpendingSubmission.get_next_id()
-        guild = bot.get_guild(int(config.DISCORD_SERVER_ID))
+        guild = bot.get_guild(ctx.guild_id)
         if guild:
-            role_everyone = await discord_bot.get_role_by_name("@everyone")
-            channel = await (
-                guild.create_text_channel(
-                f"spending-{next_submission_id}",
-                    overwrites={
-                        role_everyone: PermissionOverwrite.from_pair(
-                            Permissions.none(),
-                            Permissions.all()
-                        ),
-                        ctx.author: PermissionOverwrite.from_pair(
-                            Permissions(DP.SEND_MESSAGES | DP.VIEW_CHANNEL),
-                            Permissions(~(DP.SEND_MESSAGES | DP.VIEW_CHANNEL))
-                        )
-                    },
-                    category=await discord_bot.get_or_create_category("submissions")
-                )
-            )
-            SpendingSubmission.create(channel.id, user.id)
+            channel = await discord_bot.create_submission_channel(guild, f"spending-{next_submission_id}", ctx.author)
+            SpendingSubmission.create(channel.id, user.id, ctx.guild_id)
             await ctx.followup.send(channel.mention)
             await channel.send("Click the button below to enter your Ability information", view=SpendingAbilityInfoButton())
         else:
@@ -233,23 +422,23 @@ async def spending_submission(ctx):
     else:
         await ctx.followup.send(f"You don't have enough Judgement Points to create a Spending Submission. Your current balance is `{user.judgement_points}` Points")
 
-@bot.slash_command(name="set_visibility", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="set_visibility", guild_ids=GUILD_IDS)
 @option("visibility", choices=["visible", "invisible"], description="The visibility the user should have on the Leaderboard")
 @option("user", discord.User, description="The user to set the visibility of, if they are a member of the server", required=False)
 @option("user_id", type=int, min_value=0, description="The NY Noir ID of the user (from /users) to set the visibility of", required=False)
 async def set_visibility(ctx, visibility, user: Optional[discord.User], user_id: Optional[int]):
     await ctx.response.defer(ephemeral=True)
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.followup.send("You are not authorized to perform this action")
         return
     if user:
-        db_user = User.get_or_create(user.id)
-        User.set_visible_by_discord_id(user.id, True if visibility == "visible" else False)
+        db_user = User.get_or_create(user.id, ctx.guild_id)
+        User.set_visible_by_discord_id(user.id, True if visibility == "visible" else False, ctx.guild_id)
         await ctx.followup.send(f"Visibility updated! NY Noir user #{db_user.id} ({user.name}) has been set to {visibility}")
     elif user_id:
         db_user = User.get_by_id(user_id)
-        if db_user:
+        if db_user and db_user.guild_id == ctx.guild_id:
             User.set_visible(user_id, True if visibility == "visible" else False)
             user = await bot.fetch_user(db_user.discord_id)
             await ctx.followup.send(f"Visibility updated! NY Noir user #{db_user.id} ({user.name}) has been set to {visibility}")
@@ -259,23 +448,23 @@ async def set_visibility(ctx, visibility, user: Optional[discord.User], user_id:
         await ctx.followup.send("Either `user` or `user_id` must be provided")
 
 
-@bot.slash_command(name="set_user_privs", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="set_user_privs", guild_ids=GUILD_IDS)
 @option("user_privs", choices=["user", "bot admin"], description="The privileges this user has to this Bot")
 @option("user", discord.User, description="The user to set the admin status of, if they are a member of the server", required=False)
 @option("user_id", type=int, min_value=0, description="The NY Noir ID of the user (from /users) to set the admin status of", required=False)
 async def set_user_privs(ctx, user_privs, user: Optional[discord.User], user_id: Optional[int]):
     await ctx.response.defer(ephemeral=True)
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.followup.send("You are not authorized to perform this action")
         return
     if user:
-        db_user = User.get_or_create(user.id)
-        User.set_admin_by_discord_id(user.id, True if user_privs == "bot admin" else False)
+        db_user = User.get_or_create(user.id, ctx.guild_id)
+        User.set_admin_by_discord_id(user.id, True if user_privs == "bot admin" else False, ctx.guild_id)
         await ctx.followup.send(f"Privileges updated! NY Noir user #{db_user.id} ({user.name}) has been set to {user_privs}")
     elif user_id:
         db_user = User.get_by_id(user_id)
-        if db_user:
+        if db_user and db_user.guild_id == ctx.guild_id:
             User.set_admin(user_id, True if user_privs == "bot admin" else False)
             user = await bot.fetch_user(db_user.discord_id)
             await ctx.followup.send(f"Privileges updated! NY Noir user #{db_user.id} ({user.name}) has been set to {user_privs}")
@@ -284,7 +473,7 @@ async def set_user_privs(ctx, user_privs, user: Optional[discord.User], user_id:
     else:
         await ctx.followup.send("Either `user` or `user_id` must be provided")
 
-@bot.slash_command(name="users", guild_ids=[config.DISCORD_SERVER_ID])
+@bot.slash_command(name="users", guild_ids=GUILD_IDS)
 @option("user_type", choices=["all", "user", "bot admin"], description="The type of users to show")
 @option("page",
         type=int,
@@ -294,7 +483,7 @@ async def set_user_privs(ctx, user_privs, user: Optional[discord.User], user_id:
 )
 async def users(ctx, user_type, page=1):
     await ctx.response.defer(ephemeral=True)
-    calling_user = User.get_or_create(ctx.author.id)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
     if not calling_user.is_admin:
         await ctx.followup.send("You are not authorized to perform this action")
         return
@@ -304,6 +493,112 @@ async def users(ctx, user_type, page=1):
     elif user_type == "bot admin":
         admin = True
     try:
-        await ctx.followup.send(embed=await generate_users_embed(page, admin=admin), view=UserPaginationButtons())
+        await ctx.followup.send(embed=await generate_users_embed(page, admin=admin, guild_id=ctx.guild_id), view=UserPaginationButtons())
     except PaginationError as e:
         await ctx.followup.send(e.message)
+
+
+@bot.slash_command(name="export", guild_ids=GUILD_IDS)
+@option("record_type",
+        choices=list(export.RECORD_TYPES),
+        description="The type of record to export")
+@option("file_format",
+        choices=["CSV", "JSONL"],
+        description="The file format to export as")
+@option("user",
+        type=discord.User,
+        description="Only export records for this user",
+        required=False)
+@option("admin_user",
+        type=discord.User,
+        description="Only export Admin Transactions performed by this admin",
+        required=False)
+@option("start_date",
+        description="Only export records on or after this date (YYYY-MM-DD, UTC)",
+        required=False)
+@option("end_date",
+        description="Only export records on or before this date (YYYY-MM-DD, UTC)",
+        required=False)
+async def export_records(ctx, record_type, file_format, user: discord.User = None, admin_user: discord.User = None,
+                         start_date: str = None, end_date: str = None):
+    await ctx.response.defer(ephemeral=True)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
+    if not calling_user.is_admin:
+        await ctx.followup.send("You are not authorized to perform this action")
+        return
+    try:
+        start = datetime.datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.datetime.fromisoformat(end_date) + datetime.timedelta(days=1) if end_date else None
+    except ValueError:
+        await ctx.followup.send("Dates must be given as `YYYY-MM-DD`")
+        return
+    user_id = User.get_or_create(user.id, ctx.guild_id).id if user else None
+    admin_id = User.get_or_create(admin_user.id, ctx.guild_id).id if admin_user else None
+    try:
+        spool, row_count = await asyncio.to_thread(export.write_export, record_type, file_format, user_id=user_id,
+                                                   admin_id=admin_id, start=start, end=end,
+                                                   guild_id=ctx.guild_id)
+    except ValueError as e:
+        await ctx.followup.send(str(e))
+        return
+    with spool:
+        size = spool.seek(0, io.SEEK_END)
+        spool.seek(0)
+        if ctx.guild and size > ctx.guild.filesize_limit:
+            await ctx.followup.send(f"The export of {row_count} records is {size // 1024} KiB, larger than this "
+                                    f"server's upload limit. Narrow it down with a user or date range.")
+            return
+        filename = f"{record_type.lower().replace(' ', '_')}.{file_format.lower()}"
+        await ctx.followup.send(f"Exported {row_count} records", file=discord.File(spool, filename=filename))
+
+
+@bot.slash_command(name="guild_settings", guild_ids=GUILD_IDS)
+@option("earning_review_channel", discord.TextChannel, description="Channel Earning Submissions are reviewed in",
+        required=False)
+@option("spending_review_channel", discord.TextChannel, description="Channel Spending Submissions are reviewed in",
+        required=False)
+@option("earning_approved_channel", discord.TextChannel,
+        description="Channel approved Earning Submissions are posted to", required=False)
+@option("spending_approved_channel", discord.TextChannel,
+        description="Channel approved Spending Submissions are posted to", required=False)
+@option("thread_parent_channel", discord.TextChannel,
+        description="Channel submission threads are opened in, when the bot uses threads", required=False)
+async def guild_settings(ctx, earning_review_channel: discord.TextChannel = None,
+                         spending_review_channel: discord.TextChannel = None,
+                         earning_approved_channel: discord.TextChannel = None,
+                         spending_approved_channel: discord.TextChannel = None,
+                         thread_parent_channel: discord.TextChannel = None):
+    await ctx.response.defer(ephemeral=True)
+    calling_user = User.get_or_create(ctx.author.id, ctx.guild_id)
+    if not calling_user.is_admin and not ctx.author.guild_permissions.manage_guild:
+        await ctx.followup.send("You are not authorized to perform this action")
+        return
+    options = {  # config name -> (option name, channel given)
+        "EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID": ("earning_review_channel", earning_review_channel),
+        "SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID": ("spending_review_channel", spending_review_channel),
+        "EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID": ("earning_approved_channel", earning_approved_channel),
+        "SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID": ("spending_approved_channel", spending_approved_channel),
+        "SUBMISSION_THREAD_PARENT_CHANNEL_ID": ("thread_parent_channel", thread_parent_channel),
+    }
+    channel_ids = {name: channel.id for name, (_, channel) in options.items() if channel is not None}
+    if channel_ids:
+        # A server is only served with all of its channels set, so refuse settings that would leave some out
+        settings = {**GuildSettings.get(ctx.guild_id), **channel_ids}
+        missing = [options[name][0] for name in discord_bot.channels.configured_names() if settings[name] is None]
+        if missing:
+            await ctx.followup.send("All of the server's channels have to be set, also provide "
+                                    + ", ".join(f"`{option}`" for option in missing),
+                                    embed=await generate_guild_settings_embed(ctx.guild_id))
+            return
+        first_setup = not GuildSettings.is_set_up(ctx.guild_id)
+        await write_in_thread(GuildSettings.set, ctx.guild_id, channel_ids)
+        await write_in_thread(CacheVersion.ensure, [ctx.guild_id])
+        if first_setup:
+            # Nobody is a bot admin in a new server yet, so whoever sets it up becomes the first
+            User.set_admin(calling_user.id, True)
+        try:
+            await discord_bot.channels.resolve_guild(ctx.guild_id)
+        except ConfigurationError as e:
+            await ctx.followup.send(str(e), embed=await generate_guild_settings_embed(ctx.guild_id))
+            return
+    await ctx.followup.send(embed=await generate_guild_settings_embed(ctx.guild_id))
@@ -1,14 +1,53 @@
-DB_DIALECT = "mysql+pymysql://"  # Leave as-is unless you know what you're doing
+DB_DIALECT = "mysql+pymysql://"  # Leave as-is unless you know what you're doing, use "sqlite:///" to run on a local file
 DB_HOST = "dbhost"  # The hostname of the database server, include :port if necessary
-DB_NAME = "dbname"  # The name of the database on the server
+DB_NAME = "dbname"  # The name of the database on the server, or the path to the database file for SQLite
 DB_USER = "dbuser"  # A user with read/write access to the database
 DB_PASS = "password"  # The password to the user
+DB_REPLICA_HOSTS = []  # Hostnames of read replicas of DB_HOST, read-only commands are spread across them when set
+DB_READ_YOUR_WRITES_SECONDS = 10  # How long a user's reads stay on DB_HOST after a posting to their balance, to outlast replica lag
 
 DISCORD_APP_ID = "0000000000000000000"  # The Discord App ID to run as
 DISCORD_PUBLIC_KEY = "0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef"  # The Bot Public Key
 DISCORD_TOKEN = "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"  # The Bot Token
 DISCORD_SERVER_ID = 000000000000000000  # The ID of the Discord Server to run on
+DISCORD_EXTRA_SERVER_IDS = []  # IDs of further Discord Servers to run on, each set up by its admins with /guild_settings
+DISCORD_MEMBERS_INTENT = False  # Needed for /bulk_admin_transaction by role, also enable "Server Members Intent" for the bot in the Discord Developer Portal
+DISCORD_SHARD_COUNT = None  # Gateway shards across all bot processes, None to run one unsharded bot
+DISCORD_SHARD_IDS = None  # The shards this process runs, e.g. [0, 1, 2, 3], None for all of them; main.py --shards overrides it
 EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID = 0000000000000000000  # The ID of a channel to use for Earning Submissions Review
 SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID = 0000000000000000000  # The ID of a channel to use for Spending Submissions Review
 EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID = 0000000000000000000  # The ID of a channel to use for posting Approved Earning Submissions
 SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID = 0000000000000000000  # The ID of a channel to use for posting Approved Spending Submissions
+SUBMISSION_WORKSPACE = "channel"  # "channel" gives each submission its own channel, "thread" a private thread in the channel below
+SUBMISSION_THREAD_PARENT_CHANNEL_ID = 0000000000000000000  # The ID of the channel submission threads are opened in, in "thread" mode
+
+RECONCILE_INTERVAL_MINUTES = 15  # How often balances are checked against the transaction log in the background
+RECONCILE_REPAIR = False  # Whether the background check corrects balances that do not match the transaction log
+LEADERBOARD_SNAPSHOT_INTERVAL_MINUTES = 60  # How often to check whether today's leaderboard snapshot has been taken
+LEADERBOARD_INDEX_ENABLED = False  # Serve /leaderboard and /rank from an in-memory index instead of the database
+LEADERBOARD_INDEX_RECONCILE_MINUTES = 10  # How often the in-memory leaderboard index is reloaded from the database
+LEADERBOARD_INDEX_SYNC_SECONDS = 5  # How often the leaderboard index picks up postings made by other bot processes
+SUBMISSION_DRAFT_TTL_HOURS = 72  # Unsubmitted submission channels idle for longer than this are deleted, or archived in "thread" mode
+SUBMISSION_REAPER_INTERVAL_MINUTES = 30  # How often to look for abandoned submission drafts
+SUBMISSION_REAPER_BATCH_SIZE = 50  # Most channels of each submission type deleted per run
+SUBMISSION_REAPER_DELETE_DELAY_SECONDS = 1.0  # Pause between channel deletions to stay clear of Discord's rate limits
+SUBMISSION_CATEGORY_COLLAPSE_INTERVAL_MINUTES = 60  # How often empty overflow submissions-N categories are deleted
+SUBMISSION_CHANNEL_POOL_SIZE = 5  # Hidden submission channels kept ready ahead of time, 0 to always create them on demand
+SUBMISSION_CHANNEL_POOL_REFILL_SECONDS = 15  # How often the submission channel pool is topped back up
+OUTBOUND_MAX_CONCURRENCY = 8  # Most queued Discord calls (DMs, canon posts, channel deletes) in flight at once
+OUTBOUND_MAX_ATTEMPTS = 4  # Attempts at a queued Discord call that keeps getting a 429 or a server error
+OUTBOUND_RETRY_BASE_SECONDS = 0.5  # Backoff before the first retry of a queued Discord call, doubling each attempt
+OUTBOX_POLL_SECONDS = 10  # How often the outbox of approval DMs, canon posts and cleanups is checked for due entries
+OUTBOX_WORKERS = 4  # Outbox entries delivered at once
+OUTBOX_BATCH_SIZE = 20  # Outbox entries claimed per database round trip
+OUTBOX_LEASE_SECONDS = 300  # How long a claimed outbox entry is left alone before it is assumed lost and claimed again
+OUTBOX_MAX_ATTEMPTS = 8  # Attempts before an outbox entry is dead-lettered
+OUTBOX_RETRY_BASE_SECONDS = 5  # Wait before retrying a failed outbox entry, doubling each attempt
+OUTBOX_RETRY_MAX_SECONDS = 900  # Longest wait between outbox retries
+OUTBOUND_EFFECT_TIMEOUT_SECONDS = 30  # Longest a single DM, post or channel cleanup may run once started before it counts as failed
+GUILD_SETTINGS_CACHE_SECONDS = 300  # How long a server's /guild_settings are cached before being read from the database again
+LEADER_LEASE_SECONDS = 60  # How long the bot process running the background jobs can go unheard before another takes over
+LEADER_LEASE_RENEW_SECONDS = 15  # How often the leader renews its lease, and the other processes try to take it
+CACHE_VERSION_POLL_SECONDS = 2  # How often each bot process checks for changes to cached users and leaderboards made elsewhere
+USER_CACHE_ENABLED = False  # Keep users in memory between interactions, dropped whenever a balance, visibility or admin flag changes
+LEADERBOARD_PAGE_CACHE_SECONDS = 0  # How long a rendered /leaderboard page is reused while the standings are unchanged, 0 to not reuse them
@@ -1,8 +1,111 @@
-from sqlalchemy import create_engine
+"""Database engines: the primary, which takes every write, and any read replicas listed in DB_REPLICA_HOSTS.
 
-from config import DB_DIALECT, DB_USER, DB_PASS, DB_HOST, DB_NAME
+Read-only model methods take their engine from get_read_engine(). It hands out the replicas in turn, except for reads
+that must see a write that may not have replicated yet:
 
+- the rest of a task, such as an interaction, that has committed a write to the primary,
+- reads of a user's data for DB_READ_YOUR_WRITES_SECONDS after a posting to their balance,
+- anything inside primary_reads().
 
-def get_engine():
-    engine = create_engine(f"{DB_DIALECT}{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}?charset=utf8mb4")
+A write run with asyncio.to_thread records itself in the thread's copy of the task's context, so async code runs
+writes with write_in_thread() instead, which records them in the awaiting task.
+"""
+import asyncio
+import contextvars
+import itertools
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+
+from settings import config
+
+PRUNE_POSTED_AT = 10000  # Users remembered before those past DB_READ_YOUR_WRITES_SECONDS are dropped
+
+_engines = {}
+_replica_turn = itertools.count()
+_wrote = contextvars.ContextVar("wrote", default=False)
+_posted_at = {}  # user id -> time.monotonic() of the last posting to their balance committed by this process
+
+
+def get_engine_url(host=None):
+    if config.DB_DIALECT.startswith("sqlite"):
+        return f"{config.DB_DIALECT}{config.DB_NAME}"
+    host = host or config.DB_HOST
+    return f"{config.DB_DIALECT}{config.DB_USER}:{config.DB_PASS}@{host}/{config.DB_NAME}?charset=utf8mb4"
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def _get_engine(url):
+    engine = _engines.get(url)
+    if engine is None:
+        if url.startswith("sqlite"):
+            engine = create_engine(url)
+            event.listen(engine, "connect", set_sqlite_pragmas)
+        else:
+            engine = create_engine(url, pool_pre_ping=True, pool_recycle=3600)
+        _engines[url] = engine
     return engine
+
+
+def get_engine():
+    """The primary."""
+    return _get_engine(get_engine_url())
+
+
+def get_replica_engines():
+    # A SQLite file has no replicas
+    if config.DB_DIALECT.startswith("sqlite"):
+        return []
+    return [_get_engine(get_engine_url(host)) for host in config.DB_REPLICA_HOSTS]
+
+
+def get_read_engine(user_id=None):
+    """An engine for a read-only query, a replica unless the read has to see this process's own writes.
+
+    Pass the user whose data is read, so their reads go to the primary for a while after a posting to their balance.
+    """
+    replicas = get_replica_engines()
+    if not replicas or _wrote.get():
+        return get_engine()
+    posted_at = _posted_at.get(user_id)
+    if posted_at is not None and time.monotonic() - posted_at < config.DB_READ_YOUR_WRITES_SECONDS:
+        return get_engine()
+    return replicas[next(_replica_turn) % len(replicas)]
+
+
+def note_write(user_ids=()):
+    """Record a commit to the primary, and the users it posted to, for get_read_engine."""
+    _wrote.set(True)
+    now = time.monotonic()
+    if len(_posted_at) > PRUNE_POSTED_AT:
+        for user_id, posted_at in list(_posted_at.items()):
+            if now - posted_at >= config.DB_READ_YOUR_WRITES_SECONDS:
+                del _posted_at[user_id]
+    for user_id in user_ids:
+        _posted_at[user_id] = now
+
+
+async def write_in_thread(func, *args, **kwargs):
+    """asyncio.to_thread for a function that writes to the primary, noting the write in the awaiting task."""
+    result = await asyncio.to_thread(func, *args, **kwargs)
+    note_write()
+    return result
+
+
+@contextmanager
+def primary_reads():
+    """Send every read inside to the primary, for callers that need to see a write made elsewhere."""
+    token = _wrote.set(True)
+    try:
+        yield
+    finally:
+        _wrote.reset(token)
@@ -1,16 +1,56 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
 from typing import Optional
 
 import discord.utils
-from discord import NotFound, HTTPException
+from discord import NotFound, Forbidden, HTTPException, PermissionOverwrite, Permissions, ChannelType
 from discord.ext import commands
 
-import config
+from settings import config
+from discord_permissions import DP
+from exceptions import ConfigurationError
+from models import GuildSettings, guild_or_default
 
-bot = commands.Bot()
+logger = logging.getLogger(__name__)
 
 
-async def get_role_by_name(name):
-    guild = bot.get_guild(int(config.DISCORD_SERVER_ID))
+def create_bot():
+    # Only the process running shard 0 registers the slash commands with Discord
+    intents = discord.Intents.default()
+    intents.members = config.DISCORD_MEMBERS_INTENT
+    if not config.DISCORD_SHARD_COUNT:
+        return commands.Bot(intents=intents)
+    shard_ids = config.DISCORD_SHARD_IDS
+    return commands.AutoShardedBot(intents=intents, shard_count=config.DISCORD_SHARD_COUNT, shard_ids=shard_ids,
+                                   auto_sync_commands=shard_ids is None or 0 in shard_ids)
+
+
+bot = create_bot()
+
+SUBMISSIONS_CATEGORY = "submissions"
+CATEGORY_CHANNEL_LIMIT = 50  # Discord's cap on channels in one category
+POOL_CHANNEL_NAME = "submission-pool"
+
+
+def served_guild_ids():
+    guild_ids = [config.DISCORD_SERVER_ID, *config.DISCORD_EXTRA_SERVER_IDS]
+    return list(dict.fromkeys(int(guild_id) for guild_id in guild_ids))
+
+
+def local_guild_ids():
+    shard_count = getattr(bot, "shard_count", None)
+    shard_ids = getattr(bot, "shard_ids", None)
+    if not shard_count or shard_ids is None:
+        return served_guild_ids()
+    # Discord puts a guild on shard (guild_id >> 22) % shard_count
+    return [guild_id for guild_id in served_guild_ids() if (guild_id >> 22) % shard_count in shard_ids]
+
+
+async def get_role_by_name(name, guild_id=None):
+    guild = bot.get_guild(guild_or_default(guild_id))
     roles = await guild.fetch_roles()
     for role in roles:
         if role.name == name:
@@ -18,8 +58,8 @@ async def get_role_by_name(name):
     return None
 
 
-async def get_or_create_category(name):
-    guild = bot.get_guild(int(config.DISCORD_SERVER_ID))
+async def get_or_create_category(name, guild_id=None):
+    guild = bot.get_guild(guild_or_default(guild_id))
     for category in guild.categories:
         if category.name == name:
             return category
@@ -27,6 +67,370 @@ async def get_or_create_category(name):
     return category
 
 
+class CategoryShards(object):
+    # Occupancy of a guild's submissions categories, loaded once and kept current by gateway events
+
+    def __init__(self, name, limit=CATEGORY_CHANNEL_LIMIT):
+        self.name = name
+        self.limit = limit
+        self.pattern = re.compile(rf"^{re.escape(name)}(?:-(\d+))?$")
+        self.loaded = False
+        self.categories = {}  # category id -> category
+        self.channel_ids = {}  # category id -> ids of its channels
+        self.pending = {}  # category id -> channels being created in it
+        self.free = {}  # category ids with room, in shard order; a dict so picking the first one is O(1)
+        self.creating = None  # Lock so concurrent reservations only create one new shard
+
+    def shard_number(self, category):
+        match = self.pattern.match(category.name)
+        if not match:
+            return None
+        return int(match.group(1) or 1)
+
+    def load(self, guild):
+        shards = sorted((category for category in guild.categories if self.shard_number(category) is not None),
+                        key=self.shard_number)
+        for category in shards:
+            self.add(category)
+        self.loaded = True
+
+    def add(self, category):
+        self.categories[category.id] = category
+        self.channel_ids[category.id] = {channel.id for channel in category.channels}
+        self.pending[category.id] = 0
+        self._update_free(category.id)
+
+    def occupancy(self, category_id):
+        return len(self.channel_ids[category_id]) + self.pending[category_id]
+
+    def _update_free(self, category_id):
+        if self.occupancy(category_id) < self.limit:
+            self.free.setdefault(category_id, True)
+        else:
+            self.free.pop(category_id, None)
+
+    async def reserve(self, guild):
+        # The channel is counted as soon as its category is picked, so concurrent creations never overfill it
+        if not self.loaded:
+            self.load(guild)
+        if not self.free:
+            if self.creating is None:
+                self.creating = asyncio.Lock()
+            async with self.creating:
+                # Whoever held the lock may have just created a shard with room
+                if not self.free:
+                    await self._create_shard(guild)
+        category = self.categories[next(iter(self.free))]
+        self.pending[category.id] += 1
+        self._update_free(category.id)
+        return category
+
+    async def _create_shard(self, guild):
+        numbers = {self.shard_number(category) for category in self.categories.values()}
+        number = next(number for number in range(1, len(numbers) + 2) if number not in numbers)
+        category = await guild.create_category(self.name if number == 1 else f"{self.name}-{number}")
+        self.categories[category.id] = category
+        self.channel_ids[category.id] = set()
+        self.pending[category.id] = 0
+        self._update_free(category.id)
+
+    def release(self, category, channel=None):
+        if category.id not in self.categories:
+            return
+        self.pending[category.id] -= 1
+        if channel is not None:
+            self.channel_ids[category.id].add(channel.id)
+        self._update_free(category.id)
+
+    def channel_created(self, channel):
+        category_id = getattr(channel, "category_id", None)
+        if category_id in self.categories:
+            self.channel_ids[category_id].add(channel.id)
+            self._update_free(category_id)
+
+    def channel_deleted(self, channel):
+        if channel.id in self.categories:
+            self.forget(channel.id)
+            return
+        category_id = getattr(channel, "category_id", None)
+        if category_id in self.categories:
+            self.channel_ids[category_id].discard(channel.id)
+            self._update_free(category_id)
+
+    def forget(self, category_id):
+        for shard_map in (self.categories, self.channel_ids, self.pending, self.free):
+            shard_map.pop(category_id, None)
+
+    def empty_overflow(self):
+        return [category for category_id, category in self.categories.items()
+                if self.shard_number(category) != 1 and self.occupancy(category_id) == 0]
+
+
+submission_categories = {}  # guild id -> CategoryShards
+
+
+def categories_for(guild):
+    return submission_categories.setdefault(guild.id, CategoryShards(SUBMISSIONS_CATEGORY))
+
+
+THREAD_TYPES = (ChannelType.private_thread, ChannelType.public_thread)
+
+
+def is_thread(channel):
+    return channel.type in THREAD_TYPES
+
+
+def is_open_submission_channel(channel):
+    # A submission thread is closed by archiving it rather than deleting it
+    return not (is_thread(channel) and channel.archived)
+
+
+class ChannelRegistry(object):
+    # Handles for each guild's configured channels, resolved at startup and kept current by gateway events
+
+    def __init__(self):
+        self.channels = {}  # (guild id, config name) -> channel
+        self.resolved = False
+
+    @staticmethod
+    def configured_names():
+        names = ["EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID", "SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID",
+                 "EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID", "SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID"]
+        if config.SUBMISSION_WORKSPACE == "thread":
+            names.append("SUBMISSION_THREAD_PARENT_CHANNEL_ID")
+        return names
+
+    async def resolve(self, guild_ids=None):
+        # Extra guilds not set up or misconfigured are skipped; DISCORD_SERVER_ID's raise ConfigurationError
+        for guild_id in served_guild_ids() if guild_ids is None else guild_ids:
+            if not await asyncio.to_thread(GuildSettings.is_set_up, guild_id):
+                logger.info("Guild %s has not been set up with /guild_settings yet", guild_id)
+                continue
+            try:
+                await self.resolve_guild(guild_id)
+            except ConfigurationError as e:
+                if guild_id == int(config.DISCORD_SERVER_ID):
+                    raise
+                logger.error("Not serving guild %s until it is set up again with /guild_settings: %s", guild_id, e)
+        self.resolved = True
+
+    async def resolve_guild(self, guild_id):
+        problems = []
+        channel_ids = await asyncio.to_thread(GuildSettings.get, guild_id)
+        for name in self.configured_names():
+            channel_id = channel_ids[name]
+            if channel_id is None:
+                problems.append(f"{name} is not set for guild {guild_id}")
+                continue
+            try:
+                channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+            except (NotFound, Forbidden):
+                problems.append(f"{name} {channel_id} is not a channel the bot can see")
+                continue
+            if channel.guild is None or channel.guild.id != guild_id:
+                problems.append(f"{name} {channel_id} is not in guild {guild_id}")
+            elif channel.type not in (ChannelType.text, ChannelType.news):
+                problems.append(f"{name} {channel_id} is a {channel.type} channel, not a text channel")
+            else:
+                self.channels[guild_id, name] = channel
+        if problems:
+            raise ConfigurationError("Misconfigured channels in config.py or /guild_settings:\n" + "\n".join(problems))
+
+    def get(self, name, guild_id=None):
+        guild_id = guild_or_default(guild_id)
+        channel = self.channels.get((guild_id, name))
+        if channel is None:
+            # Not resolved yet, as in tools that never see on_ready; the client cache is enough then
+            channel_id = GuildSettings.get(guild_id)[name]
+            channel = bot.get_channel(channel_id) if channel_id is not None else None
+            if channel is None:
+                raise ConfigurationError(f"{name} {channel_id} for guild {guild_id} is not a channel the bot can see")
+            self.channels[guild_id, name] = channel
+        return channel
+
+    def channel_changed(self, channel):
+        for key, known in list(self.channels.items()):
+            if known.id == channel.id:
+                self.channels[key] = channel
+
+    def channel_deleted(self, channel):
+        for (guild_id, name), known in list(self.channels.items()):
+            if known.id == channel.id:
+                del self.channels[guild_id, name]
+                logger.error("Configured channel %s %s of guild %s was deleted", name, channel.id, guild_id)
+
+
+channels = ChannelRegistry()
+
+
+async def create_submission_thread(guild, name, member):
+    parent = channels.get("SUBMISSION_THREAD_PARENT_CHANNEL_ID", guild.id)
+    thread = await parent.create_thread(name=name, type=ChannelType.private_thread, invitable=False,
+                                        auto_archive_duration=10080)
+    await thread.add_user(member)
+    return thread
+
+
+def submission_overwrites(guild, member=None):
+    overwrites = {
+        guild.default_role: PermissionOverwrite.from_pair(
+            Permissions.none(),
+            Permissions.all()
+        )
+    }
+    if member is not None:
+        overwrites[member] = PermissionOverwrite.from_pair(
+            Permissions(DP.SEND_MESSAGES | DP.VIEW_CHANNEL),
+            Permissions(~(DP.SEND_MESSAGES | DP.VIEW_CHANNEL))
+        )
+    return overwrites
+
+
+async def create_text_channel_in_submissions(guild, name, overwrites):
+    shards = categories_for(guild)
+    category = await shards.reserve(guild)
+    channel = None
+    try:
+        channel = await guild.create_text_channel(name, overwrites=overwrites, category=category)
+    finally:
+        shards.release(category, channel)
+    return channel
+
+
+class SubmissionChannelPool(object):
+    # Hidden submission channels made ahead of time, found again by POOL_CHANNEL_NAME after a restart
+
+    def __init__(self, size):
+        self.size = size
+        self.channels = deque()
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_seconds = 0.0
+
+    def load(self, guild):
+        known = {channel.id for channel in self.channels}
+        self.channels.extend(channel for channel in guild.channels
+                             if channel.name == POOL_CHANNEL_NAME and channel.id not in known)
+        self.loaded = True
+
+    def claim(self):
+        if self.channels:
+            self.hits += 1
+            return self.channels.popleft()
+        self.misses += 1
+        return None
+
+    async def refill(self, guild):
+        if not self.loaded:
+            self.load(guild)
+        created = 0
+        while len(self.channels) < self.size:
+            start = time.perf_counter()
+            self.channels.append(
+                await create_text_channel_in_submissions(guild, POOL_CHANNEL_NAME, submission_overwrites(guild)))
+            self.refill_seconds += time.perf_counter() - start
+            self.refills += 1
+            created += 1
+        return created
+
+    def channel_deleted(self, channel):
+        try:
+            self.channels.remove(channel)
+        except ValueError:
+            pass
+
+    def stats(self):
+        claims = self.hits + self.misses
+        return {
+            "available": len(self.channels),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / claims, 3) if claims else None,
+            "refills": self.refills,
+            "mean_refill_ms": round(self.refill_seconds / self.refills * 1000, 3) if self.refills else None,
+        }
+
+
+submission_channel_pools = {}  # guild id -> SubmissionChannelPool
+
+
+def pool_for(guild):
+    return submission_channel_pools.setdefault(guild.id, SubmissionChannelPool(config.SUBMISSION_CHANNEL_POOL_SIZE))
+
+
+async def create_submission_channel(guild, name, member):
+    if config.SUBMISSION_WORKSPACE == "thread":
+        return await create_submission_thread(guild, name, member)
+    overwrites = submission_overwrites(guild, member)
+    pool = pool_for(guild)
+    if pool.size:
+        if not pool.loaded:
+            pool.load(guild)
+        channel = pool.claim()
+        if channel is not None:
+            try:
+                await channel.edit(name=name, overwrites=overwrites)
+                return channel
+            except NotFound:
+                pass
+            except HTTPException:
+                # The edit may or may not have been applied, so the channel cannot go back in the pool
+                logger.exception("Failed to claim pooled submission channel %s", channel.id)
+                try:
+                    await channel.delete(reason="Failed to claim pooled submission channel")
+                except HTTPException:
+                    logger.exception("Failed to delete pooled submission channel %s", channel.id)
+    return await create_text_channel_in_submissions(guild, name, overwrites)
+
+
+async def close_submission_channel(channel, reason):
+    if is_thread(channel):
+        await channel.edit(archived=True, locked=True, reason=reason)
+    else:
+        await channel.delete(reason=reason)
+
+
+async def collapse_empty_submission_categories():
+    deleted = 0
+    for shards in list(submission_categories.values()):
+        for category in shards.empty_overflow():
+            # Forget it first so no new channel is placed in it while the delete is in flight
+            shards.forget(category.id)
+            try:
+                await category.delete(reason="Empty overflow submissions category")
+                deleted += 1
+            except NotFound:
+                pass
+            except HTTPException:
+                # It is still there, so keep placing channels in it rather than losing track of it
+                logger.exception("Failed to delete empty submissions category %s", category.id)
+                shards.add(category)
+    return deleted
+
+
+def register_listeners(bot):
+    async def on_guild_channel_create(channel):
+        if channel.guild.id in submission_categories:
+            submission_categories[channel.guild.id].channel_created(channel)
+        channels.channel_changed(channel)
+
+    async def on_guild_channel_update(before, after):
+        channels.channel_changed(after)
+
+    async def on_guild_channel_delete(channel):
+        if channel.guild.id in submission_categories:
+            submission_categories[channel.guild.id].channel_deleted(channel)
+        if channel.guild.id in submission_channel_pools:
+            submission_channel_pools[channel.guild.id].channel_deleted(channel)
+        channels.channel_deleted(channel)
+
+    bot.add_listener(on_guild_channel_create)
+    bot.add_listener(on_guild_channel_update)
+    bot.add_listener(on_guild_channel_delete)
+
+
 async def get_user(id) -> Optional[discord.User]:
     user = bot.get_user(id)
     if not user:
@@ -8,3 +8,7 @@ class PaginationError(ValueError):
             self.message = f"Invalid Page: `{page}`. There are no pages of data to display."
         super().__init__(self.message)
         print(self.message)
+
+
+class ConfigurationError(Exception):
+    pass
@@ -0,0 +1,81 @@
+import csv
+import datetime
+import io
+import json
+import tempfile
+from enum import Enum
+
+from sqlalchemy import select
+
+from models import TransactionLog, AdminTransaction, EarningSubmission, SpendingSubmission, stream_rows, \
+    guild_or_default
+
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # Exports larger than this are spooled to disk instead of memory
+
+RECORD_TYPES = {
+    "Transaction Log": TransactionLog,
+    "Admin Transactions": AdminTransaction,
+    "Earning Submissions": EarningSubmission,
+    "Spending Submissions": SpendingSubmission,
+}
+
+
+def build_export_query(record_type, user_id=None, admin_id=None, start=None, end=None, guild_id=None):
+    model = RECORD_TYPES[record_type]
+    stmt = select(*model.__table__.columns).where(model.guild_id == guild_or_default(guild_id))
+    if user_id:
+        stmt = stmt.where(model.user_id == user_id)
+    if admin_id:
+        if model is not AdminTransaction:
+            raise ValueError("Only Admin Transactions can be filtered by admin")
+        stmt = stmt.where(model.admin_user_id == admin_id)
+    if start:
+        stmt = stmt.where(model.timestamp >= start)
+    if end:
+        stmt = stmt.where(model.timestamp < end)
+    return stmt.order_by(model.id)
+
+
+def serialize_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.name
+    return value
+
+
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([serialize_value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps({column: serialize_value(value) for column, value in zip(columns, row)}) + "\n"
+
+
+def write_export(record_type, file_format, user_id=None, admin_id=None, start=None, end=None, guild_id=None):
+    """Stream the guild's matching rows into a spooled temporary file, returning the file rewound and the row count."""
+    stmt = build_export_query(record_type, user_id=user_id, admin_id=admin_id, start=start, end=end, guild_id=guild_id)
+    columns = [column.name for column in stmt.selected_columns]
+    row_count = 0
+
+    def counted(rows):
+        nonlocal row_count
+        for row in rows:
+            row_count += 1
+            yield row
+
+    lines = csv_lines if file_format == "CSV" else jsonl_lines
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
+    for line in lines(columns, counted(stream_rows(stmt))):
+        spool.write(line.encode("utf-8"))
+    spool.seek(0)
+    return spool, row_count
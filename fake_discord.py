@@ -0,0 +1,422 @@
+"""In-process stand-in for the parts of discord.ext.commands.Bot the bot uses.
+
+Install it before commands.py or ui.py are imported so they bind to the fake instead of the real client:
+
+    bot = fake_discord.install(fake_discord.FakeBot(latency=0.05, rate_limit_rate=0.01))
+    import commands
+
+Every REST-backed call sleeps for the configured latency and may be rate limited. By default a 429 is retried
+transparently after retry_after, the way the library's HTTP client does it; with raise_rate_limits the 429 is raised
+as a discord.HTTPException instead. Per-route call counts, 429s and timings are kept in FakeBot.stats.
+"""
+import asyncio
+import itertools
+import random
+import sys
+import time
+from collections import defaultdict
+
+import discord
+
+from settings import config
+
+_snowflakes = itertools.count(1100000000000000000)
+
+
+def next_snowflake():
+    return next(_snowflakes)
+
+
+class FakeHTTPResponse(object):
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+class RouteStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.rate_limited = 0
+        self.total_seconds = 0.0
+
+    def as_dict(self):
+        return {"calls": self.calls, "rate_limited": self.rate_limited,
+                "total_seconds": round(self.total_seconds, 6)}
+
+
+class FakeRole(object):
+    def __init__(self, name, id=None):
+        self.id = id if id is not None else next_snowflake()
+        self.name = name
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+
+class FakeUser(object):
+    def __init__(self, bot, id, name=None):
+        self._bot = bot
+        self.id = int(id)
+        self.name = name or f"user{id}"
+        self.discriminator = "0"
+        self.avatar = None
+        self.bot = False
+        self.mention = f"<@{self.id}>"
+        self.jump_url = f"https://discord.com/users/{self.id}"
+        self.dm_channel = None
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    async def send(self, content=None, **kwargs):
+        if self.dm_channel is None:
+            await self._bot.request("POST /users/@me/channels")
+            self.dm_channel = FakeTextChannel(self._bot, None, f"dm-{self.id}")
+        return await self.dm_channel.send(content, **kwargs)
+
+
+class FakeMessage(object):
+    def __init__(self, bot, channel, content=None, embed=None, embeds=None, view=None, author=None, files=None):
+        self._bot = bot
+        self.id = next_snowflake()
+        self.channel = channel
+        self.content = content or ""
+        self.embeds = list(embeds or []) + ([embed] if embed else [])
+        self.view = view
+        self.author = author
+        self.files = list(files or [])
+        self.deleted = False
+
+    async def delete(self, reason=None):
+        await self._bot.request("DELETE /channels/{channel_id}/messages/{message_id}")
+        self.deleted = True
+
+
+class FakeTextChannel(object):
+    type = discord.ChannelType.text
+
+    def __init__(self, bot, guild, name, category=None, overwrites=None, id=None):
+        self._bot = bot
+        self.id = id if id is not None else next_snowflake()
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.category_id = category.id if category else None
+        self.overwrites = dict(overwrites or {})
+        self.messages = []
+        self.mention = f"<#{self.id}>"
+        self.deleted = False
+
+    @property
+    def last_message(self):
+        return self.messages[-1] if self.messages else None
+
+    async def send(self, content=None, embed=None, embeds=None, view=None, file=None, files=None):
+        await self._bot.request("POST /channels/{channel_id}/messages")
+        message = FakeMessage(self._bot, self, content, embed=embed, embeds=embeds, view=view,
+                              files=([file] if file else []) + list(files or []))
+        self.messages.append(message)
+        return message
+
+    async def delete_messages(self, messages, reason=None):
+        await self._bot.request("POST /channels/{channel_id}/messages/bulk-delete")
+        for message in messages:
+            message.deleted = True
+            if message in self.messages:
+                self.messages.remove(message)
+
+    async def delete(self, reason=None):
+        await self._bot.request("DELETE /channels/{channel_id}")
+        self.deleted = True
+        self._bot.channels.pop(self.id, None)
+        if self.guild:
+            self.guild.remove_channel(self)
+        self._bot.dispatch("guild_channel_delete", self)
+
+    async def edit(self, name=None, overwrites=None, reason=None, **kwargs):
+        await self._bot.request("PATCH /channels/{channel_id}")
+        if name is not None:
+            self.name = name
+        if overwrites is not None:
+            self.overwrites = dict(overwrites)
+        return self
+
+    async def create_thread(self, name, type=None, invitable=True, auto_archive_duration=None, **kwargs):
+        await self._bot.request("POST /channels/{channel_id}/threads")
+        thread = FakeThread(self._bot, self, name, type or discord.ChannelType.public_thread)
+        self._bot.channels[thread.id] = thread
+        return thread
+
+
+class FakeThread(FakeTextChannel):
+    def __init__(self, bot, parent, name, type):
+        super().__init__(bot, parent.guild, name)
+        self.parent = parent
+        self.type = type
+        self.members = []
+        self.archived = False
+        self.locked = False
+
+    async def add_user(self, user):
+        await self._bot.request("PUT /channels/{channel_id}/thread-members/{user_id}")
+        self.members.append(user)
+
+    async def edit(self, archived=None, locked=None, reason=None, **kwargs):
+        await self._bot.request("PATCH /channels/{channel_id}")
+        if archived is not None:
+            self.archived = archived
+        if locked is not None:
+            self.locked = locked
+        return self
+
+    async def send(self, *args, **kwargs):
+        # Sending to an archived thread that is not locked unarchives it
+        if self.locked:
+            raise discord.Forbidden(FakeHTTPResponse(403, "Forbidden"), {"message": "Thread is locked", "code": 50083})
+        self.archived = False
+        return await super().send(*args, **kwargs)
+
+
+class FakeCategory(object):
+    def __init__(self, bot, guild, name):
+        self._bot = bot
+        self.id = next_snowflake()
+        self.guild = guild
+        self.name = name
+        self.channels = []
+        self.deleted = False
+
+    async def delete(self, reason=None):
+        await self._bot.request("DELETE /channels/{channel_id}")
+        self.deleted = True
+        if self in self.guild.categories:
+            self.guild.categories.remove(self)
+        self._bot.dispatch("guild_channel_delete", self)
+
+
+class FakeGuild(object):
+    def __init__(self, bot, id):
+        self._bot = bot
+        self.id = int(id)
+        self.default_role = FakeRole("@everyone", id=self.id)
+        self.roles = [self.default_role]
+        self.categories = []
+        self.channels = []
+        self.filesize_limit = 25 * 1024 * 1024
+
+    async def fetch_roles(self):
+        await self._bot.request("GET /guilds/{guild_id}/roles")
+        return list(self.roles)
+
+    async def create_category(self, name, **kwargs):
+        await self._bot.request("POST /guilds/{guild_id}/channels")
+        category = FakeCategory(self._bot, self, name)
+        self.categories.append(category)
+        return category
+
+    async def create_text_channel(self, name, overwrites=None, category=None, **kwargs):
+        await self._bot.request("POST /guilds/{guild_id}/channels")
+        channel = self._bot.add_channel(name, guild=self, category=category, overwrites=overwrites)
+        self._bot.dispatch("guild_channel_create", channel)
+        return channel
+
+    def remove_channel(self, channel):
+        if channel in self.channels:
+            self.channels.remove(channel)
+        if channel.category and channel in channel.category.channels:
+            channel.category.channels.remove(channel)
+
+
+class FakeInteractionResponse(object):
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        await self._interaction._bot.request("POST /interactions/{interaction_id}/{interaction_token}/callback")
+        self._done = True
+        self._interaction.first_response_at = time.perf_counter()
+
+    async def defer(self, ephemeral=False, invisible=True):
+        await self._respond()
+
+    async def send_message(self, content=None, embed=None, embeds=None, view=None, ephemeral=False, **kwargs):
+        await self._respond()
+        message = FakeMessage(self._interaction._bot, self._interaction.channel, content, embed=embed,
+                              embeds=embeds, view=view)
+        self._interaction.sent.append(message)
+        return self._interaction
+
+    async def send_modal(self, modal):
+        await self._respond()
+        self._interaction.modal = modal
+        return self._interaction
+
+
+class FakeWebhook(object):
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, embed=None, embeds=None, view=None, ephemeral=False, file=None, files=None,
+                   **kwargs):
+        await self._interaction._bot.request("POST /webhooks/{application_id}/{interaction_token}")
+        message = FakeMessage(self._interaction._bot, self._interaction.channel, content, embed=embed,
+                              embeds=embeds, view=view, files=([file] if file else []) + list(files or []))
+        self._interaction.sent.append(message)
+        return message
+
+
+class FakeInteraction(object):
+    """Serves as both a slash command ApplicationContext and a component or modal Interaction."""
+
+    def __init__(self, bot, user, channel=None, message=None, guild=None):
+        self._bot = bot
+        self.id = next_snowflake()
+        self.user = user
+        self.author = user
+        self.channel = channel
+        self.channel_id = channel.id if channel else None
+        self.message = message
+        self.guild = guild
+        self.guild_id = guild.id if guild else None
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeWebhook(self)
+        self.sent = []
+        self.modal = None
+        self.created_at = time.perf_counter()
+        self.first_response_at = None
+
+    async def respond(self, *args, **kwargs):
+        if self.response.is_done():
+            return await self.followup.send(*args, **kwargs)
+        return await self.response.send_message(*args, **kwargs)
+
+
+class FakeBot(object):
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_rate=0.0, retry_after=0.05, raise_rate_limits=False,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.raise_rate_limits = raise_rate_limits
+        self.random = random.Random(seed)
+        self.application_commands = {}
+        self.events = {}
+        self.listeners = defaultdict(list)
+        self.views = []
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+        self.stats = defaultdict(RouteStats)
+
+    async def request(self, route):
+        stats = self.stats[route]
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            while True:
+                delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+                if delay:
+                    await asyncio.sleep(delay)
+                if not self.rate_limit_rate or self.random.random() >= self.rate_limit_rate:
+                    return
+                stats.rate_limited += 1
+                if self.raise_rate_limits:
+                    raise discord.HTTPException(FakeHTTPResponse(429, "Too Many Requests"),
+                                                {"message": "You are being rate limited.", "code": 0,
+                                                 "retry_after": self.retry_after})
+                await asyncio.sleep(self.retry_after)
+        finally:
+            stats.total_seconds += time.perf_counter() - start
+
+    def slash_command(self, name=None, **kwargs):
+        def decorator(func):
+            self.application_commands[name or func.__name__] = func
+            return func
+        return decorator
+
+    def event(self, coro):
+        self.events[coro.__name__] = coro
+        return coro
+
+    def add_listener(self, func, name=None):
+        self.listeners[name or func.__name__].append(func)
+
+    def dispatch(self, event, *args):
+        """Run the listeners for a gateway event as tasks, as discord.py does, without awaiting them."""
+        for listener in self.listeners[f"on_{event}"]:
+            asyncio.ensure_future(listener(*args))
+
+    def add_view(self, view, message_id=None):
+        self.views.append(view)
+
+    def get_guild(self, id):
+        id = int(id)
+        if id not in self.guilds:
+            self.guilds[id] = FakeGuild(self, id)
+        return self.guilds[id]
+
+    def add_channel(self, name, guild=None, category=None, overwrites=None, id=None):
+        channel = FakeTextChannel(self, guild, name, category=category, overwrites=overwrites, id=id)
+        self.channels[channel.id] = channel
+        if guild:
+            guild.channels.append(channel)
+        if category:
+            category.channels.append(channel)
+        return channel
+
+    def get_channel(self, id):
+        return self.channels.get(int(id))
+
+    async def fetch_channel(self, id):
+        await self.request("GET /channels/{channel_id}")
+        channel = self.channels.get(int(id))
+        if channel is None:
+            raise discord.NotFound(FakeHTTPResponse(404, "Not Found"), {"message": "Unknown Channel", "code": 10003})
+        return channel
+
+    def get_user(self, id):
+        return self.users.get(int(id))
+
+    async def fetch_user(self, id):
+        await self.request("GET /users/{user_id}")
+        id = int(id)
+        if id not in self.users:
+            self.users[id] = FakeUser(self, id)
+        return self.users[id]
+
+    def interaction(self, user_id, channel=None, message=None, guild_id=None):
+        if int(user_id) not in self.users:
+            self.users[int(user_id)] = FakeUser(self, user_id)
+        return FakeInteraction(self, self.users[int(user_id)], channel=channel, message=message,
+                               guild=self.get_guild(guild_id or config.DISCORD_SERVER_ID))
+
+    def stats_as_dict(self):
+        return {route: stats.as_dict() for route, stats in sorted(self.stats.items())}
+
+
+def install(bot):
+    """Replace discord_bot.bot with a fake. Must run before commands or ui are first imported."""
+    for module in ("commands", "ui"):
+        if module in sys.modules:
+            raise RuntimeError(f"{module} was imported before the fake Discord client was installed")
+    import discord_bot
+    discord_bot.bot = bot
+    discord_bot.register_listeners(bot)
+    for channel_id in {config.EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID, config.SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID,
+                       config.EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID, config.SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID,
+                       config.SUBMISSION_THREAD_PARENT_CHANNEL_ID}:
+        bot.add_channel(f"configured-{channel_id}", guild=bot.get_guild(config.DISCORD_SERVER_ID), id=channel_id)
+    return bot
@@ -0,0 +1,99 @@
+"""Offline import of opening balances and historic ledger entries.
+
+Reads CSV or JSONL rows with a discord_id, a judgement_points amount and an optional ISO timestamp, and posts each as
+a transaction_log entry in file order, creating users as needed. Opening balances are imported the same way, as a
+single entry per user. Rows are inserted in chunks, one bounded DB transaction per chunk, and the number of rows done is committed
+with each chunk so an interrupted import resumes where it stopped when run again:
+
+    python import_ledger.py balances.csv
+    python import_ledger.py history.jsonl --chunk-size 10000
+
+Once every row is in, user.judgement_points is checked against the ledger in a single aggregate pass.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+
+from db import get_engine
+from models import User, TransactionLog, JobState, LedgerBalance
+
+
+def read_rows(path, file_format):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if file_format == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def parse_row(row, line_number, default_timestamp):
+    try:
+        discord_id = str(int(str(row["discord_id"]).strip().strip("<@!>")))
+        judgement_points = int(row["judgement_points"])
+        timestamp = row.get("timestamp")
+        timestamp = datetime.datetime.fromisoformat(timestamp) if timestamp else default_timestamp
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Row {line_number}: {row!r} is not a valid ledger row ({e})")
+    return discord_id, judgement_points, timestamp
+
+
+def import_chunk(chunk, job_name, rows_done, guild_id=None):
+    engine = get_engine()
+    with engine.begin() as conn:
+        user_ids = User.get_or_create_many(conn, (discord_id for discord_id, _, _ in chunk), guild_id=guild_id)
+        TransactionLog.post_many(conn, [{"user_id": user_ids[discord_id], "judgement_points": judgement_points,
+                                         "timestamp": timestamp} for discord_id, judgement_points, timestamp in chunk])
+        JobState.set(job_name, rows_done, conn=conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import balances or historic ledger rows into the NY Noir bot")
+    parser.add_argument("path", help="CSV or JSONL file with discord_id, judgement_points and optional timestamp")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows inserted per DB transaction")
+    parser.add_argument("--job-name", help="Checkpoint name, defaults to one derived from the file name")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and import from the start")
+    parser.add_argument("--guild-id", type=int, help="The guild to import into, defaults to DISCORD_SERVER_ID")
+    args = parser.parse_args(argv)
+
+    file_format = args.format or ("jsonl" if args.path.lower().endswith((".jsonl", ".ndjson")) else "csv")
+    job_name = args.job_name or f"import:{os.path.basename(args.path)}"
+    skip = 0 if args.restart else JobState.get(job_name)
+    if skip:
+        print(f"Resuming {job_name} after {skip} rows")
+    default_timestamp = datetime.datetime.utcnow().replace(microsecond=0)
+
+    start = time.perf_counter()
+    rows_done = skip
+    chunk = []
+    for line_number, row in enumerate(read_rows(args.path, file_format), start=1):
+        if line_number <= skip:
+            continue
+        try:
+            chunk.append(parse_row(row, line_number, default_timestamp))
+        except ValueError as e:
+            print(f"{e}, stopping after {rows_done} rows. Fix the row and run again to resume.")
+            return 1
+        if len(chunk) >= args.chunk_size:
+            rows_done += len(chunk)
+            import_chunk(chunk, job_name, rows_done, guild_id=args.guild_id)
+            chunk = []
+            print(f"{rows_done} rows imported ({(rows_done - skip) / (time.perf_counter() - start):.0f} rows/s)")
+    if chunk:
+        rows_done += len(chunk)
+        import_chunk(chunk, job_name, rows_done, guild_id=args.guild_id)
+    print(f"Imported {rows_done - skip} rows in {time.perf_counter() - start:.1f}s")
+
+    checked, mismatches, _ = LedgerBalance.reconcile(repair=True)
+    print(f"Reconciled balances, {len(mismatches)} of {checked} users updated")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
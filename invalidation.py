@@ -0,0 +1,65 @@
+"""Invalidation of in-process caches when the data behind them changes, whichever process or tool changed it.
+
+Writes bump the changed topic's (guild_id, topic) row of the cache_version table in their own transaction, see
+models.queue_invalidation. The writing process invalidates its caches as that transaction commits, and every bot process
+polls the table every CACHE_VERSION_POLL_SECONDS and invalidates the caches of any version it has not seen yet, which
+also catches a read that raced the commit. Caches register a callback per topic with listen().
+"""
+import threading
+
+from settings import config
+
+STANDINGS = "standings"  # Balances, and users joining a guild's leaderboard
+VISIBILITY = "visibility"  # Users hidden from or shown on the leaderboard
+ADMINS = "admins"  # Admin flags
+TOPICS = (STANDINGS, VISIBILITY, ADMINS)
+
+_listeners = {}  # topic -> callbacks taking the guild id
+_versions = {}  # (guild id, topic) -> version last seen in the database
+_generations = {}  # guild id -> invalidations so far
+_polled = False
+_lock = threading.Lock()
+
+
+def enabled():
+    """Whether any cache that needs invalidating is turned on. Every process shares the settings, so with none on there
+    is nothing to bump or poll."""
+    return bool(config.LEADERBOARD_INDEX_ENABLED or config.USER_CACHE_ENABLED or config.LEADERBOARD_PAGE_CACHE_SECONDS)
+
+
+def listen(topic, callback):
+    """Call callback(guild_id) whenever topic changes in a guild."""
+    _listeners.setdefault(topic, []).append(callback)
+
+
+def generation(guild_id):
+    """Changes whenever any of the guild's caches are invalidated.
+
+    Take it before reading from the database and only cache what was read if it is unchanged afterwards, so a read
+    racing an invalidation does not fill the cache with what was just invalidated.
+    """
+    return _generations.get(guild_id, 0)
+
+
+def invalidate(guild_id, topic):
+    with _lock:
+        _generations[guild_id] = _generations.get(guild_id, 0) + 1
+    for callback in _listeners.get(topic, ()):
+        callback(guild_id)
+
+
+def apply_versions(versions):
+    """Invalidate every (guild id, topic) in versions whose version has not been seen yet, returning how many were.
+
+    The first call only records the versions, nothing has been cached yet at startup.
+    """
+    global _polled
+    changed = [key for key, version in versions.items() if _versions.get(key) != version]
+    for key in changed:
+        _versions[key] = versions[key]
+        if _polled:
+            invalidate(*key)
+    if not _polled:
+        _polled = True
+        return 0
+    return len(changed)
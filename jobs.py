@@ -0,0 +1,256 @@
+"""Background jobs.
+
+Every bot process runs the jobs that look after its own guilds and in-memory state. The jobs that work on the whole
+database (balance reconciliation, leaderboard snapshots and reaping abandoned drafts) run only in the process holding
+the leader lease, and another process takes them over once a leader stops renewing it.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+
+import discord
+from discord.ext import tasks
+
+from settings import config
+import discord_bot
+import invalidation
+from db import write_in_thread
+import leaderboard_index
+import outbox
+from models import LedgerBalance, LeaderboardSnapshot, User, EarningSubmission, SpendingSubmission, GuildSettings, \
+    JobLease, CacheVersion
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEADER_LEASE = "leader"
+
+is_leader = False
+_leaderboard_index_lock = None
+
+
+@tasks.loop(minutes=config.RECONCILE_INTERVAL_MINUTES)
+async def reconcile_balances():
+    start = time.perf_counter()
+    checked, mismatches, high_water_mark = await write_in_thread(LedgerBalance.reconcile,
+                                                                 repair=config.RECONCILE_REPAIR)
+    for user_id, points, ledger_points in mismatches:
+        logger.warning("User #%s balance %s does not match ledger %s%s", user_id, points, ledger_points,
+                       ", repaired" if config.RECONCILE_REPAIR else "")
+    logger.info("Reconciled %s users up to transaction #%s in %.2fs, %s mismatched", checked, high_water_mark,
+                time.perf_counter() - start, len(mismatches))
+
+
+@reconcile_balances.error
+async def reconcile_balances_error(error):
+    logger.exception("Balance reconciliation failed", exc_info=error)
+
+
+@tasks.loop(minutes=config.LEADERBOARD_SNAPSHOT_INTERVAL_MINUTES)
+async def snapshot_leaderboard():
+    # Runs often and takes the day's snapshot the first time it runs each UTC day, so downtime at midnight is harmless
+    start = time.perf_counter()
+    stored = await write_in_thread(LeaderboardSnapshot.take)
+    if stored:
+        logger.info("Stored leaderboard snapshot of %s users in %.2fs", stored, time.perf_counter() - start)
+
+
+@snapshot_leaderboard.error
+async def snapshot_leaderboard_error(error):
+    logger.exception("Leaderboard snapshot failed", exc_info=error)
+
+
+@tasks.loop(minutes=config.LEADERBOARD_INDEX_RECONCILE_MINUTES)
+async def refresh_leaderboard_index():
+    # The first run loads the index at startup, later runs replace it with a fresh copy to correct any drift
+    start = time.perf_counter()
+    async with leaderboard_index_lock():
+        changed = await asyncio.to_thread(User.load_leaderboard_index)
+    if changed:
+        logger.warning("Leaderboard index had drifted for %s users", changed)
+    logger.info("Loaded leaderboard index in %.2fs", time.perf_counter() - start)
+
+
+@refresh_leaderboard_index.error
+async def refresh_leaderboard_index_error(error):
+    logger.exception("Leaderboard index refresh failed", exc_info=error)
+
+
+@tasks.loop(seconds=config.LEADERBOARD_INDEX_SYNC_SECONDS)
+async def sync_leaderboard_index():
+    async with leaderboard_index_lock():
+        if leaderboard_index.take_stale():
+            start = time.perf_counter()
+            await asyncio.to_thread(User.load_leaderboard_index)
+            logger.info("Reloaded leaderboard index after a visibility change in %.2fs", time.perf_counter() - start)
+        else:
+            await asyncio.to_thread(User.sync_leaderboard_index)
+
+
+@sync_leaderboard_index.error
+async def sync_leaderboard_index_error(error):
+    logger.exception("Leaderboard index sync failed", exc_info=error)
+
+
+def leaderboard_index_lock():
+    # Reloads and syncs take turns, so a sync never moves a freshly loaded index's ledger position
+    global _leaderboard_index_lock
+    if _leaderboard_index_lock is None:
+        _leaderboard_index_lock = asyncio.Lock()
+    return _leaderboard_index_lock
+
+
+@tasks.loop(minutes=config.SUBMISSION_REAPER_INTERVAL_MINUTES)
+async def reap_abandoned_submissions():
+    start = time.perf_counter()
+    idle_before = datetime.datetime.utcnow() - datetime.timedelta(hours=config.SUBMISSION_DRAFT_TTL_HOURS)
+    deleted = archived = already_gone = failed = 0
+    for model in (EarningSubmission, SpendingSubmission):
+        drafts = await asyncio.to_thread(model.get_abandoned_drafts, idle_before, config.SUBMISSION_REAPER_BATCH_SIZE)
+        reaped = []
+        for draft in drafts:
+            try:
+                channel = discord_bot.bot.get_channel(int(draft.discord_channel_id)) or \
+                    await discord_bot.bot.fetch_channel(int(draft.discord_channel_id))
+                await discord_bot.close_submission_channel(
+                    channel, reason=f"Abandoned {model.__tablename__.replace('_', ' ')} #{draft.id}")
+                if discord_bot.is_thread(channel):
+                    archived += 1
+                else:
+                    deleted += 1
+            except discord.NotFound:
+                already_gone += 1
+            except discord.HTTPException as e:
+                failed += 1
+                logger.warning("Could not close channel %s of abandoned %s #%s: %s", draft.discord_channel_id,
+                               model.__tablename__, draft.id, e)
+                if e.status == 429:
+                    break
+                continue
+            reaped.append(draft.id)
+            # Channel deletes share one rate limit bucket per guild, so space them out rather than bursting into it
+            await asyncio.sleep(config.SUBMISSION_REAPER_DELETE_DELAY_SECONDS)
+        if reaped:
+            await write_in_thread(model.mark_abandoned, reaped)
+    if deleted or archived or already_gone or failed:
+        logger.info("Reaped abandoned submission drafts in %.2fs: %s channels deleted, %s threads archived, "
+                    "%s already gone, %s failed", time.perf_counter() - start, deleted, archived, already_gone, failed)
+
+
+@reap_abandoned_submissions.error
+async def reap_abandoned_submissions_error(error):
+    logger.exception("Reaping abandoned submissions failed", exc_info=error)
+
+
+@tasks.loop(minutes=config.SUBMISSION_CATEGORY_COLLAPSE_INTERVAL_MINUTES)
+async def collapse_submission_categories():
+    start = time.perf_counter()
+    deleted = await discord_bot.collapse_empty_submission_categories()
+    if deleted:
+        logger.info("Deleted %s empty overflow submission categories in %.2fs", deleted, time.perf_counter() - start)
+
+
+@collapse_submission_categories.error
+async def collapse_submission_categories_error(error):
+    logger.exception("Collapsing submission categories failed", exc_info=error)
+
+
+@tasks.loop(seconds=config.SUBMISSION_CHANNEL_POOL_REFILL_SECONDS)
+async def refill_submission_channel_pool():
+    for guild_id in discord_bot.local_guild_ids():
+        guild = discord_bot.bot.get_guild(guild_id)
+        if guild is None or not await asyncio.to_thread(GuildSettings.is_set_up, guild_id):
+            continue
+        pool = discord_bot.pool_for(guild)
+        start = time.perf_counter()
+        created = await pool.refill(guild)
+        if created:
+            logger.info("Created %s pooled submission channels for guild %s in %.2fs, pool stats: %s", created,
+                        guild_id, time.perf_counter() - start, pool.stats())
+
+
+@refill_submission_channel_pool.error
+async def refill_submission_channel_pool_error(error):
+    logger.exception("Refilling the submission channel pool failed", exc_info=error)
+
+
+@tasks.loop(seconds=config.OUTBOX_POLL_SECONDS)
+async def deliver_outbox():
+    start = time.perf_counter()
+    delivered, failed = await outbox.drain()
+    if delivered or failed:
+        logger.info("Delivered %s outbox entries in %.2fs, %s failed", delivered, time.perf_counter() - start, failed)
+
+
+@deliver_outbox.error
+async def deliver_outbox_error(error):
+    logger.exception("Outbox delivery failed", exc_info=error)
+
+
+@tasks.loop(seconds=config.CACHE_VERSION_POLL_SECONDS)
+async def poll_cache_versions():
+    await asyncio.to_thread(CacheVersion.poll, discord_bot.local_guild_ids())
+
+
+@poll_cache_versions.before_loop
+async def before_poll_cache_versions():
+    await write_in_thread(CacheVersion.ensure, discord_bot.local_guild_ids())
+
+
+@poll_cache_versions.error
+async def poll_cache_versions_error(error):
+    logger.exception("Polling cache versions failed", exc_info=error)
+
+
+LEADER_JOBS = [reconcile_balances, snapshot_leaderboard, reap_abandoned_submissions]
+
+
+@tasks.loop(seconds=config.LEADER_LEASE_RENEW_SECONDS)
+async def hold_leadership():
+    global is_leader
+    try:
+        leader = await write_in_thread(JobLease.acquire, LEADER_LEASE, INSTANCE_ID, config.LEADER_LEASE_SECONDS)
+    except Exception:
+        # Not renewed, so the lease may lapse and another process take over
+        logger.exception("Could not renew the leader lease")
+        leader = False
+    if leader != is_leader:
+        logger.info("%s %s the leader, %s background jobs", INSTANCE_ID, "is now" if leader else "is no longer",
+                    "starting" if leader else "stopping")
+    is_leader = leader
+    for job in LEADER_JOBS:
+        if leader and not job.is_running():
+            job.start()
+        elif not leader and job.is_running():
+            job.stop()
+
+
+@hold_leadership.error
+async def hold_leadership_error(error):
+    logger.exception("Leader election failed", exc_info=error)
+
+
+def release_leadership():
+    """Hand the leader lease over straight away on shutdown, rather than after it expires."""
+    if not is_leader:
+        return
+    try:
+        JobLease.release(LEADER_LEASE, INSTANCE_ID)
+    except Exception:
+        logger.exception("Could not release the leader lease, another process will take over once it expires")
+
+
+def start_jobs():
+    jobs = [hold_leadership, collapse_submission_categories, deliver_outbox]
+    if config.SUBMISSION_CHANNEL_POOL_SIZE and config.SUBMISSION_WORKSPACE == "channel":
+        jobs.append(refill_submission_channel_pool)
+    if config.LEADERBOARD_INDEX_ENABLED:
+        jobs += [refresh_leaderboard_index, sync_leaderboard_index]
+    if invalidation.enabled():
+        jobs.append(poll_cache_versions)
+    for job in jobs:
+        if not job.is_running():
+            job.start()
@@ -0,0 +1,205 @@
+"""In-process leaderboard index, so /leaderboard and /rank can be served without querying the database.
+
+Visible users are kept sorted by (judgement_points desc, id), the same order as User.get_leaderboard, in a list of
+bounded buckets with a Fenwick tree over the bucket sizes. Point updates, rank lookups and finding the start of a page
+are O(log n), apart from the occasional bucket split or removal which rebuilds the tree.
+
+Each guild has its own index, as each has its own leaderboard. Enabled with LEADERBOARD_INDEX_ENABLED. models keeps the
+installed indexes up to date as postings and visibility changes commit. jobs.py applies postings committed by other
+processes every LEADERBOARD_INDEX_SYNC_SECONDS, reloads the indexes when invalidation.py reports a visibility change and
+reloads them every LEADERBOARD_INDEX_RECONCILE_MINUTES to catch anything missed.
+"""
+import threading
+from bisect import bisect_left, insort
+from typing import NamedTuple
+
+BUCKET_SIZE = 512
+
+
+class LeaderboardEntry(NamedTuple):
+    id: int
+    discord_id: str
+    judgement_points: int
+
+
+def sort_key(user_id, judgement_points):
+    return -judgement_points, user_id
+
+
+class LeaderboardIndex:
+    def __init__(self, rows=()):
+        """Build the index from (id, discord_id, judgement_points) rows of visible users, in any order."""
+        self._lock = threading.Lock()
+        self._entries = {row[0]: LeaderboardEntry(row[0], str(row[1]), row[2]) for row in rows}
+        keys = sorted(sort_key(entry.id, entry.judgement_points) for entry in self._entries.values())
+        self._buckets = [keys[index:index + BUCKET_SIZE] for index in range(0, len(keys), BUCKET_SIZE)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._rebuild_tree()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def get(self, user_id):
+        return self._entries.get(user_id)
+
+    def differences(self, other):
+        """How many users have a different standing, or are only present, in one of the two indexes."""
+        user_ids = self._entries.keys() | other._entries.keys()
+        return sum(1 for user_id in user_ids if self._entries.get(user_id) != other._entries.get(user_id))
+
+    def set(self, user_id, discord_id, judgement_points, visible=True):
+        """Insert, move or, for an invisible user, remove a user."""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._remove(sort_key(entry.id, entry.judgement_points))
+            if visible:
+                self._entries[user_id] = LeaderboardEntry(user_id, str(discord_id), judgement_points)
+                self._insert(sort_key(user_id, judgement_points))
+
+    def rank(self, user_id):
+        """The user's 1-based leaderboard position, or None if they are not on the leaderboard."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            key = sort_key(entry.id, entry.judgement_points)
+            index = bisect_left(self._maxes, key)
+            return self._prefix(index) + bisect_left(self._buckets[index], key) + 1
+
+    def slice(self, start, stop):
+        """Entries at leaderboard positions start to stop - 1, counting from 0."""
+        with self._lock:
+            start = max(start, 0)
+            stop = min(stop, len(self._entries))
+            if start >= stop:
+                return []
+            index, offset = self._find(start)
+            keys = []
+            while len(keys) < stop - start and index < len(self._buckets):
+                keys.extend(self._buckets[index][offset:offset + stop - start - len(keys)])
+                index += 1
+                offset = 0
+            return [self._entries[user_id] for _, user_id in keys]
+
+    def page(self, page, page_size=10):
+        return self.slice((page - 1) * page_size, page * page_size)
+
+    def _insert(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        index = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[index]
+        insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > BUCKET_SIZE * 2:
+            self._buckets[index:index + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self._maxes[index:index + 1] = [bucket[BUCKET_SIZE - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._add(index, 1)
+
+    def _remove(self, key):
+        index = bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._add(index, -1)
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+            self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        self._tree = [0] * (len(self._buckets) + 1)
+        for index, bucket in enumerate(self._buckets):
+            self._add(index, len(bucket))
+
+    def _add(self, index, delta):
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _prefix(self, index):
+        """How many entries are in the buckets before bucket index."""
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _find(self, position):
+        """The bucket holding the entry at a position, and the entry's offset within that bucket."""
+        index = 0
+        step = 1 << (len(self._tree).bit_length())
+        while step:
+            if index + step < len(self._tree) and self._tree[index + step] <= position:
+                index += step
+                position -= self._tree[index]
+            step >>= 1
+        return index, position
+
+
+_indexes = None  # guild id -> index, or None while disabled or not loaded yet
+_ledger_position = 0  # The last transaction log id whose user the indexes have caught up with
+_stale = False  # Whether a change the ledger does not show, such as a user being hidden, calls for a reload
+
+
+def installed():
+    return _indexes is not None
+
+
+def get_indexes():
+    """The installed dict of guild id -> index, or None."""
+    return _indexes
+
+
+def get_index(guild_id):
+    """The guild's installed index, or None while indexes are disabled or not loaded yet."""
+    indexes = _indexes
+    if indexes is None:
+        return None
+    # A guild nobody was visible in at load time starts out empty
+    return indexes.setdefault(guild_id, LeaderboardIndex())
+
+
+def install(indexes, ledger_position=0):
+    """Install a dict of guild id -> index, or None to go back to serving from the database."""
+    global _indexes, _ledger_position
+    _indexes = indexes
+    _ledger_position = ledger_position
+
+
+def ledger_position():
+    return _ledger_position
+
+
+def set_ledger_position(position):
+    global _ledger_position
+    _ledger_position = position
+
+
+def mark_stale(guild_id=None):
+    global _stale
+    _stale = installed()
+
+
+def take_stale():
+    """Whether the indexes were marked stale since the last call."""
+    global _stale
+    stale, _stale = _stale, False
+    return stale
+
+
+def update_user(guild_id, user_id, discord_id, judgement_points, visible=True):
+    index = get_index(guild_id)
+    if index is not None:
+        index.set(user_id, discord_id, judgement_points, visible)
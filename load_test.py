@@ -0,0 +1,196 @@
+"""Load test the interaction handlers against the fake Discord client.
+
+Drives concurrent simulated /leaderboard, /balance and earning submission approvals through the real commands.py and
+ui.py code, with the Discord API replaced by fake_discord.FakeBot. Point it at a scratch database seeded by
+benchmark.py:
+
+    python benchmark.py --sqlite bench.db --users 10000 --transactions 200000 --iterations 1
+    python load_test.py --sqlite bench.db --interactions 5000 --concurrency 500 --latency-ms 80
+
+Throughput and latency percentiles per interaction type, plus per-route Discord call counts, are written as JSON.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import sys
+import time
+import traceback
+
+import discord
+
+from settings import config
+import fake_discord
+
+ADMIN_DISCORD_ID = 990000000000000001
+KINDS = ("leaderboard", "balance", "approval")
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 3)
+
+
+def summarize(kind, latencies, first_responses, errors, elapsed):
+    return {
+        "kind": kind,
+        "completed": len(latencies),
+        "errors": errors,
+        "throughput_per_s": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": percentile(latencies, 1.0),
+        "first_response_p50_ms": percentile(first_responses, 0.50),
+        "first_response_p99_ms": percentile(first_responses, 0.99),
+    }
+
+
+def prepare_submissions(bot, count, user_ids):
+    from models import User, EarningSubmission, LocationAlignment
+
+    guild = bot.get_guild(config.DISCORD_SERVER_ID)
+    submission_ids = []
+    for index in range(count):
+        user = User.get_or_create(user_ids[index % len(user_ids)])
+        channel = bot.add_channel(f"earning-load-{index}", guild=guild)
+        submission = EarningSubmission.create(channel.id, user.id)
+        EarningSubmission.set_points_lodged(channel.id, 10)
+        EarningSubmission.set_act_summary(channel.id, "Load test act summary")
+        EarningSubmission.set_location_alignment(channel.id, LocationAlignment.NOT_APPLICABLE)
+        EarningSubmission.submit(channel.id)
+        submission_ids.append(submission.id)
+    return submission_ids
+
+
+async def run(bot, args):
+    import commands
+    import outbox
+    import ui
+    from sqlalchemy import select
+    from db import get_engine
+    from models import User
+
+    rng = random.Random(args.seed)
+    User.set_admin_by_discord_id(ADMIN_DISCORD_ID, True)
+    with get_engine().connect() as conn:
+        user_ids = [int(row.discord_id) for row in
+                    conn.execute(select(User.discord_id).order_by(User.id).limit(args.users))]
+    if not user_ids:
+        raise SystemExit("The scratch database has no users, seed it with benchmark.py first")
+    leaderboard_pages = max((User.count() + 9) // 10, 1)
+
+    weights = [args.leaderboard_weight, args.balance_weight, args.approval_weight]
+    workload = rng.choices(KINDS, weights=weights, k=args.interactions)
+    submission_ids = iter(prepare_submissions(bot, workload.count("approval"), user_ids))
+    review_channel = bot.get_channel(config.EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID)
+
+    latencies = {kind: [] for kind in KINDS}
+    first_responses = {kind: [] for kind in KINDS}
+    errors = {kind: 0 for kind in KINDS}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def leaderboard():
+        ctx = bot.interaction(rng.choice(user_ids))
+        await commands.leaderboard(ctx, rng.randint(1, min(leaderboard_pages, args.max_page)))
+        return ctx
+
+    async def balance():
+        ctx = bot.interaction(rng.choice(user_ids))
+        await commands.balance(ctx, None)
+        return ctx
+
+    async def approval():
+        message = fake_discord.FakeMessage(bot, review_channel, embeds=[
+            discord.Embed(title=f"New Earning Submission - #{next(submission_ids)}")])
+        interaction = bot.interaction(ADMIN_DISCORD_ID, channel=review_channel, message=message)
+        await ui.EarningApproveDenyButtons().approve_callback.callback(interaction)
+        return interaction
+
+    handlers = {"leaderboard": leaderboard, "balance": balance, "approval": approval}
+
+    async def drive(kind):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                interaction = await handlers[kind]()
+            except Exception:
+                errors[kind] += 1
+                if args.verbose:
+                    traceback.print_exc()
+                return
+            latencies[kind].append(time.perf_counter() - start)
+            if interaction.first_response_at:
+                first_responses[kind].append(interaction.first_response_at - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(drive(kind) for kind in workload))
+    elapsed = time.perf_counter() - start
+    # Approvals answer once the ledger commit lands, so their queued side effects are delivered outside the timings
+    flush_start = time.perf_counter()
+    delivered, failed = await outbox.flush()
+    print(f"Delivered the outbox in {time.perf_counter() - flush_start:.2f}s, {failed} failed")
+    return elapsed, [summarize(kind, latencies[kind], first_responses[kind], errors[kind], elapsed)
+                     for kind in KINDS if kind in workload]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the NY Noir bot's interaction handlers")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--db-name", help="Scratch database seeded by benchmark.py")
+    target.add_argument("--sqlite", help="Path of a scratch SQLite database file seeded by benchmark.py")
+    parser.add_argument("--interactions", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--leaderboard-weight", type=float, default=6)
+    parser.add_argument("--balance-weight", type=float, default=3)
+    parser.add_argument("--approval-weight", type=float, default=1)
+    parser.add_argument("--max-page", type=int, default=1000, help="Deepest leaderboard page to request")
+    parser.add_argument("--users", type=int, default=10000, help="How many seeded users send interactions")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Simulated Discord REST latency")
+    parser.add_argument("--jitter-ms", type=float, default=25)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Fraction of Discord REST calls answered with a 429")
+    parser.add_argument("--retry-after-ms", type=float, default=250)
+    parser.add_argument("--raise-rate-limits", action="store_true",
+                        help="Raise 429s to the handlers instead of retrying them transparently")
+    parser.add_argument("--seed", type=int, default=5541)
+    parser.add_argument("--output", default="load.json")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        config.DB_DIALECT = "sqlite:///"
+        config.DB_NAME = args.sqlite
+    elif args.db_name == config.DB_NAME:
+        parser.error("--db-name must not be the bot's configured database")
+    else:
+        config.DB_NAME = args.db_name
+
+    bot = fake_discord.install(fake_discord.FakeBot(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                                                    rate_limit_rate=args.rate_limit_rate,
+                                                    retry_after=args.retry_after_ms / 1000,
+                                                    raise_rate_limits=args.raise_rate_limits, seed=args.seed))
+    elapsed, results = asyncio.run(run(bot, args))
+    for result in results:
+        print(f"{result['kind']:<12} {result['completed']:>7} ok {result['errors']:>5} errors "
+              f"{result['throughput_per_s']:>9} /s  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms")
+    import outbound
+    report = {
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "elapsed_s": round(elapsed, 3),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("db_name", "sqlite", "output")},
+        "results": results,
+        "discord_routes": bot.stats_as_dict(),
+        "outbound": outbound.scheduler.stats(),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
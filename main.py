@@ -1,31 +1,63 @@
+import argparse
 import asyncio
+import sys
 
 from discord import Intents, PermissionOverwrite, Permissions, option
 
-import config
-from config import *
+from settings import config
 import discord
 from discord.ext import commands
 import discord_bot
+from jobs import start_jobs, release_leadership
 
 from discord_permissions import DP
+from exceptions import ConfigurationError
 from models import EarningSubmission, User, AdminTransaction, TransactionLog
 from ui import EarningPointsLodged, register_views
 
 
-def run_bot():
+def parse_shards(value):
+    """A shard id, or an inclusive range of them such as 0-3."""
+    start, _, end = value.partition("-")
+    return list(range(int(start), int(end or start) + 1))
+
+
+def run_bot(shard_ids=None):
     bot = discord_bot.bot
+    if shard_ids is not None:
+        if not config.DISCORD_SHARD_COUNT:
+            print("Set DISCORD_SHARD_COUNT in config.py to run a range of shards")
+            sys.exit(1)
+        bot.shard_ids = shard_ids
+        bot.auto_sync_commands = 0 in shard_ids
+    discord_bot.register_listeners(bot)
 
     @bot.event
     async def on_ready():
+        try:
+            # Each process looks after the guilds on its own shards
+            await discord_bot.channels.resolve(discord_bot.local_guild_ids())
+        except ConfigurationError as e:
+            print(e)
+            await bot.close()
+            return
         register_views(bot)
+        start_jobs()
         print("Bot Ready")
 
     import commands
 
-    bot.run(config.DISCORD_TOKEN)
-
+    try:
+        bot.run(config.DISCORD_TOKEN)
+    finally:
+        release_leadership()
+    if not discord_bot.channels.resolved:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    run_bot()
+    parser = argparse.ArgumentParser(description="Run the bot, or with DISCORD_SHARD_COUNT set some of its shards")
+    parser.add_argument("--shards", type=parse_shards,
+                        help="Shard id or inclusive range of them, such as 0-3, overriding DISCORD_SHARD_IDS")
+    args = parser.parse_args()
+    run_bot(args.shards)
@@ -1,83 +1,245 @@
 import datetime
+import json
 import math
+import time
+import uuid
 from enum import Enum
 from typing import Optional
 
-from sqlalchemy import Text, DateTime, ForeignKey, select, func, Connection, insert, BigInteger, update, desc
+from sqlalchemy import Text, DateTime, ForeignKey, select, func, Connection, insert, BigInteger, update, desc, case, \
+    Index, String, bindparam, and_, or_, not_, union_all, literal
+from sqlalchemy import Engine, event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.compiler import compiles
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, aliased
 from sqlalchemy.sql import expression
 
-from db import get_engine
+from settings import config
+import invalidation
+import leaderboard_index
+from db import get_engine, get_read_engine, note_write
 from exceptions import PaginationError
 
+IN_CLAUSE_CHUNK_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+OUTBOX_APPROVAL_KINDS = ("approved_dm", "close_submission_channel", "canon_post")  # Handled in outbox.py
+
+GUILD_CHANNEL_SETTINGS = {  # config.py name -> guild_settings column
+    "EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID": "earning_review_channel_id",
+    "SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID": "spending_review_channel_id",
+    "EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID": "earning_approved_channel_id",
+    "SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID": "spending_approved_channel_id",
+    "SUBMISSION_THREAD_PARENT_CHANNEL_ID": "thread_parent_channel_id",
+}
+
 
 class utcnow(expression.FunctionElement):
     type = DateTime()
     inherit_cache = True
 
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
 @compiles(utcnow, 'mysql')
 def pg_utcnow(element, compiler, **kw):
     return "UTC_TIMESTAMP()"
 
 
+class utcnow_plus(expression.FunctionElement):
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow_plus)
+def default_utcnow_plus(element, compiler, **kw):
+    return "datetime(CURRENT_TIMESTAMP, %s || ' seconds')" % compiler.process(element.clauses, **kw)
+
+
+@compiles(utcnow_plus, 'mysql')
+def mysql_utcnow_plus(element, compiler, **kw):
+    return "UTC_TIMESTAMP() + INTERVAL %s SECOND" % compiler.process(element.clauses, **kw)
+
+
+def chunked(values, size=IN_CLAUSE_CHUNK_SIZE):
+    for index in range(0, len(values), size):
+        yield values[index:index + size]
+
+
+def stream_rows(stmt, batch_size=STREAM_BATCH_SIZE):
+    engine = get_engine()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for row in result:
+            yield row
+
+
+def guild_or_default(guild_id):
+    return int(config.DISCORD_SERVER_ID if guild_id is None else guild_id)
+
+
+def queue_leaderboard_update(conn, guild_id, user_id, discord_id, judgement_points, visible):
+    if leaderboard_index.installed():
+        conn.info.setdefault("leaderboard_updates", {})[user_id] = (guild_id, discord_id, judgement_points, visible)
+
+
+def queue_invalidation(conn, guild_id, *topics):
+    # Bumped once per transaction and as late as possible, since a bump holds a guild-wide row lock
+    if not invalidation.enabled():
+        return
+    queued = conn.info.setdefault("invalidations", set())
+    for topic in topics:
+        if (guild_id, topic) not in queued:
+            CacheVersion.bump(conn, guild_id, topic)
+            queued.add((guild_id, topic))
+
+
+@event.listens_for(Engine, "commit")
+def apply_leaderboard_updates(conn):
+    # Runs just before the DB commit. A commit that then fails leaves the index ahead until its next reconcile
+    for user_id, (guild_id, *update_values) in conn.info.pop("leaderboard_updates", {}).items():
+        leaderboard_index.update_user(guild_id, user_id, *update_values)
+    # A read between here and the commit can cache the old values again, the next cache_version poll catches that
+    for guild_id, topic in conn.info.pop("invalidations", ()):
+        invalidation.invalidate(guild_id, topic)
+    # Later reads in this task, and of these users, go to the primary rather than a replica that may be behind
+    note_write(conn.info.pop("posted_users", ()))
+
+
+@event.listens_for(Engine, "rollback")
+def discard_leaderboard_updates(conn):
+    conn.info.pop("leaderboard_updates", None)
+    conn.info.pop("invalidations", None)
+    conn.info.pop("posted_users", None)
+
+
 class Base(DeclarativeBase):
     pass
 
 
 class User(Base):
+    # One per guild a member is in, each with its own balance and leaderboard standing
     __tablename__ = "user"
+    __table_args__ = (Index("ix_user_guild_id_discord_id", "guild_id", "discord_id", mysql_length={"discord_id": 32}),
+                      Index("ix_user_guild_id_visible_judgement_points", "guild_id", "visible", "judgement_points"))
     id: Mapped[int] = mapped_column(primary_key=True)
+    guild_id: Mapped[int] = mapped_column(BigInteger)
     discord_id: Mapped[str] = mapped_column(Text)
     judgement_points: Mapped[int] = mapped_column()
     visible: Mapped[bool] = mapped_column(server_default='1')
     is_admin: Mapped[bool] = mapped_column(server_default='0')
 
+    _cache = {}  # guild id -> discord id -> row, with USER_CACHE_ENABLED
+
     @classmethod
-    def get_or_create(cls, discord_id):
+    def get_or_create(cls, discord_id, guild_id=None):
         engine = get_engine()
         discord_id = str(discord_id)
-        stmt = select(User).where(User.discord_id == discord_id).limit(1)
+        guild_id = guild_or_default(guild_id)
+        if config.USER_CACHE_ENABLED:
+            cached = cls._cache.get(guild_id, {}).get(discord_id)
+            if cached is not None:
+                return cached
+        generation = invalidation.generation(guild_id)
+        stmt = select(User).where(User.guild_id == guild_id, User.discord_id == discord_id).limit(1)
         with engine.connect() as conn:
             result = conn.execute(stmt).first()
             if result:
+                cls._remember(guild_id, result, generation)
                 return result
-            stmt = insert(User).values(discord_id=discord_id, judgement_points=0)
+            stmt = insert(User).values(guild_id=guild_id, discord_id=discord_id, judgement_points=0)
             conn.execute(stmt)
+            queue_invalidation(conn, guild_id, invalidation.STANDINGS)
             conn.commit()
-            stmt = select(User).where(User.discord_id == discord_id).limit(1)
+            stmt = select(User).where(User.guild_id == guild_id, User.discord_id == discord_id).limit(1)
             result = conn.execute(stmt).first()
             if result:
+                leaderboard_index.update_user(guild_id, result.id, result.discord_id, result.judgement_points,
+                                              result.visible)
                 return result
         raise ValueError("Unable to Create User")
 
+    @classmethod
+    def _remember(cls, guild_id, user, generation):
+        if config.USER_CACHE_ENABLED and invalidation.generation(guild_id) == generation:
+            cls._cache.setdefault(guild_id, {})[user.discord_id] = user
+
+    @classmethod
+    def forget_guild(cls, guild_id):
+        cls._cache.pop(guild_id, None)
+
     @classmethod
     def get_by_id(cls, user_id):
-        engine = get_engine()
+        engine = get_read_engine(user_id)
         stmt = select(User).where(User.id == user_id).limit(1)
         with engine.connect() as conn:
             result = conn.execute(stmt).first()
             if result:
                 return result
+        if engine is not get_engine():
+            # A user created moments ago may not have reached the replica yet
+            with get_engine().connect() as conn:
+                return conn.execute(stmt).first()
         return None
 
     @classmethod
-    def get_leaderboard(cls, page=1):
-        count = cls.count()
+    def get_leaderboard(cls, page=1, guild_id=None):
+        guild_id = guild_or_default(guild_id)
+        count = cls.count(guild_id=guild_id)
         if page < 1 or math.ceil(count/10) < page:
             raise PaginationError((page, math.ceil(count/10)))
-        engine = get_engine()
-        stmt = select(User).where(User.visible == True).order_by(desc(User.judgement_points)).limit(10).offset((page - 1) * 10)
+        index = leaderboard_index.get_index(guild_id)
+        if index is not None:
+            return index.page(page)
+        engine = get_read_engine()
+        stmt = select(User).where(User.guild_id == guild_id, User.visible == True).order_by(desc(User.judgement_points), User.id).limit(10).offset((page - 1) * 10)
         with engine.connect() as conn:
-            result = conn.execute(stmt)
+            result = conn.execute(stmt).all()
             if result:
                 return result
             return []
 
     @classmethod
-    def count(cls, only_visible=True, admin=None):
+    def get_rank(cls, user, window=5):
+        # Returns the rank, the leaderboard size, the first row's place and up to window rows either side of the user
+        index = leaderboard_index.get_index(user.guild_id)
+        if index is not None:
+            rank = index.rank(user.id)
+            if rank is None:
+                return None, len(index), None, []
+            start = max(rank - 1 - window, 0)
+            return rank, len(index), start + 1, index.slice(start, rank + window)
         engine = get_engine()
-        stmt = select(func.count())
+        ranked = and_(User.guild_id == user.guild_id, User.visible == True)
+        ahead = or_(User.judgement_points > user.judgement_points,
+                    and_(User.judgement_points == user.judgement_points, User.id < user.id))
+        users_ahead = select(func.count()).select_from(User) \
+            .where(ranked, User.judgement_points > user.judgement_points).scalar_subquery()
+        tied_ahead = select(func.count()).select_from(User) \
+            .where(ranked, User.judgement_points == user.judgement_points, User.id < user.id) \
+            .scalar_subquery()
+        above = select(User.id, User.discord_id, User.judgement_points, literal(1).label("ahead")) \
+            .where(ranked, ahead).order_by(User.judgement_points, desc(User.id)).limit(window).subquery()
+        below = select(User.id, User.discord_id, User.judgement_points, literal(0).label("ahead")) \
+            .where(ranked, not_(ahead)).order_by(desc(User.judgement_points), User.id).limit(window + 1).subquery()
+        total = select(func.count()).select_from(User).where(ranked).scalar_subquery()
+        neighbours = union_all(select(above), select(below)).subquery()
+        stmt = select(neighbours, (users_ahead + tied_ahead + 1).label("rank"), total.label("total")) \
+            .order_by(desc(neighbours.c.judgement_points), neighbours.c.id)
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        if not rows or not any(row.id == user.id for row in rows):
+            return None, User.count(guild_id=user.guild_id), None, []
+        return rows[0].rank, rows[0].total, rows[0].rank - sum(row.ahead for row in rows), rows
+
+    @classmethod
+    def count(cls, only_visible=True, admin=None, guild_id=None, conn=None):
+        guild_id = guild_or_default(guild_id)
+        index = leaderboard_index.get_index(guild_id)
+        if only_visible and admin is None and index is not None:
+            return len(index)
+        stmt = select(func.count()).where(User.guild_id == guild_id)
         if only_visible:
             stmt = stmt.where(User.visible == True)
         if admin is None:
@@ -87,18 +249,17 @@ class User(Base):
         elif admin:
             stmt = stmt.where(User.is_admin == True)
         stmt = stmt.select_from(User)
+        if conn is not None:
+            return conn.execute(stmt).scalar()
+        engine = get_read_engine()
         with engine.connect() as conn:
-            result = conn.execute(stmt).first()
-            return result[0]
+            return conn.execute(stmt).scalar()
 
 
     @classmethod
-    def get_users(cls, page=1, admin=None):
-        count = cls.count(only_visible=False, admin=admin)
-        if page < 1 or math.ceil(count / 10) < page:
-            raise PaginationError((page, math.ceil(count/10)))
-        engine = get_engine()
-        stmt = select(User)
+    def get_users(cls, page=1, admin=None, guild_id=None):
+        guild_id = guild_or_default(guild_id)
+        stmt = select(User).where(User.guild_id == guild_id)
         if admin is None:
             pass
         elif admin:
@@ -106,11 +267,13 @@ class User(Base):
         else:
             stmt = stmt.where(User.is_admin == False)
         stmt = stmt.order_by(User.id).limit(10).offset((page - 1) * 10)
+        # The count and the page are read from the same replica, so they agree
+        engine = get_read_engine()
         with engine.connect() as conn:
-            result = conn.execute(stmt)
-            if result:
-                return result
-            return []
+            count = cls.count(only_visible=False, admin=admin, guild_id=guild_id, conn=conn)
+            if page < 1 or math.ceil(count / 10) < page:
+                raise PaginationError((page, math.ceil(count/10)))
+            return conn.execute(stmt).all()
 
     @classmethod
     def set_visible(cls, user_id, visible):
@@ -118,11 +281,15 @@ class User(Base):
         with engine.connect() as conn:
             stmt = update(User).where(User.id == user_id).values(visible=visible)
             conn.execute(stmt)
+            user = conn.execute(select(User.guild_id, User.discord_id, User.judgement_points)
+                                .where(User.id == user_id)).first()
+            queue_leaderboard_update(conn, user.guild_id, user_id, user.discord_id, user.judgement_points, visible)
+            queue_invalidation(conn, user.guild_id, invalidation.VISIBILITY)
             conn.commit()
 
     @classmethod
-    def set_visible_by_discord_id(cls, discord_id, visible):
-        user = User.get_or_create(discord_id)
+    def set_visible_by_discord_id(cls, discord_id, visible, guild_id=None):
+        user = User.get_or_create(discord_id, guild_id)
         cls.set_visible(user.id, visible)
 
     @classmethod
@@ -131,16 +298,88 @@ class User(Base):
         with engine.connect() as conn:
             stmt = update(User).where(User.id == user_id).values(is_admin=is_admin)
             conn.execute(stmt)
+            guild_id = conn.execute(select(User.guild_id).where(User.id == user_id)).scalar()
+            queue_invalidation(conn, guild_id, invalidation.ADMINS)
             conn.commit()
 
     @classmethod
-    def set_admin_by_discord_id(cls, discord_id, is_admin):
-        user = User.get_or_create(discord_id)
+    def set_admin_by_discord_id(cls, discord_id, is_admin, guild_id=None):
+        user = User.get_or_create(discord_id, guild_id)
         cls.set_admin(user.id, is_admin)
 
+    @classmethod
+    def load_leaderboard_index(cls):
+        engine = get_engine()
+        stmt = select(User.guild_id, User.id, User.discord_id, User.judgement_points).where(User.visible == True)
+        rows = {}
+        with engine.connect() as conn:
+            # Read first, so postings committed while the users are read are applied again by sync_leaderboard_index
+            ledger_position = conn.execute(select(func.max(TransactionLog.id))).scalar() or 0
+            for row in conn.execute(stmt):
+                rows.setdefault(row.guild_id, []).append(row[1:])
+        indexes = {guild_id: leaderboard_index.LeaderboardIndex(guild_rows) for guild_id, guild_rows in rows.items()}
+        differences = 0
+        previous = leaderboard_index.get_indexes()
+        if previous is not None:
+            for guild_id in set(indexes) | set(previous):
+                index = indexes.setdefault(guild_id, leaderboard_index.LeaderboardIndex())
+                differences += index.differences(previous.get(guild_id) or leaderboard_index.LeaderboardIndex())
+        leaderboard_index.install(indexes, ledger_position)
+        return differences
+
+    @classmethod
+    def sync_leaderboard_index(cls, limit=STREAM_BATCH_SIZE):
+        # Picks up postings committed by other bot processes and the command line tools
+        if not leaderboard_index.installed():
+            return 0
+        indexes = leaderboard_index.get_indexes()
+        after = leaderboard_index.ledger_position()
+        engine = get_engine()
+        updated = 0
+        with engine.connect() as conn:
+            while True:
+                postings = conn.execute(select(TransactionLog.id, TransactionLog.user_id)
+                                        .where(TransactionLog.id > after).order_by(TransactionLog.id).limit(limit)).all()
+                if not postings:
+                    break
+                user_ids = list(dict.fromkeys(posting.user_id for posting in postings))
+                for chunk in chunked(user_ids):
+                    stmt = select(User.guild_id, User.id, User.discord_id, User.judgement_points, User.visible) \
+                        .where(User.id.in_(chunk))
+                    for user in conn.execute(stmt):
+                        leaderboard_index.update_user(user.guild_id, user.id, user.discord_id, user.judgement_points,
+                                                      user.visible)
+                updated += len(user_ids)
+                after = postings[-1].id
+        # A reload installed meanwhile has its own, later, position
+        if leaderboard_index.get_indexes() is indexes:
+            leaderboard_index.set_ledger_position(after)
+        return updated
+
+    @classmethod
+    def get_or_create_many(cls, conn, discord_ids, guild_id=None):
+        guild_id = guild_or_default(guild_id)
+        discord_ids = list(dict.fromkeys(str(discord_id) for discord_id in discord_ids))
+        user_ids = {}
+        for chunk in chunked(discord_ids):
+            stmt = select(User.discord_id, User.id).where(User.guild_id == guild_id, User.discord_id.in_(chunk))
+            user_ids.update({row.discord_id: row.id for row in conn.execute(stmt)})
+        missing = [discord_id for discord_id in discord_ids if discord_id not in user_ids]
+        if missing:
+            conn.execute(insert(User), [{"guild_id": guild_id, "discord_id": discord_id, "judgement_points": 0}
+                                        for discord_id in missing])
+            queue_invalidation(conn, guild_id, invalidation.STANDINGS)
+            for chunk in chunked(missing):
+                stmt = select(User.discord_id, User.id).where(User.guild_id == guild_id, User.discord_id.in_(chunk))
+                user_ids.update({row.discord_id: row.id for row in conn.execute(stmt)})
+        return user_ids
+
 class TransactionLog(Base):
     __tablename__ = "transaction_log"
+    __table_args__ = (Index("ix_transaction_log_user_id_timestamp", "user_id", "timestamp"),
+                      Index("ix_transaction_log_guild_id_timestamp", "guild_id", "timestamp"))
     id: Mapped[int] = mapped_column(primary_key=True)
+    guild_id: Mapped[int] = mapped_column(BigInteger)  # The user's, so a guild's ledger is read without a join
     timestamp: Mapped[datetime.datetime] = mapped_column(server_default=utcnow())
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
     earning_submission_id: Mapped[Optional[int]] = mapped_column(ForeignKey("earning_submission.id"))
@@ -150,30 +389,125 @@ class TransactionLog(Base):
     admin_transaction_id: Mapped[Optional[int]] = mapped_column(ForeignKey("admin_transaction.id"))
     admin_transaction: Mapped["AdminTransaction"] = relationship(back_populates="transaction_record")
     judgement_points: Mapped[int] = mapped_column()
+    balance_after: Mapped[Optional[int]] = mapped_column()  # The user's balance after this posting, in timestamp order
 
     @classmethod
-    def count(cls, user_id):
-        engine = get_engine()
+    def count(cls, user_id, conn=None):
         stmt = select(func.count()).where(TransactionLog.user_id == user_id).select_from(TransactionLog)
+        if conn is not None:
+            return conn.execute(stmt).scalar()
+        engine = get_read_engine(user_id)
         with engine.connect() as conn:
-            result = conn.execute(stmt).first()
-            return result[0]
+            return conn.execute(stmt).scalar()
 
     @classmethod
     def search_by_user(cls, user_id, page=1):
-        count = cls.count(user_id)
-        if page < 1 or math.ceil(count / 10) < page:
-            raise PaginationError((page, math.ceil(count/10)))
-        engine = get_engine()
-        stmt = select(TransactionLog).where(TransactionLog.user_id == user_id).order_by(desc(TransactionLog.timestamp)).limit(10).offset((page - 1) * 10)
+        stmt = select(TransactionLog).where(TransactionLog.user_id == user_id).order_by(desc(TransactionLog.timestamp), desc(TransactionLog.id)).limit(10).offset((page - 1) * 10)
+        # The count and the page are read from the same replica, so they agree
+        engine = get_read_engine(user_id)
         with engine.connect() as conn:
-            result = conn.execute(stmt)
-            if result:
-                return result
-            return []
+            count = cls.count(user_id, conn=conn)
+            if page < 1 or math.ceil(count / 10) < page:
+                raise PaginationError((page, math.ceil(count/10)))
+            return conn.execute(stmt).all()
+
+    @classmethod
+    def balance_as_of(cls, user_id, timestamp):
+        engine = get_read_engine(user_id)
+        stmt = select(TransactionLog.balance_after) \
+            .where(TransactionLog.user_id == user_id, TransactionLog.timestamp < timestamp) \
+            .order_by(desc(TransactionLog.timestamp), desc(TransactionLog.id)).limit(1)
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar() or 0
+
+    @classmethod
+    def post(cls, conn, user_id, judgement_points, **references):
+        # Updating the balance first takes the user's row lock, so their postings are serialized
+        conn.execute(update(User).where(User.id == user_id)
+                     .values(judgement_points=User.judgement_points + judgement_points))
+        user = conn.execute(select(User.guild_id, User.judgement_points, User.discord_id, User.visible)
+                            .where(User.id == user_id)).first()
+        balance_after = user.judgement_points
+        queue_leaderboard_update(conn, user.guild_id, user_id, user.discord_id, balance_after, user.visible)
+        conn.info.setdefault("posted_users", set()).add(user_id)
+        posting = {"timestamp": datetime.datetime.utcnow().replace(microsecond=0), **references,
+                   "user_id": user_id, "judgement_points": judgement_points, "balance_after": balance_after}
+        conn.execute(insert(TransactionLog).values(guild_id=user.guild_id, **posting))
+        DailyLedgerRollup.apply(conn, [posting])
+        queue_invalidation(conn, user.guild_id, invalidation.STANDINGS)
+        return balance_after
+
+    @classmethod
+    def restate_balance_after(cls, conn, user_id, since):
+        # Running balances in timestamp order, from the first posting at or after since
+        opening = conn.execute(select(TransactionLog.balance_after)
+                               .where(TransactionLog.user_id == user_id, TransactionLog.timestamp < since)
+                               .order_by(desc(TransactionLog.timestamp), desc(TransactionLog.id)).limit(1)).scalar()
+        balance = opening or 0
+        updates = []
+        stmt = select(TransactionLog.id, TransactionLog.judgement_points, TransactionLog.balance_after) \
+            .where(TransactionLog.user_id == user_id, TransactionLog.timestamp >= since) \
+            .order_by(TransactionLog.timestamp, TransactionLog.id)
+        for row in conn.execute(stmt):
+            balance += row.judgement_points
+            if row.balance_after != balance:
+                updates.append({"txn_id": row.id, "balance": balance})
+        stmt = update(TransactionLog).where(TransactionLog.id == bindparam("txn_id")) \
+            .values(balance_after=bindparam("balance"))
+        for chunk in chunked(updates):
+            conn.execute(stmt, chunk)
 
     @classmethod
-    def create_from_earning_submission(cls, earning_submission):
+    def post_many(cls, conn, postings):
+        users = {}
+        latest_posting = select(func.max(TransactionLog.timestamp)).where(TransactionLog.user_id == User.id) \
+            .scalar_subquery()
+        for chunk in chunked(list(dict.fromkeys(posting["user_id"] for posting in postings))):
+            stmt = select(User.id, User.guild_id, User.discord_id, User.judgement_points, User.visible,
+                          latest_posting.label("latest_posting")).where(User.id.in_(chunk)).with_for_update()
+            users.update({row.id: row for row in conn.execute(stmt)})
+        balances = {user_id: row.judgement_points for user_id, row in users.items()}
+        opening = dict(balances)
+        latest = {user_id: row.latest_posting for user_id, row in users.items()}
+        backdated = {}  # user id -> earliest posting dated before one of theirs already made
+        timestamp = datetime.datetime.utcnow().replace(microsecond=0)
+        rows = []
+        for posting in postings:
+            posting.setdefault("timestamp", timestamp)
+            user_id = posting["user_id"]
+            if latest[user_id] is not None and posting["timestamp"] < latest[user_id]:
+                backdated[user_id] = min(backdated.get(user_id, posting["timestamp"]), posting["timestamp"])
+            else:
+                latest[user_id] = posting["timestamp"]
+            balances[posting["user_id"]] += posting["judgement_points"]
+            posting["balance_after"] = balances[posting["user_id"]]
+            rows.append({"earning_submission_id": None, "spending_submission_id": None, "admin_transaction_id": None,
+                         "guild_id": users[posting["user_id"]].guild_id, **posting})
+        for chunk in chunked(rows):
+            conn.execute(insert(TransactionLog), chunk)
+        for user_id, since in backdated.items():
+            cls.restate_balance_after(conn, user_id, since)
+        net_by_user = {user_id: balance - opening[user_id] for user_id, balance in balances.items()}
+        for chunk in chunked(list(net_by_user)):
+            stmt = update(User).where(User.id.in_(chunk)).values(
+                judgement_points=User.judgement_points + case({user_id: net_by_user[user_id] for user_id in chunk},
+                                                              value=User.id, else_=0))
+            conn.execute(stmt)
+        DailyLedgerRollup.apply(conn, postings)
+        for user_id, balance in balances.items():
+            queue_leaderboard_update(conn, users[user_id].guild_id, user_id, users[user_id].discord_id, balance,
+                                     users[user_id].visible)
+        for guild_id in {user.guild_id for user in users.values()}:
+            queue_invalidation(conn, guild_id, invalidation.STANDINGS)
+        conn.info.setdefault("posted_users", set()).update(balances)
+        return postings
+
+    @classmethod
+    def create_from_earning_submission(cls, earning_submission, conn=None):
+        if conn is None:
+            engine = get_engine()
+            with engine.begin() as conn:
+                return cls.create_from_earning_submission(earning_submission, conn=conn)
         e = earning_submission
         points_lodged = e.points_lodged
         alignment = e.location_alignment
@@ -182,40 +516,23 @@ class TransactionLog(Base):
             points_result *= 1.5
         elif alignment == LocationAlignment.IN_CONTRAVENTION:
             points_result *= 2
-        engine = get_engine()
-        with engine.connect() as conn:
-            stmt = insert(TransactionLog).values(user_id=e.user_id, earning_submission_id=e.id, judgement_points=points_result)
-            conn.execute(stmt)
-            user = User.get_by_id(user_id=e.user_id)
-            stmt = update(User).where(User.id == e.user_id).values(judgement_points=user.judgement_points+points_result)
-            conn.execute(stmt)
-            conn.commit()
+        cls.post(conn, e.user_id, points_result, earning_submission_id=e.id)
 
     @classmethod
     def create_from_admin_transaction(cls, admin_transaction):
         a = admin_transaction
-        net_points = a.net_points
         engine = get_engine()
-        with engine.connect() as conn:
-            stmt = insert(TransactionLog).values(user_id=a.user_id, admin_transaction_id=a.id, judgement_points=net_points)
-            conn.execute(stmt)
-            user = User.get_by_id(user_id=a.user_id)
-            stmt = update(User).where(User.id == a.user_id).values(judgement_points=user.judgement_points+net_points)
-            conn.execute(stmt)
-            conn.commit()
+        with engine.begin() as conn:
+            cls.post(conn, a.user_id, a.net_points, admin_transaction_id=a.id)
 
     @classmethod
-    def create_from_spending_submission(cls, spending_submission):
+    def create_from_spending_submission(cls, spending_submission, conn=None):
+        if conn is None:
+            engine = get_engine()
+            with engine.begin() as conn:
+                return cls.create_from_spending_submission(spending_submission, conn=conn)
         s = spending_submission
-        net_points = -s.cost
-        engine = get_engine()
-        with engine.connect() as conn:
-            stmt = insert(TransactionLog).values(user_id=s.user_id, spending_submission_id=s.id, judgement_points=net_points)
-            conn.execute(stmt)
-            user = User.get_by_id(user_id=s.user_id)
-            stmt = update(User).where(User.id == s.user_id).values(judgement_points=user.judgement_points+net_points)
-            conn.execute(stmt)
-            conn.commit()
+        cls.post(conn, s.user_id, -s.cost, spending_submission_id=s.id)
 
 
 class LocationAlignment(Enum):
@@ -226,7 +543,11 @@ class LocationAlignment(Enum):
 
 class EarningSubmission(Base):
     __tablename__ = "earning_submission"
+    __table_args__ = (Index("ix_earning_submission_guild_id_submitted_approved_timestamp", "guild_id", "submitted", "approved",
+                            "timestamp"),
+                      Index("ix_earning_submission_submitted_updated_at", "submitted", "updated_at"))
     id: Mapped[int] = mapped_column(primary_key=True)
+    guild_id: Mapped[int] = mapped_column(BigInteger)
     discord_channel_id: Mapped[str] = mapped_column(Text)
     timestamp: Mapped[datetime.datetime] = mapped_column(server_default=utcnow())
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
@@ -236,8 +557,50 @@ class EarningSubmission(Base):
     submitted: Mapped[bool] = mapped_column(default=False)
     approved: Mapped[Optional[bool]] = mapped_column()
     denied_reason: Mapped[Optional[str]] = mapped_column(Text)
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+    abandoned: Mapped[bool] = mapped_column(server_default='0')  # Draft whose channel was deleted for being idle
     transaction_record: Mapped["TransactionLog"] = relationship(back_populates="earning_submission")
 
+    @classmethod
+    def get_abandoned_drafts(cls, idle_before, limit=50):
+        engine = get_engine()
+        stmt = select(EarningSubmission.id, EarningSubmission.discord_channel_id) \
+            .where(EarningSubmission.submitted == False, EarningSubmission.abandoned == False, EarningSubmission.updated_at < idle_before) \
+            .order_by(EarningSubmission.updated_at).limit(limit)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    @classmethod
+    def mark_abandoned(cls, submission_ids):
+        engine = get_engine()
+        with engine.connect() as conn:
+            stmt = update(EarningSubmission).where(EarningSubmission.id.in_(submission_ids)).values(abandoned=True)
+            conn.execute(stmt)
+            conn.commit()
+
+    @classmethod
+    def count_pending_review(cls, guild_id=None):
+        engine = get_engine()
+        stmt = select(func.count()).select_from(EarningSubmission) \
+            .where(EarningSubmission.guild_id == guild_or_default(guild_id), EarningSubmission.submitted == True, EarningSubmission.approved.is_(None))
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    @classmethod
+    def get_review_queue(cls, after=None, limit=10, guild_id=None):
+        engine = get_engine()
+        stmt = select(EarningSubmission.id, EarningSubmission.timestamp, EarningSubmission.points_lodged, EarningSubmission.discord_channel_id,
+                      User.discord_id).join(User, User.id == EarningSubmission.user_id) \
+            .where(EarningSubmission.guild_id == guild_or_default(guild_id), EarningSubmission.submitted == True, EarningSubmission.approved.is_(None))
+        if after:
+            # Keyset on (timestamp, id), reading the cursor's timestamp in SQL so it compares exactly as stored
+            timestamp = select(EarningSubmission.timestamp).where(EarningSubmission.id == after).scalar_subquery()
+            stmt = stmt.where(or_(EarningSubmission.timestamp > timestamp,
+                                  and_(EarningSubmission.timestamp == timestamp, EarningSubmission.id > after)))
+        stmt = stmt.order_by(EarningSubmission.timestamp, EarningSubmission.id).limit(limit)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
     @classmethod
     def get_next_id(cls):
         engine = get_engine()
@@ -249,10 +612,10 @@ class EarningSubmission(Base):
         return 1
 
     @classmethod
-    def create(cls, discord_channel_id, user_id):
+    def create(cls, discord_channel_id, user_id, guild_id=None):
         engine = get_engine()
         with engine.connect() as conn:
-            stmt = insert(EarningSubmission).values(discord_channel_id=str(discord_channel_id), user_id=user_id)
+            stmt = insert(EarningSubmission).values(guild_id=guild_or_default(guild_id), discord_channel_id=str(discord_channel_id), user_id=user_id)
             result = conn.execute(stmt)
             conn.commit()
             stmt = select(EarningSubmission).where(EarningSubmission.id == result.inserted_primary_key[0]).limit(1)
@@ -312,6 +675,19 @@ class EarningSubmission(Base):
             conn.execute(stmt)
             conn.commit()
 
+    @classmethod
+    def approve_and_post(cls, submission):
+        # Returns False, changing nothing, if the submission was already approved
+        engine = get_engine()
+        with engine.begin() as conn:
+            stmt = update(EarningSubmission).where(EarningSubmission.id == submission.id, EarningSubmission.approved.is_not(True)) \
+                .values(approved=True, denied_reason=None)
+            if conn.execute(stmt).rowcount == 0:
+                return False
+            TransactionLog.create_from_earning_submission(submission, conn=conn)
+            Outbox.enqueue_approval(conn, EarningSubmission.__tablename__, submission.id, submission.guild_id)
+        return True
+
     @classmethod
     def deny(cls, submission_id, reason):
         engine = get_engine()
@@ -331,7 +707,11 @@ class EarningSubmission(Base):
 
 class SpendingSubmission(Base):
     __tablename__ = "spending_submission"
+    __table_args__ = (Index("ix_spending_submission_guild_id_submitted_approved_timestamp", "guild_id", "submitted", "approved",
+                            "timestamp"),
+                      Index("ix_spending_submission_submitted_updated_at", "submitted", "updated_at"))
     id: Mapped[int] = mapped_column(primary_key=True)
+    guild_id: Mapped[int] = mapped_column(BigInteger)
     discord_channel_id: Mapped[str] = mapped_column(Text)
     timestamp: Mapped[datetime.datetime] = mapped_column(server_default=utcnow())
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
@@ -345,8 +725,50 @@ class SpendingSubmission(Base):
     submitted: Mapped[bool] = mapped_column(default=False)
     approved: Mapped[Optional[bool]] = mapped_column()  # Whether the Submission was Approved
     denied_reason: Mapped[Optional[str]] = mapped_column(Text)
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+    abandoned: Mapped[bool] = mapped_column(server_default='0')  # Draft whose channel was deleted for being idle
     transaction_record: Mapped["TransactionLog"] = relationship(back_populates="spending_submission")
 
+    @classmethod
+    def get_abandoned_drafts(cls, idle_before, limit=50):
+        engine = get_engine()
+        stmt = select(SpendingSubmission.id, SpendingSubmission.discord_channel_id) \
+            .where(SpendingSubmission.submitted == False, SpendingSubmission.abandoned == False, SpendingSubmission.updated_at < idle_before) \
+            .order_by(SpendingSubmission.updated_at).limit(limit)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    @classmethod
+    def mark_abandoned(cls, submission_ids):
+        engine = get_engine()
+        with engine.connect() as conn:
+            stmt = update(SpendingSubmission).where(SpendingSubmission.id.in_(submission_ids)).values(abandoned=True)
+            conn.execute(stmt)
+            conn.commit()
+
+    @classmethod
+    def count_pending_review(cls, guild_id=None):
+        engine = get_engine()
+        stmt = select(func.count()).select_from(SpendingSubmission) \
+            .where(SpendingSubmission.guild_id == guild_or_default(guild_id), SpendingSubmission.submitted == True, SpendingSubmission.approved.is_(None))
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    @classmethod
+    def get_review_queue(cls, after=None, limit=10, guild_id=None):
+        engine = get_engine()
+        stmt = select(SpendingSubmission.id, SpendingSubmission.timestamp, SpendingSubmission.cost, SpendingSubmission.discord_channel_id,
+                      User.discord_id).join(User, User.id == SpendingSubmission.user_id) \
+            .where(SpendingSubmission.guild_id == guild_or_default(guild_id), SpendingSubmission.submitted == True, SpendingSubmission.approved.is_(None))
+        if after:
+            # Keyset on (timestamp, id), reading the cursor's timestamp in SQL so it compares exactly as stored
+            timestamp = select(SpendingSubmission.timestamp).where(SpendingSubmission.id == after).scalar_subquery()
+            stmt = stmt.where(or_(SpendingSubmission.timestamp > timestamp,
+                                  and_(SpendingSubmission.timestamp == timestamp, SpendingSubmission.id > after)))
+        stmt = stmt.order_by(SpendingSubmission.timestamp, SpendingSubmission.id).limit(limit)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
     @classmethod
     def get_next_id(cls):
         engine = get_engine()
@@ -358,10 +780,10 @@ class SpendingSubmission(Base):
         return 1
 
     @classmethod
-    def create(cls, discord_channel_id, user_id):
+    def create(cls, discord_channel_id, user_id, guild_id=None):
         engine = get_engine()
         with engine.connect() as conn:
-            stmt = insert(SpendingSubmission).values(discord_channel_id=str(discord_channel_id), user_id=user_id)
+            stmt = insert(SpendingSubmission).values(guild_id=guild_or_default(guild_id), discord_channel_id=str(discord_channel_id), user_id=user_id)
             result = conn.execute(stmt)
             conn.commit()
             stmt = select(SpendingSubmission).where(SpendingSubmission.id == result.inserted_primary_key[0]).limit(1)
@@ -445,6 +867,19 @@ class SpendingSubmission(Base):
             conn.execute(stmt)
             conn.commit()
 
+    @classmethod
+    def approve_and_post(cls, submission):
+        # Returns False, changing nothing, if the submission was already approved
+        engine = get_engine()
+        with engine.begin() as conn:
+            stmt = update(SpendingSubmission).where(SpendingSubmission.id == submission.id, SpendingSubmission.approved.is_not(True)) \
+                .values(approved=True, denied_reason=None)
+            if conn.execute(stmt).rowcount == 0:
+                return False
+            TransactionLog.create_from_spending_submission(submission, conn=conn)
+            Outbox.enqueue_approval(conn, SpendingSubmission.__tablename__, submission.id, submission.guild_id)
+        return True
+
     @classmethod
     def deny(cls, submission_id, reason):
         engine = get_engine()
@@ -463,7 +898,9 @@ class SpendingSubmission(Base):
 
 class AdminTransaction(Base):
     __tablename__ = "admin_transaction"
+    __table_args__ = (Index("ix_admin_transaction_guild_id_timestamp", "guild_id", "timestamp"),)
     id: Mapped[int] = mapped_column(primary_key=True)
+    guild_id: Mapped[int] = mapped_column(BigInteger)
     timestamp: Mapped[datetime.datetime] = mapped_column(server_default=utcnow())
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
     admin_user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
@@ -472,51 +909,639 @@ class AdminTransaction(Base):
     transaction_record: Mapped["TransactionLog"] = relationship(back_populates="admin_transaction")
 
     @classmethod
-    def count(cls, user_id=None, admin_id=None):
-        engine = get_engine()
-        stmt = select(func.count())
+    def count(cls, user_id=None, admin_id=None, guild_id=None, conn=None):
+        stmt = select(func.count()).where(AdminTransaction.guild_id == guild_or_default(guild_id))
         if user_id:
             stmt = stmt.where(AdminTransaction.user_id == user_id)
         if admin_id:
             stmt = stmt.where(AdminTransaction.admin_user_id == admin_id)
         stmt = stmt.select_from(AdminTransaction)
+        if conn is not None:
+            return conn.execute(stmt).scalar()
+        engine = get_read_engine(user_id)
         with engine.connect() as conn:
-            result = conn.execute(stmt).first()
-        return result[0]
+            return conn.execute(stmt).scalar()
 
     @classmethod
-    def create(cls, user_id, admin_user_id, net_points, reason):
+    def create(cls, user_id, admin_user_id, net_points, reason, guild_id=None):
         engine = get_engine()
         with engine.connect() as conn:
-            stmt = insert(AdminTransaction).values(user_id=user_id, admin_user_id=admin_user_id, net_points=net_points, reason=reason)
+            stmt = insert(AdminTransaction).values(guild_id=guild_or_default(guild_id), user_id=user_id, admin_user_id=admin_user_id, net_points=net_points, reason=reason)
             result = conn.execute(stmt)
             conn.commit()
             return result.inserted_primary_key[0]
 
     @classmethod
-    def get_by_id(cls, transaction_id):
+    def create_bulk(cls, admin_user_id, adjustments, reason, guild_id=None):
+        # Adjustments are (discord_id, "+"/"-"/"=", amount), applied in order in one transaction
+        if not adjustments:
+            return []
         engine = get_engine()
+        guild_id = guild_or_default(guild_id)
+        timestamp = datetime.datetime.utcnow().replace(microsecond=0)
+        discord_ids = list(dict.fromkeys(str(discord_id) for discord_id, _, _ in adjustments))
+        with engine.begin() as conn:
+            users = {}
+            for chunk in chunked(discord_ids):
+                stmt = select(User.id, User.discord_id, User.judgement_points) \
+                    .where(User.guild_id == guild_id, User.discord_id.in_(chunk))
+                users.update({row.discord_id: row for row in conn.execute(stmt.with_for_update())})
+            missing = [discord_id for discord_id in discord_ids if discord_id not in users]
+            if missing:
+                conn.execute(insert(User), [{"guild_id": guild_id, "discord_id": discord_id, "judgement_points": 0}
+                                            for discord_id in missing])
+                for chunk in chunked(missing):
+                    stmt = select(User.id, User.discord_id, User.judgement_points) \
+                        .where(User.guild_id == guild_id, User.discord_id.in_(chunk))
+                    users.update({row.discord_id: row for row in conn.execute(stmt)})
+
+            balances = {discord_id: row.judgement_points for discord_id, row in users.items()}
+            rows = []
+            for discord_id, action, amount in adjustments:
+                discord_id = str(discord_id)
+                if action == "+":
+                    net_points = amount
+                elif action == "-":
+                    net_points = -amount
+                else:
+                    net_points = amount - balances[discord_id]
+                balances[discord_id] += net_points
+                rows.append({"guild_id": guild_id, "user_id": users[discord_id].id, "admin_user_id": admin_user_id,
+                             "net_points": net_points, "reason": reason, "timestamp": timestamp,
+                             "discord_id": discord_id, "balance": balances[discord_id]})
+
+            # MySQL has no RETURNING, so insert row by row to learn each new id
+            for row in rows:
+                result = conn.execute(insert(AdminTransaction).values(
+                    **{key: row[key] for key in ("guild_id", "user_id", "admin_user_id", "net_points", "reason",
+                                                 "timestamp")}))
+                row["admin_transaction_id"] = result.inserted_primary_key[0]
+
+            TransactionLog.post_many(conn, [{"user_id": row["user_id"], "judgement_points": row["net_points"],
+                                             "admin_transaction_id": row["admin_transaction_id"],
+                                             "timestamp": timestamp} for row in rows])
+        return [(row["discord_id"], row["admin_transaction_id"], row["net_points"], row["balance"]) for row in rows]
+
+    @classmethod
+    def get_by_id(cls, transaction_id):
+        engine = get_read_engine()
+        stmt = select(AdminTransaction).where(AdminTransaction.id == transaction_id).limit(1)
         with engine.connect() as conn:
-            stmt = select(AdminTransaction).where(AdminTransaction.id == transaction_id).limit(1)
-            return conn.execute(stmt).first()
+            result = conn.execute(stmt).first()
+        if result is None and engine is not get_engine():
+            # Not replicated yet, if it was only just made
+            with get_engine().connect() as conn:
+                result = conn.execute(stmt).first()
+        return result
 
     @classmethod
-    def search(cls, target=None, admin=None, page=1):
-        count = cls.count(user_id=target.id if target else None, admin_id=admin.id if admin else None)
-        if page < 1 or math.ceil(count / 10) < page:
-            raise PaginationError((page, math.ceil(count/10)))
-        engine = get_engine()
-        stmt = select(AdminTransaction)
+    def search(cls, target=None, admin=None, page=1, guild_id=None):
+        guild_id = guild_or_default(guild_id)
+        stmt = select(AdminTransaction).where(AdminTransaction.guild_id == guild_id)
         if target:
             stmt = stmt.where(AdminTransaction.user_id == target.id)
         if admin:
             stmt = stmt.where(AdminTransaction.admin_user_id == admin.id)
         stmt = stmt.order_by(desc(AdminTransaction.timestamp)).limit(10).offset((page - 1) * 10)
+        # The count and the page are read from the same replica, so they agree
+        engine = get_read_engine(target.id if target else None)
         with engine.connect() as conn:
-            result = conn.execute(stmt)
-            if result:
-                return result
-            return []
+            count = cls.count(user_id=target.id if target else None, admin_id=admin.id if admin else None,
+                              guild_id=guild_id, conn=conn)
+            if page < 1 or math.ceil(count / 10) < page:
+                raise PaginationError((page, math.ceil(count/10)))
+            return conn.execute(stmt).all()
+
+
+class LedgerBalance(Base):
+    # Each user's transaction log sum up to the reconciliation high-water mark
+    __tablename__ = "ledger_balance"
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    ledger_points: Mapped[int] = mapped_column(BigInteger)
+
+    job_name = "reconcile_balances"
+
+    @classmethod
+    def reconcile(cls, full=False, repair=False):
+        # Repairs add the difference found rather than set the balance, so postings made meanwhile are kept
+        engine = get_engine()
+        with engine.begin() as conn:
+            high_water_mark = 0 if full else JobState.get(cls.job_name, conn=conn)
+            new_high_water_mark = conn.execute(select(func.max(TransactionLog.id))).scalar() or 0
+            stmt = select(TransactionLog.user_id, func.sum(TransactionLog.judgement_points)) \
+                .where(TransactionLog.id > high_water_mark, TransactionLog.id <= new_high_water_mark) \
+                .group_by(TransactionLog.user_id)
+            deltas = {row[0]: int(row[1]) for row in conn.execute(stmt)}
+
+            totals = {}
+            if full:
+                conn.execute(LedgerBalance.__table__.delete())
+            else:
+                for chunk in chunked(list(deltas)):
+                    stmt = select(LedgerBalance.user_id, LedgerBalance.ledger_points) \
+                        .where(LedgerBalance.user_id.in_(chunk))
+                    totals.update({row.user_id: row.ledger_points for row in conn.execute(stmt)})
+            updates = [{"uid": user_id, "delta": delta} for user_id, delta in deltas.items() if user_id in totals]
+            inserts = [{"user_id": user_id, "ledger_points": delta} for user_id, delta in deltas.items()
+                       if user_id not in totals]
+            stmt = update(LedgerBalance).where(LedgerBalance.user_id == bindparam("uid")) \
+                .values(ledger_points=LedgerBalance.ledger_points + bindparam("delta"))
+            for chunk in chunked(updates):
+                conn.execute(stmt, chunk)
+            for chunk in chunked(inserts):
+                conn.execute(insert(LedgerBalance), chunk)
+            for user_id, delta in deltas.items():
+                totals[user_id] = totals.get(user_id, 0) + delta
+
+            balances = {}
+            if full:
+                balances = {row.id: row.judgement_points for row in conn.execute(select(User.id, User.judgement_points))}
+            else:
+                for chunk in chunked(list(deltas)):
+                    stmt = select(User.id, User.judgement_points).where(User.id.in_(chunk))
+                    balances.update({row.id: row.judgement_points for row in conn.execute(stmt)})
+            mismatches = [(user_id, points, totals.get(user_id, 0)) for user_id, points in balances.items()
+                          if points != totals.get(user_id, 0)]
+
+            if repair and mismatches:
+                stmt = update(User).where(User.id == bindparam("uid")) \
+                    .values(judgement_points=User.judgement_points + bindparam("correction"))
+                for chunk in chunked([{"uid": user_id, "correction": ledger_points - points}
+                                      for user_id, points, ledger_points in mismatches]):
+                    conn.execute(stmt, chunk)
+                guild_ids = set()
+                for chunk in chunked([user_id for user_id, _, _ in mismatches]):
+                    guild_ids.update(conn.execute(select(User.guild_id).where(User.id.in_(chunk)).distinct()).scalars())
+                for guild_id in guild_ids:
+                    queue_invalidation(conn, guild_id, invalidation.STANDINGS)
+            JobState.set(cls.job_name, new_high_water_mark, conn=conn)
+        return len(balances), mismatches, new_high_water_mark
+
+
+class DailyLedgerRollup(Base):
+    # Per user and UTC day; admin transactions and imported entries count as admin_adjusted
+    __tablename__ = "daily_ledger_rollup"
+    __table_args__ = (Index("ix_daily_ledger_rollup_day", "day"),)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    earned: Mapped[int] = mapped_column(BigInteger, server_default='0')
+    spent: Mapped[int] = mapped_column(BigInteger, server_default='0')
+    admin_adjusted: Mapped[int] = mapped_column(BigInteger, server_default='0')
+    transaction_count: Mapped[int] = mapped_column(server_default='0')
+
+    @classmethod
+    def apply(cls, conn, postings):
+        # Callers hold the posting users' row locks, so a daily row cannot be created twice concurrently
+        deltas = {}
+        for posting in postings:
+            key = (posting["user_id"], posting["timestamp"].date())
+            earned, spent, admin_adjusted, count = deltas.get(key, (0, 0, 0, 0))
+            if posting.get("earning_submission_id"):
+                earned += posting["judgement_points"]
+            elif posting.get("spending_submission_id"):
+                spent -= posting["judgement_points"]
+            else:
+                admin_adjusted += posting["judgement_points"]
+            deltas[key] = (earned, spent, admin_adjusted, count + 1)
+        if not deltas:
+            return
+
+        days = [day for _, day in deltas]
+        existing = set()
+        for chunk in chunked(list({user_id for user_id, _ in deltas})):
+            stmt = select(DailyLedgerRollup.user_id, DailyLedgerRollup.day) \
+                .where(DailyLedgerRollup.user_id.in_(chunk), DailyLedgerRollup.day.between(min(days), max(days)))
+            existing.update((row.user_id, row.day) for row in conn.execute(stmt))
+        updates = [{"uid": user_id, "d": day, "e": earned, "s": spent, "a": admin_adjusted, "c": count}
+                   for (user_id, day), (earned, spent, admin_adjusted, count) in deltas.items()
+                   if (user_id, day) in existing]
+        inserts = [{"user_id": user_id, "day": day, "earned": earned, "spent": spent, "admin_adjusted": admin_adjusted,
+                    "transaction_count": count}
+                   for (user_id, day), (earned, spent, admin_adjusted, count) in deltas.items()
+                   if (user_id, day) not in existing]
+        stmt = update(DailyLedgerRollup) \
+            .where(DailyLedgerRollup.user_id == bindparam("uid"), DailyLedgerRollup.day == bindparam("d")) \
+            .values(earned=DailyLedgerRollup.earned + bindparam("e"), spent=DailyLedgerRollup.spent + bindparam("s"),
+                    admin_adjusted=DailyLedgerRollup.admin_adjusted + bindparam("a"),
+                    transaction_count=DailyLedgerRollup.transaction_count + bindparam("c"))
+        for chunk in chunked(updates):
+            conn.execute(stmt, chunk)
+        for chunk in chunked(inserts):
+            conn.execute(insert(DailyLedgerRollup), chunk)
+
+    @classmethod
+    def rebuild(cls):
+        engine = get_engine()
+        earning = TransactionLog.earning_submission_id.is_not(None)
+        spending = TransactionLog.spending_submission_id.is_not(None)
+        stmt = select(TransactionLog.user_id, func.date(TransactionLog.timestamp),
+                      func.sum(case((earning, TransactionLog.judgement_points), else_=0)),
+                      func.sum(case((spending, -TransactionLog.judgement_points), else_=0)),
+                      func.sum(case((earning | spending, 0), else_=TransactionLog.judgement_points)),
+                      func.count()) \
+            .group_by(TransactionLog.user_id, func.date(TransactionLog.timestamp))
+        with engine.begin() as conn:
+            conn.execute(DailyLedgerRollup.__table__.delete())
+            conn.execute(insert(DailyLedgerRollup).from_select(["user_id", "day", "earned", "spent", "admin_adjusted",
+                                                                "transaction_count"], stmt))
+
+    @classmethod
+    def totals(cls, user_id=None, start=None, end=None, guild_id=None):
+        # Days from start up to but excluding end, for the user or else the whole guild
+        engine = get_engine()
+        stmt = select(func.coalesce(func.sum(DailyLedgerRollup.earned), 0).label("earned"),
+                      func.coalesce(func.sum(DailyLedgerRollup.spent), 0).label("spent"),
+                      func.coalesce(func.sum(DailyLedgerRollup.admin_adjusted), 0).label("admin_adjusted"),
+                      func.coalesce(func.sum(DailyLedgerRollup.transaction_count), 0).label("transaction_count"),
+                      func.count(func.distinct(DailyLedgerRollup.user_id)).label("active_users"))
+        stmt = cls._filter(stmt, user_id=user_id, start=start, end=end,
+                           guild_id=None if user_id else guild_or_default(guild_id))
+        with engine.connect() as conn:
+            return conn.execute(stmt).first()
+
+    @classmethod
+    def top_earners(cls, start=None, end=None, limit=10, guild_id=None):
+        engine = get_engine()
+        earned = func.sum(DailyLedgerRollup.earned).label("earned")
+        stmt = select(User.id, User.discord_id, earned).join(User, User.id == DailyLedgerRollup.user_id) \
+            .where(User.guild_id == guild_or_default(guild_id), User.visible == True).group_by(User.id, User.discord_id).having(earned > 0) \
+            .order_by(desc(earned), User.id).limit(limit)
+        stmt = cls._filter(stmt, start=start, end=end)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    @staticmethod
+    def _filter(stmt, user_id=None, start=None, end=None, guild_id=None):
+        if user_id:
+            stmt = stmt.where(DailyLedgerRollup.user_id == user_id)
+        if guild_id is not None:
+            stmt = stmt.where(DailyLedgerRollup.user_id.in_(select(User.id).where(User.guild_id == guild_id)))
+        if start:
+            stmt = stmt.where(DailyLedgerRollup.day >= start)
+        if end:
+            stmt = stmt.where(DailyLedgerRollup.day < end)
+        return stmt
+
+
+class LeaderboardSnapshot(Base):
+    __tablename__ = "leaderboard_snapshot"
+    __table_args__ = (Index("ix_leaderboard_snapshot_guild_id_day_rank", "guild_id", "day", "rank", unique=True),
+                      Index("ix_leaderboard_snapshot_user_id_day", "user_id", "day"))
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    guild_id: Mapped[int] = mapped_column(BigInteger)
+    rank: Mapped[int] = mapped_column()
+    judgement_points: Mapped[int] = mapped_column(BigInteger)
+
+    @classmethod
+    def take(cls, day=None):
+        day = day or datetime.datetime.utcnow().date()
+        engine = get_engine()
+        with engine.begin() as conn:
+            taken = list(conn.execute(select(LeaderboardSnapshot.guild_id).where(LeaderboardSnapshot.day == day)
+                                      .distinct()).scalars())
+            stmt = select(User.guild_id, User.id, User.judgement_points).where(User.visible == True,
+                                                                                 User.guild_id.not_in(taken)) \
+                .order_by(User.guild_id, desc(User.judgement_points), User.id)
+            ranks = {}
+            rows = []
+            for row in conn.execute(stmt):
+                ranks[row.guild_id] = rank = ranks.get(row.guild_id, 0) + 1
+                rows.append({"day": day, "guild_id": row.guild_id, "user_id": row.id, "rank": rank,
+                             "judgement_points": row.judgement_points})
+            for chunk in chunked(rows):
+                conn.execute(insert(LeaderboardSnapshot), chunk)
+        return len(rows)
+
+    @classmethod
+    def nearest_day(cls, day, guild_id=None):
+        engine = get_engine()
+        stmt = select(func.max(LeaderboardSnapshot.day)) \
+            .where(LeaderboardSnapshot.guild_id == guild_or_default(guild_id), LeaderboardSnapshot.day <= day)
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    @classmethod
+    def first_day(cls, guild_id=None):
+        engine = get_engine()
+        stmt = select(func.min(LeaderboardSnapshot.day)).where(LeaderboardSnapshot.guild_id == guild_or_default(guild_id))
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    @classmethod
+    def count(cls, day, guild_id=None):
+        engine = get_engine()
+        stmt = select(func.count()).select_from(LeaderboardSnapshot) \
+            .where(LeaderboardSnapshot.guild_id == guild_or_default(guild_id), LeaderboardSnapshot.day == day)
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+    @classmethod
+    def get_movement(cls, start_day, end_day, page=1, guild_id=None):
+        guild_id = guild_or_default(guild_id)
+        count = cls.count(end_day, guild_id=guild_id)
+        if page < 1 or math.ceil(count / 10) < page:
+            raise PaginationError((page, math.ceil(count / 10)))
+        engine = get_engine()
+        previous = aliased(LeaderboardSnapshot)
+        stmt = select(LeaderboardSnapshot.rank, LeaderboardSnapshot.judgement_points, User.discord_id,
+                      previous.rank.label("previous_rank"), previous.judgement_points.label("previous_points")) \
+            .join(User, User.id == LeaderboardSnapshot.user_id) \
+            .outerjoin(previous, and_(previous.user_id == LeaderboardSnapshot.user_id, previous.day == start_day)) \
+            .where(LeaderboardSnapshot.guild_id == guild_id, LeaderboardSnapshot.day == end_day) \
+            .order_by(LeaderboardSnapshot.rank).limit(10).offset((page - 1) * 10)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    @classmethod
+    def get_user_history(cls, user_id, start_day):
+        engine = get_engine()
+        stmt = select(LeaderboardSnapshot.day, LeaderboardSnapshot.rank, LeaderboardSnapshot.judgement_points) \
+            .where(LeaderboardSnapshot.user_id == user_id, LeaderboardSnapshot.day >= start_day) \
+            .order_by(LeaderboardSnapshot.day)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+
+class OutboxStatus(Enum):
+    PENDING = 0
+    DONE = 1
+    DEAD = 2
+
+
+class Outbox(Base):
+    # Discord side effects of committed changes, written in the same transaction and delivered by outbox.py
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_status_next_attempt_at", "status", "next_attempt_at"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    idempotency_key: Mapped[str] = mapped_column(String(191), unique=True)
+    kind: Mapped[str] = mapped_column(String(64))
+    payload: Mapped[str] = mapped_column(Text)  # JSON arguments for the kind's handler
+    guild_id: Mapped[Optional[int]] = mapped_column(BigInteger)  # Delivered by a process running the guild's shard
+    status: Mapped[OutboxStatus] = mapped_column(default=OutboxStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(server_default='0')
+    next_attempt_at: Mapped[datetime.datetime] = mapped_column()
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    claim_token: Mapped[Optional[str]] = mapped_column(String(32))  # Set by each claim, the claimer's proof of its lease
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow())
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+
+    @classmethod
+    def enqueue_many(cls, conn, entries, guild_id=None):
+        # Keys already queued are skipped; a guild's entries only go to processes running its shard
+        keys = [key for key, _, _ in entries]
+        existing = set(conn.execute(select(Outbox.idempotency_key).where(Outbox.idempotency_key.in_(keys))).scalars())
+        now = datetime.datetime.utcnow()
+        rows = [{"idempotency_key": key, "kind": kind, "payload": json.dumps(payload), "guild_id": guild_id,
+                 "status": OutboxStatus.PENDING, "next_attempt_at": now}
+                for key, kind, payload in entries if key not in existing]
+        if rows:
+            conn.execute(insert(Outbox), rows)
+        return len(rows)
+
+    @classmethod
+    def enqueue_approval(cls, conn, submission_type, submission_id, guild_id):
+        payload = {"submission_type": submission_type, "submission_id": submission_id}
+        return cls.enqueue_many(conn, [(f"{submission_type}:{submission_id}:approved:{kind}", kind, payload)
+                                       for kind in OUTBOX_APPROVAL_KINDS], guild_id=guild_id)
+
+    @classmethod
+    def enqueue_changes(cls, submission_type, submission_id, channel_id, guild_id):
+        # Keyed on the current channel, so repeat presses before the new channel opens queue it once
+        payload = {"submission_type": submission_type, "submission_id": submission_id}
+        engine = get_engine()
+        with engine.begin() as conn:
+            return cls.enqueue_many(conn, [(f"{submission_type}:{submission_id}:changes:{channel_id}", "make_changes",
+                                            payload)], guild_id=guild_id)
+
+    @classmethod
+    def claim_due(cls, limit, lease_seconds, guild_ids):
+        # Only entries still due when the update runs are leased, so concurrent claimers never share one
+        engine = get_engine()
+        now = datetime.datetime.utcnow()
+        claim_token = uuid.uuid4().hex
+        with engine.begin() as conn:
+            stmt = select(Outbox.id).where(Outbox.status == OutboxStatus.PENDING, Outbox.next_attempt_at <= now,
+                                           or_(Outbox.guild_id.in_(guild_ids), Outbox.guild_id.is_(None))) \
+                .order_by(Outbox.next_attempt_at, Outbox.id).limit(limit)
+            ids = list(conn.execute(stmt).scalars())
+            if not ids:
+                return []
+            conn.execute(update(Outbox)
+                         .where(Outbox.id.in_(ids), Outbox.status == OutboxStatus.PENDING,
+                                Outbox.next_attempt_at <= now)
+                         .values(attempts=Outbox.attempts + 1, claim_token=claim_token,
+                                 next_attempt_at=now + datetime.timedelta(seconds=lease_seconds)))
+            return conn.execute(select(Outbox).where(Outbox.claim_token == claim_token).order_by(Outbox.id)).all()
+
+    @classmethod
+    def mark_done(cls, outbox_id, claim_token):
+        # False if the claim ran out and the entry was claimed again
+        engine = get_engine()
+        with engine.begin() as conn:
+            return conn.execute(update(Outbox).where(Outbox.id == outbox_id, Outbox.claim_token == claim_token)
+                                .values(status=OutboxStatus.DONE, last_error=None)).rowcount > 0
+
+    @classmethod
+    def mark_failed(cls, outbox_id, claim_token, error, retry_at=None):
+        # Dead-letters the entry without retry_at; False if the claim ran out and it was claimed again
+        values = {"last_error": error}
+        if retry_at is None:
+            values["status"] = OutboxStatus.DEAD
+        else:
+            values["next_attempt_at"] = retry_at
+        engine = get_engine()
+        with engine.begin() as conn:
+            return conn.execute(update(Outbox).where(Outbox.id == outbox_id, Outbox.claim_token == claim_token)
+                                .values(**values)).rowcount > 0
+
+    @classmethod
+    def count_by_status(cls):
+        engine = get_engine()
+        stmt = select(Outbox.status, func.count()).group_by(Outbox.status)
+        with engine.connect() as conn:
+            return {status.name: count for status, count in conn.execute(stmt)}
+
+    @classmethod
+    def get_dead(cls, limit=10):
+        engine = get_engine()
+        stmt = select(Outbox).where(Outbox.status == OutboxStatus.DEAD).order_by(desc(Outbox.id)).limit(limit)
+        with engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    @classmethod
+    def retry_dead(cls, outbox_id=None):
+        stmt = update(Outbox).where(Outbox.status == OutboxStatus.DEAD) \
+            .values(status=OutboxStatus.PENDING, attempts=0, next_attempt_at=datetime.datetime.utcnow())
+        if outbox_id is not None:
+            stmt = stmt.where(Outbox.id == outbox_id)
+        engine = get_engine()
+        with engine.begin() as conn:
+            return conn.execute(stmt).rowcount
+
+
+class GuildSettings(Base):
+    # The DISCORD_SERVER_ID guild falls back to config.py for any channel it has not set
+    __tablename__ = "guild_settings"
+    guild_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    earning_review_channel_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    spending_review_channel_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    earning_approved_channel_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    spending_approved_channel_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    thread_parent_channel_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+
+    _cache = {}  # guild id -> (time.monotonic() when loaded, channel ids)
+
+    @classmethod
+    def get(cls, guild_id):
+        # Cached per process for GUILD_SETTINGS_CACHE_SECONDS; set() only refreshes this process's copy
+        guild_id = int(guild_id)
+        cached = cls._cache.get(guild_id)
+        if cached is not None and time.monotonic() - cached[0] < config.GUILD_SETTINGS_CACHE_SECONDS:
+            return cached[1]
+        engine = get_engine()
+        with engine.connect() as conn:
+            row = conn.execute(select(GuildSettings).where(GuildSettings.guild_id == guild_id).limit(1)).first()
+        channel_ids = {}
+        for name, column in GUILD_CHANNEL_SETTINGS.items():
+            channel_id = getattr(row, column) if row else None
+            if channel_id is None and guild_id == int(config.DISCORD_SERVER_ID):
+                channel_id = getattr(config, name)
+            channel_ids[name] = int(channel_id) if channel_id is not None else None
+        cls._cache[guild_id] = (time.monotonic(), channel_ids)
+        return channel_ids
+
+    @classmethod
+    def is_set_up(cls, guild_id):
+        return any(channel_id is not None for channel_id in cls.get(guild_id).values())
+
+    @classmethod
+    def set(cls, guild_id, channel_ids):
+        guild_id = int(guild_id)
+        values = {GUILD_CHANNEL_SETTINGS[name]: int(channel_id) for name, channel_id in channel_ids.items()}
+        engine = get_engine()
+        with engine.begin() as conn:
+            stmt = update(GuildSettings).where(GuildSettings.guild_id == guild_id).values(**values)
+            if conn.execute(stmt).rowcount == 0:
+                conn.execute(insert(GuildSettings).values(guild_id=guild_id, **values))
+        cls._cache.pop(guild_id, None)
+        return cls.get(guild_id)
+
+
+class JobState(Base):
+    __tablename__ = "job_state"
+    name: Mapped[str] = mapped_column(String(191), primary_key=True)
+    high_water_mark: Mapped[int] = mapped_column(BigInteger, server_default='0')
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+
+    @classmethod
+    def get(cls, name, conn=None):
+        stmt = select(JobState.high_water_mark).where(JobState.name == name).limit(1)
+        if conn is not None:
+            return conn.execute(stmt).scalar() or 0
+        engine = get_engine()
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar() or 0
+
+    @classmethod
+    def set(cls, name, high_water_mark, conn=None):
+        if conn is None:
+            engine = get_engine()
+            with engine.begin() as conn:
+                return cls.set(name, high_water_mark, conn=conn)
+        stmt = update(JobState).where(JobState.name == name).values(high_water_mark=high_water_mark)
+        if conn.execute(stmt).rowcount == 0:
+            conn.execute(insert(JobState).values(name=name, high_water_mark=high_water_mark))
+
+
+class JobLease(Base):
+    __tablename__ = "job_lease"
+    name: Mapped[str] = mapped_column(String(191), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(191))
+    expires_at: Mapped[datetime.datetime] = mapped_column()
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+
+    @classmethod
+    def acquire(cls, name, holder, lease_seconds):
+        # Expiry is set and judged by the database's clock, so skew between bot hosts cannot make two holders
+        expires_at = utcnow_plus(lease_seconds)
+        engine = get_engine()
+        try:
+            with engine.begin() as conn:
+                stmt = update(JobLease).where(JobLease.name == name,
+                                              or_(JobLease.holder == holder, JobLease.expires_at <= utcnow())) \
+                    .values(holder=holder, expires_at=expires_at)
+                if conn.execute(stmt).rowcount:
+                    return True
+                if conn.execute(select(JobLease.name).where(JobLease.name == name)).first() is not None:
+                    return False
+                conn.execute(insert(JobLease).values(name=name, holder=holder, expires_at=expires_at))
+                return True
+        except IntegrityError:
+            # Another process created the lease first
+            return False
+
+    @classmethod
+    def release(cls, name, holder):
+        engine = get_engine()
+        with engine.begin() as conn:
+            stmt = update(JobLease).where(JobLease.name == name, JobLease.holder == holder).values(expires_at=utcnow())
+            return conn.execute(stmt).rowcount > 0
+
+    @classmethod
+    def get_holder(cls, name):
+        engine = get_engine()
+        stmt = select(JobLease.holder).where(JobLease.name == name, JobLease.expires_at > utcnow())
+        with engine.connect() as conn:
+            return conn.execute(stmt).scalar()
+
+
+class CacheVersion(Base):
+    # Polled by every process to invalidate its caches, see invalidation.py
+    __tablename__ = "cache_version"
+    guild_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    topic: Mapped[str] = mapped_column(String(64), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, server_default='0')
+    updated_at: Mapped[datetime.datetime] = mapped_column(server_default=utcnow(), onupdate=utcnow())
+
+    @classmethod
+    def bump(cls, conn, guild_id, topic):
+        # Rows are created ahead of time by the migration, ensure() and /guild_settings, so the insert is a fallback
+        stmt = update(CacheVersion).where(CacheVersion.guild_id == guild_id, CacheVersion.topic == topic) \
+            .values(version=CacheVersion.version + 1)
+        if conn.execute(stmt).rowcount == 0:
+            conn.execute(insert(CacheVersion).values(guild_id=guild_id, topic=topic, version=1))
+
+    @classmethod
+    def ensure(cls, guild_ids):
+        engine = get_engine()
+        try:
+            with engine.begin() as conn:
+                existing = set(conn.execute(select(CacheVersion.guild_id, CacheVersion.topic)
+                                            .where(CacheVersion.guild_id.in_(guild_ids))).tuples())
+                rows = [{"guild_id": guild_id, "topic": topic, "version": 0} for guild_id in guild_ids
+                        for topic in invalidation.TOPICS if (guild_id, topic) not in existing]
+                if rows:
+                    conn.execute(insert(CacheVersion), rows)
+        except IntegrityError:
+            # Another process created them at the same time
+            pass
+
+    @classmethod
+    def poll(cls, guild_ids=None):
+        stmt = select(CacheVersion.guild_id, CacheVersion.topic, CacheVersion.version)
+        if guild_ids is not None:
+            stmt = stmt.where(CacheVersion.guild_id.in_(guild_ids))
+        engine = get_engine()
+        with engine.connect() as conn:
+            versions = {(row.guild_id, row.topic): row.version for row in conn.execute(stmt)}
+        return invalidation.apply_versions(versions)
+
 
+invalidation.listen(invalidation.STANDINGS, User.forget_guild)
+invalidation.listen(invalidation.VISIBILITY, User.forget_guild)
+invalidation.listen(invalidation.ADMINS, User.forget_guild)
+invalidation.listen(invalidation.VISIBILITY, leaderboard_index.mark_stale)
 
 Base.registry.configure()
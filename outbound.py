@@ -0,0 +1,184 @@
+"""Scheduler for the Discord REST calls handlers make besides answering the interaction itself.
+
+Calls are queued per rate limit bucket and run one at a time per bucket, highest priority first, with at most
+OUTBOUND_MAX_CONCURRENCY in flight across all buckets, so a burst of approvals queues instead of colliding in Discord's
+shared buckets. A call given a key is coalesced with an identical call that is still queued or in flight, and a call
+failing with a 429 or a server error is retried with exponential backoff. A call running for longer than
+OUTBOUND_EFFECT_TIMEOUT_SECONDS fails with TimeoutError and is not retried, as Discord may have carried it out anyway;
+time spent queued does not count against it.
+
+Interaction responses and followups are not queued. They have their own per-interaction limits and a 3 second
+deadline, so they are sent directly and always go first; INTERACTIVE is for calls the response itself depends on.
+"""
+import asyncio
+import itertools
+import logging
+import random
+from collections import defaultdict
+from enum import IntEnum
+from heapq import heappush, heappop
+
+import discord
+
+from settings import config
+import discord_bot
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # Needed to answer the user who is waiting, such as fetching the user shown in a reply
+    NOTIFY = 1  # DMs and posts to the review and canon channels
+    CLEANUP = 2  # Deleting or archiving finished submission channels
+
+
+class OutboundScheduler(object):
+    def __init__(self, concurrency=config.OUTBOUND_MAX_CONCURRENCY, max_attempts=config.OUTBOUND_MAX_ATTEMPTS,
+                 retry_base_seconds=config.OUTBOUND_RETRY_BASE_SECONDS, timeout=config.OUTBOUND_EFFECT_TIMEOUT_SECONDS):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.timeout = timeout
+        self.queues = {}  # bucket -> heap of (priority, sequence, bucket, call, key, future)
+        self.busy = set()  # buckets with a call in flight
+        self.keyed = {}  # coalescing key -> future of the queued or in flight call
+        self.in_flight = 0
+        self.sequence = itertools.count()
+        self.counts = defaultdict(int)
+
+    def submit(self, bucket, priority, call, key=None):
+        """Queue call, a function returning a coroutine, and return a future for its result."""
+        self.counts["submitted"] += 1
+        if key is not None and key in self.keyed:
+            self.counts["coalesced"] += 1
+            return self.keyed[key]
+        future = asyncio.get_running_loop().create_future()
+        heappush(self.queues.setdefault(bucket, []), (priority, next(self.sequence), bucket, call, key, future))
+        if key is not None:
+            self.keyed[key] = future
+        self.counts["max_depth"] = max(self.counts["max_depth"], self.depth())
+        self._dispatch()
+        return future
+
+    async def run(self, bucket, priority, call, key=None):
+        # Shielded so a cancelled caller does not cancel a call that was coalesced with others
+        return await asyncio.shield(self.submit(bucket, priority, call, key))
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self):
+        queued = defaultdict(int)
+        for queue in self.queues.values():
+            for item in queue:
+                queued[Priority(item[0]).name] += 1
+        return {
+            "queued": dict(queued),
+            "queued_buckets": len(self.queues),
+            "in_flight": self.in_flight,
+            **self.counts,
+        }
+
+    def _dispatch(self):
+        while self.in_flight < self.concurrency:
+            ready = [queue[0] for bucket, queue in self.queues.items() if bucket not in self.busy]
+            if not ready:
+                return
+            item = min(ready)
+            bucket = item[2]
+            heappop(self.queues[bucket])
+            if not self.queues[bucket]:
+                del self.queues[bucket]
+            self.busy.add(bucket)
+            self.in_flight += 1
+            asyncio.create_task(self._run(*item))
+
+    async def _run(self, priority, sequence, bucket, call, key, future):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        result = await call()
+                except discord.HTTPException as e:
+                    if (e.status == 429 or e.status >= 500) and attempt < self.max_attempts:
+                        self.counts["retried"] += 1
+                        logger.warning("Retrying %s call after attempt %s failed: %s", bucket, attempt, e)
+                        delay = self.retry_base_seconds * 2 ** (attempt - 1)
+                        await asyncio.sleep(delay + random.uniform(0, self.retry_base_seconds))
+                        continue
+                    self.counts["failed"] += 1
+                    future.set_exception(e)
+                except Exception as e:
+                    self.counts["failed"] += 1
+                    future.set_exception(e)
+                else:
+                    self.counts["completed"] += 1
+                    future.set_result(result)
+                break
+        finally:
+            if key is not None and self.keyed.get(key) is future:
+                del self.keyed[key]
+            # Nobody may be left waiting on a coalesced call, so retrieve any exception to keep asyncio quiet
+            if future.done() and not future.cancelled():
+                future.exception()
+            self.busy.discard(bucket)
+            self.in_flight -= 1
+            self._dispatch()
+
+
+scheduler = OutboundScheduler()
+
+
+async def fan_out(*effects):
+    """Await independent side effects concurrently.
+
+    A failing effect does not cancel the others. Once all have finished, any failures are raised together as an
+    ExceptionGroup. The effects' Discord calls are queued here, which times each call out once it is running, so a slow
+    call is never abandoned while it can still go through.
+    """
+    errors = []
+
+    async def guarded(effect):
+        try:
+            await effect
+        except Exception as e:
+            errors.append(e)
+
+    async with asyncio.TaskGroup() as group:
+        for effect in effects:
+            group.create_task(guarded(effect))
+    if errors:
+        raise ExceptionGroup(f"{len(errors)} of {len(effects)} side effects failed", errors)
+
+
+async def fetch_user(user_id, priority=Priority.INTERACTIVE):
+    user_id = int(user_id)
+    user = discord_bot.bot.get_user(user_id)
+    if user is not None:
+        return user
+    return await scheduler.run("GET /users/{user_id}", priority, lambda: discord_bot.bot.fetch_user(user_id),
+                               key=("fetch_user", user_id))
+
+
+async def fetch_channel(channel_id, priority=Priority.INTERACTIVE):
+    channel_id = int(channel_id)
+    channel = discord_bot.bot.get_channel(channel_id)
+    if channel is not None:
+        return channel
+    return await scheduler.run("GET /channels/{channel_id}", priority,
+                               lambda: discord_bot.bot.fetch_channel(channel_id), key=("fetch_channel", channel_id))
+
+
+async def send(channel, priority=Priority.NOTIFY, **kwargs):
+    return await scheduler.run(f"channel:{channel.id}", priority, lambda: channel.send(**kwargs))
+
+
+async def send_dm(user, priority=Priority.NOTIFY, **kwargs):
+    return await scheduler.run(f"dm:{user.id}", priority, lambda: user.send(**kwargs))
+
+
+async def close_submission_channel(channel, reason):
+    # Channel deletes share a guild wide limit, so they all go in one bucket
+    return await scheduler.run("DELETE /channels/{channel_id}", Priority.CLEANUP,
+                               lambda: discord_bot.close_submission_channel(channel, reason=reason),
+                               key=("close", channel.id))
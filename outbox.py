@@ -0,0 +1,125 @@
+"""Delivery of the outbox, the Discord side effects models queue in the same transaction as the change behind them.
+
+Handlers are registered per kind with @outbox.handler and called with the entry's JSON payload as keyword arguments.
+Entries are claimed in batches with a lease, so ones claimed by a process that then died are picked up again once
+the lease runs out, and delivered OUTBOX_WORKERS at a time. Each claim carries a token, so an outcome recorded after
+the lease ran out cannot overwrite that of whoever claimed the entry next. Delivery is at least once: a handler can
+run again after a crash between its Discord call and the entry being marked done, but the idempotency key stops the
+same side effect being queued twice. Failures worth retrying back off exponentially, anything else and entries out of
+attempts are dead-lettered for Outbox.retry_dead.
+
+Entries for a guild are only claimed by processes running its gateway shard, which have its channels cached.
+
+jobs.py drains the outbox every OUTBOX_POLL_SECONDS, and wake() starts a drain straight away after a commit.
+"""
+import asyncio
+import datetime
+import json
+import logging
+
+import aiohttp
+import discord
+
+from settings import config
+import discord_bot
+from db import write_in_thread
+from models import Outbox
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+retry_timeout_kinds = set()  # Kinds whose handlers can safely run again after timing out
+_claim_lock = None
+_wake_tasks = set()
+
+
+def handler(kind, retry_timeouts=True):
+    """Register the handler for kind. Pass retry_timeouts=False if a timed out Discord call may still have taken effect
+    and running the handler again would repeat it, such as sending a message.
+    """
+    def decorator(func):
+        handlers[kind] = func
+        if retry_timeouts:
+            retry_timeout_kinds.add(kind)
+        return func
+    return decorator
+
+
+def is_retryable(error, kind):
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    if isinstance(error, asyncio.TimeoutError):
+        return kind in retry_timeout_kinds
+    return isinstance(error, (aiohttp.ClientError, OSError, LookupError))
+
+
+async def deliver(entry):
+    """Run one claimed entry's handler and record the outcome, returning whether it was delivered."""
+    try:
+        if entry.kind not in handlers:
+            # Kept for retry rather than dead-lettered, it may be handled once the module registering it is loaded
+            raise LookupError(f"No outbox handler for {entry.kind}")
+        await handlers[entry.kind](**json.loads(entry.payload))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        delay = retry_at = None
+        if is_retryable(e, entry.kind) and entry.attempts < config.OUTBOX_MAX_ATTEMPTS:
+            delay = min(config.OUTBOX_RETRY_BASE_SECONDS * 2 ** (entry.attempts - 1), config.OUTBOX_RETRY_MAX_SECONDS)
+            retry_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+        if not await write_in_thread(Outbox.mark_failed, entry.id, entry.claim_token, error, retry_at):
+            logger.warning("Outbox entry %s (%s) failed after its lease ran out: %s", entry.id, entry.kind, error)
+        elif retry_at is not None:
+            logger.warning("Outbox entry %s (%s) failed attempt %s, retrying in %ss: %s", entry.id, entry.kind,
+                           entry.attempts, delay, error)
+        else:
+            logger.error("Dead-lettered outbox entry %s (%s) after %s attempts: %s", entry.id, entry.kind,
+                         entry.attempts, error)
+        return False
+    if not await write_in_thread(Outbox.mark_done, entry.id, entry.claim_token):
+        logger.warning("Outbox entry %s (%s) was delivered after its lease ran out and may be delivered again",
+                       entry.id, entry.kind)
+    return True
+
+
+async def drain():
+    """Deliver due entries until none are left, returning how many were delivered and how many failed."""
+    global _claim_lock
+    if _claim_lock is None:
+        _claim_lock = asyncio.Lock()
+    semaphore = asyncio.Semaphore(config.OUTBOX_WORKERS)
+
+    async def deliver_one(entry):
+        async with semaphore:
+            return await deliver(entry)
+
+    delivered = failed = 0
+    while True:
+        # Claims are serialised so a drain started by wake() and the polling job never claim the same entry
+        async with _claim_lock:
+            entries = await write_in_thread(Outbox.claim_due, config.OUTBOX_BATCH_SIZE,
+                                            config.OUTBOX_LEASE_SECONDS, discord_bot.local_guild_ids())
+        if not entries:
+            return delivered, failed
+        results = await asyncio.gather(*(deliver_one(entry) for entry in entries))
+        delivered += results.count(True)
+        failed += results.count(False)
+
+
+async def _drain_now():
+    try:
+        await drain()
+    except Exception:
+        logger.exception("Outbox delivery failed, the entries will be retried by the next poll")
+
+
+def wake():
+    """Start delivering just-committed entries now instead of at the next poll."""
+    task = asyncio.create_task(_drain_now())
+    _wake_tasks.add(task)
+    task.add_done_callback(_wake_tasks.discard)
+
+
+async def flush():
+    """Wait for drains started by wake() and deliver anything else due, for load tests and shutdown."""
+    await asyncio.gather(*_wake_tasks)
+    return await drain()
@@ -0,0 +1,37 @@
+"""Reconcile user balances with the transaction log.
+
+user.judgement_points is a running copy of each user's transaction log total. This compares the two, by default only
+for users with transaction log rows added since the last run, and with --repair corrects any drift:
+
+    python reconcile.py
+    python reconcile.py --full --repair
+
+The bot runs the same incremental check in the background every RECONCILE_INTERVAL_MINUTES.
+"""
+import argparse
+import sys
+import time
+
+from models import LedgerBalance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile NY Noir user balances with the transaction log")
+    parser.add_argument("--full", action="store_true", help="Recompute every user instead of only new activity")
+    parser.add_argument("--repair", action="store_true", help="Correct balances that do not match the ledger")
+    parser.add_argument("--limit", type=int, default=50, help="How many mismatches to list")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    checked, mismatches, high_water_mark = LedgerBalance.reconcile(full=args.full, repair=args.repair)
+    for user_id, points, ledger_points in mismatches[:args.limit]:
+        print(f"User #{user_id}: balance {points}, ledger {ledger_points} ({ledger_points - points:+})")
+    if len(mismatches) > args.limit:
+        print(f"... and {len(mismatches) - args.limit} more")
+    print(f"Checked {checked} users up to transaction #{high_water_mark} in {time.perf_counter() - start:.2f}s, "
+          f"{len(mismatches)} mismatched{', repaired' if args.repair and mismatches else ''}")
+    return 1 if mismatches and not args.repair else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
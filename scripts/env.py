@@ -1,12 +1,13 @@
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
+from sqlalchemy import event
 from sqlalchemy import pool
 
 from alembic import context
 
 import models
-from config import *
+from db import get_engine_url, set_sqlite_pragmas
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -29,6 +30,15 @@ target_metadata = models.Base.metadata
 # ... etc.
 
 
+def set_migration_sqlite_pragmas(dbapi_connection, connection_record):
+    set_sqlite_pragmas(dbapi_connection, connection_record)
+    # Batch mode rebuilds a table by copying it and dropping the original, which foreign key enforcement refuses for any
+    # table with rows referencing it
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=OFF")
+    cursor.close()
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -41,12 +51,13 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    url = f"{DB_DIALECT}{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}?charset=utf8mb4"
+    url = get_engine_url()
     context.configure(
         url=url,
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=url.startswith("sqlite"),
     )
 
     with context.begin_transaction():
@@ -63,13 +74,17 @@ def run_migrations_online() -> None:
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
-        url=f"{DB_DIALECT}{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}?charset=utf8mb4",
+        url=get_engine_url(),
         poolclass=pool.NullPool,
     )
 
+    if connectable.dialect.name == "sqlite":
+        event.listen(connectable, "connect", set_migration_sqlite_pragmas)
+
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == "sqlite",
         )
 
         with context.begin_transaction():
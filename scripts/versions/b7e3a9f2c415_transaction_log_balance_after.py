@@ -0,0 +1,62 @@
+"""Transaction log balance_after
+
+Revision ID: b7e3a9f2c415
+Revises: 8d2f4b6a1c90
+Create Date: 2026-10-19 19:03:27.551904+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3a9f2c415'
+down_revision: Union[str, None] = '8d2f4b6a1c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_CHUNK_SIZE = 10000
+
+
+def backfill_balance_after():
+    """Fill balance_after with each user's running total in timestamp order, one chunk of rows at a time."""
+    conn = op.get_bind()
+    transaction_log = sa.table('transaction_log', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                               sa.column('timestamp', sa.DateTime), sa.column('judgement_points', sa.Integer),
+                               sa.column('balance_after', sa.Integer))
+    stmt = sa.update(transaction_log).where(transaction_log.c.id == sa.bindparam('txn_id')) \
+        .values(balance_after=sa.bindparam('balance'))
+    balances = {}
+    last = None
+    # In (user_id, timestamp, id) order, which ix_transaction_log_user_id_timestamp serves
+    order = (transaction_log.c.user_id, transaction_log.c.timestamp, transaction_log.c.id)
+    while True:
+        query = sa.select(transaction_log.c.id, transaction_log.c.user_id, transaction_log.c.timestamp,
+                          transaction_log.c.judgement_points)
+        if last is not None:
+            query = query.where(sa.tuple_(*order) > sa.tuple_(last.user_id, last.timestamp, last.id))
+        rows = conn.execute(query.order_by(*order).limit(BACKFILL_CHUNK_SIZE)).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            balances[row.user_id] = balances.get(row.user_id, 0) + row.judgement_points
+            updates.append({'txn_id': row.id, 'balance': balances[row.user_id]})
+        conn.execute(stmt, updates)
+        last = rows[-1]
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('transaction_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('balance_after', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_transaction_log_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+
+    backfill_balance_after()
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('transaction_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_log_user_id_timestamp')
+        batch_op.drop_column('balance_after')
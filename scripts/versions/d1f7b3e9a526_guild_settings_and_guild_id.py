@@ -0,0 +1,132 @@
+"""Guild settings and guild_id
+
+Revision ID: d1f7b3e9a526
+Revises: a6d9c3f1e2b8
+Create Date: 2026-10-20 10:12:41.305817+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import expression
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1f7b3e9a526'
+down_revision: Union[str, None] = 'a6d9c3f1e2b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+class utcnow(expression.FunctionElement):
+    """The current UTC time as a server default, kept here so this revision does not change along with models.py."""
+    type = sa.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, 'mysql')
+def mysql_utcnow(element, compiler, **kw):
+    return "UTC_TIMESTAMP()"
+
+
+def default_guild_id():
+    # The guild existing rows belong to: `alembic -x default_guild_id=...`, else the bot's DISCORD_SERVER_ID
+    guild_id = context.get_x_argument(as_dictionary=True).get('default_guild_id')
+    if guild_id is None:
+        from settings import config
+        guild_id = config.DISCORD_SERVER_ID
+    return int(guild_id)
+
+
+GUILD_SCOPED_TABLES = ('user', 'earning_submission', 'spending_submission', 'transaction_log', 'admin_transaction',
+                       'leaderboard_snapshot')
+
+
+def add_guild_id(table_name):
+    """Add guild_id to a table, with every existing row belonging to the default guild."""
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.add_column(sa.Column('guild_id', sa.BigInteger(), nullable=True))
+    table = sa.table(table_name, sa.column('guild_id', sa.BigInteger))
+    op.get_bind().execute(sa.update(table).values(guild_id=default_guild_id()))
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.alter_column('guild_id', existing_type=sa.BigInteger(), nullable=False)
+
+
+def upgrade() -> None:
+    op.create_table('guild_settings',
+    sa.Column('guild_id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('earning_review_channel_id', sa.BigInteger(), nullable=True),
+    sa.Column('spending_review_channel_id', sa.BigInteger(), nullable=True),
+    sa.Column('earning_approved_channel_id', sa.BigInteger(), nullable=True),
+    sa.Column('spending_approved_channel_id', sa.BigInteger(), nullable=True),
+    sa.Column('thread_parent_channel_id', sa.BigInteger(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=utcnow(), nullable=False),
+    sa.PrimaryKeyConstraint('guild_id')
+    )
+    for table_name in GUILD_SCOPED_TABLES:
+        add_guild_id(table_name)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_discord_id')
+        batch_op.drop_index('ix_user_visible_judgement_points')
+        batch_op.create_index('ix_user_guild_id_discord_id', ['guild_id', 'discord_id'], unique=False,
+                              mysql_length={'discord_id': 32})
+        batch_op.create_index('ix_user_guild_id_visible_judgement_points', ['guild_id', 'visible', 'judgement_points'],
+                              unique=False)
+
+    with op.batch_alter_table('earning_submission', schema=None) as batch_op:
+        batch_op.drop_index('ix_earning_submission_submitted_approved_timestamp')
+        batch_op.create_index('ix_earning_submission_guild_id_submitted_approved_timestamp', ['guild_id', 'submitted', 'approved', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('spending_submission', schema=None) as batch_op:
+        batch_op.drop_index('ix_spending_submission_submitted_approved_timestamp')
+        batch_op.create_index('ix_spending_submission_guild_id_submitted_approved_timestamp', ['guild_id', 'submitted', 'approved', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('transaction_log', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_log_guild_id_timestamp', ['guild_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('admin_transaction', schema=None) as batch_op:
+        batch_op.create_index('ix_admin_transaction_guild_id_timestamp', ['guild_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('leaderboard_snapshot', schema=None) as batch_op:
+        batch_op.drop_index('ix_leaderboard_snapshot_day_rank')
+        batch_op.create_index('ix_leaderboard_snapshot_guild_id_day_rank', ['guild_id', 'day', 'rank'], unique=True)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('leaderboard_snapshot', schema=None) as batch_op:
+        batch_op.drop_index('ix_leaderboard_snapshot_guild_id_day_rank')
+        batch_op.create_index('ix_leaderboard_snapshot_day_rank', ['day', 'rank'], unique=True)
+
+    with op.batch_alter_table('admin_transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_admin_transaction_guild_id_timestamp')
+
+    with op.batch_alter_table('transaction_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_log_guild_id_timestamp')
+
+    with op.batch_alter_table('spending_submission', schema=None) as batch_op:
+        batch_op.drop_index('ix_spending_submission_guild_id_submitted_approved_timestamp')
+        batch_op.create_index('ix_spending_submission_submitted_approved_timestamp', ['submitted', 'approved', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('earning_submission', schema=None) as batch_op:
+        batch_op.drop_index('ix_earning_submission_guild_id_submitted_approved_timestamp')
+        batch_op.create_index('ix_earning_submission_submitted_approved_timestamp', ['submitted', 'approved', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_guild_id_visible_judgement_points')
+        batch_op.drop_index('ix_user_guild_id_discord_id')
+        batch_op.create_index('ix_user_visible_judgement_points', ['visible', 'judgement_points'], unique=False)
+        batch_op.create_index('ix_user_discord_id', ['discord_id'], unique=False, mysql_length=32)
+
+    for table_name in reversed(GUILD_SCOPED_TABLES):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('guild_id')
+
+    op.drop_table('guild_settings')
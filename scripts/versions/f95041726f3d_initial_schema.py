@@ -9,6 +9,8 @@ from typing import Sequence, Union
 
 from alembic import op
 import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import expression
 
 
 # revision identifiers, used by Alembic.
@@ -18,6 +20,22 @@ branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
+class utcnow(expression.FunctionElement):
+    """The current UTC time as a server default, kept here so this revision does not change along with models.py."""
+    type = sa.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, 'mysql')
+def mysql_utcnow(element, compiler, **kw):
+    return "UTC_TIMESTAMP()"
+
+
 def upgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
     op.create_table('user',
@@ -30,7 +48,7 @@ def upgrade() -> None:
     )
     op.create_table('admin_transaction',
     sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('timestamp', sa.DateTime(), server_default=sa.text('UTC_TIMESTAMP()'), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), server_default=utcnow(), nullable=False),
     sa.Column('user_id', sa.Integer(), nullable=False),
     sa.Column('admin_user_id', sa.Integer(), nullable=False),
     sa.Column('net_points', sa.Integer(), nullable=False),
@@ -42,7 +60,7 @@ def upgrade() -> None:
     op.create_table('earning_submission',
     sa.Column('id', sa.Integer(), nullable=False),
     sa.Column('discord_channel_id', sa.Text(), nullable=False),
-    sa.Column('timestamp', sa.DateTime(), server_default=sa.text('UTC_TIMESTAMP()'), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), server_default=utcnow(), nullable=False),
     sa.Column('user_id', sa.Integer(), nullable=False),
     sa.Column('points_lodged', sa.Integer(), nullable=True),
     sa.Column('act_summary', sa.Text(), nullable=True),
@@ -56,7 +74,7 @@ def upgrade() -> None:
     op.create_table('spending_submission',
     sa.Column('id', sa.Integer(), nullable=False),
     sa.Column('discord_channel_id', sa.Text(), nullable=False),
-    sa.Column('timestamp', sa.DateTime(), server_default=sa.text('UTC_TIMESTAMP()'), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), server_default=utcnow(), nullable=False),
     sa.Column('user_id', sa.Integer(), nullable=False),
     sa.Column('cost', sa.Integer(), nullable=False),
     sa.Column('ability_requested', sa.Text(), nullable=True),
@@ -73,7 +91,7 @@ def upgrade() -> None:
     )
     op.create_table('transaction_log',
     sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('timestamp', sa.DateTime(), server_default=sa.text('UTC_TIMESTAMP()'), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), server_default=utcnow(), nullable=False),
     sa.Column('user_id', sa.Integer(), nullable=False),
     sa.Column('earning_submission_id', sa.Integer(), nullable=True),
     sa.Column('spending_submission_id', sa.Integer(), nullable=True),
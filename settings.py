@@ -0,0 +1,11 @@
+"""The bot's settings: config.py, with config_defaults.py behind it.
+
+Any setting a config.py written for an older version leaves out takes its default, so upgrading the bot does not need
+every new setting copied into config.py first. Import config from here rather than importing config.py directly.
+"""
+import config
+import config_defaults
+
+for name in dir(config_defaults):
+    if name.isupper() and not hasattr(config, name):
+        setattr(config, name, getattr(config_defaults, name))
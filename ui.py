@@ -1,4 +1,5 @@
 import asyncio
+import time
 from typing import Callable
 
 import discord.ui
@@ -6,15 +7,22 @@ from discord import ComponentType, SelectOption, ButtonStyle, Emoji, InputTextSt
 from discord.embeds import EmptyEmbed
 from discord.ui import Item
 
-import config
+from settings import config
 import discord_bot
+import invalidation
+import outbound
+import outbox
 from discord_bot import bot
 from discord_permissions import DP
 from exceptions import PaginationError
-from models import EarningSubmission, LocationAlignment, User, TransactionLog, SpendingSubmission, AdminTransaction
+from outbound import Priority
+from models import EarningSubmission, LocationAlignment, User, TransactionLog, SpendingSubmission, AdminTransaction, \
+    DailyLedgerRollup, LeaderboardSnapshot, Outbox, OutboxStatus, GuildSettings, guild_or_default
 
 alignment_short_label = ["In Alignment", "In Contravention", "Not Applicable"]
 
+leaderboard_pages = {}  # guild id -> page -> (time.monotonic() when rendered, embed), with LEADERBOARD_PAGE_CACHE_SECONDS
+
 
 async def generate_earning_embed(submission, title):
     embed = discord.Embed(title=f"{title} #{submission.id}")
@@ -27,7 +35,7 @@ async def generate_earning_embed(submission, title):
     if submission.denied_reason:
         embed.add_field(name="Denial Reason", value=submission.denied_reason, inline=False)
     user_discord_id = User.get_by_id(submission.user_id).discord_id
-    discord_user = await bot.fetch_user(int(user_discord_id))
+    discord_user = await outbound.fetch_user(user_discord_id)
     embed.set_author(name=discord_user.name, url=discord_user.jump_url,
                      icon_url=discord_user.avatar.url if discord_user.avatar else EmptyEmbed)
     return embed
@@ -48,14 +56,95 @@ async def generate_spending_embed(submission, title):
     if submission.denied_reason:
         embed.add_field(name="Denial Reason", value=submission.denied_reason, inline=False)
     user_discord_id = User.get_by_id(submission.user_id).discord_id
-    discord_user = await bot.fetch_user(int(user_discord_id))
+    discord_user = await outbound.fetch_user(user_discord_id)
     embed.set_author(name=discord_user.name, url=discord_user.jump_url,
                      icon_url=discord_user.avatar.url if discord_user.avatar else EmptyEmbed)
     return embed
 
 
-async def generate_leaderboard_embed(page):
-    leaderboard_db_users = User.get_leaderboard(page)
+async def dm_submission(user, generate_embed, submission, title, **kwargs):
+    await outbound.send_dm(user, embeds=[await generate_embed(submission, title)], **kwargs)
+
+
+async def post_submission(channel_name, generate_embed, submission, title, **kwargs):
+    channel = discord_bot.channels.get(channel_name, submission.guild_id)
+    await outbound.send(channel, embeds=[await generate_embed(submission, title)], **kwargs)
+
+
+# Submission table -> (model, embed generator, label, canon channel config name), for the outbox handlers
+APPROVED_SUBMISSION_TYPES = {
+    EarningSubmission.__tablename__: (EarningSubmission, generate_earning_embed, "Earning",
+                                      "EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID"),
+    SpendingSubmission.__tablename__: (SpendingSubmission, generate_spending_embed, "Spending",
+                                       "SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID"),
+}
+
+
+@outbox.handler("approved_dm", retry_timeouts=False)
+async def send_approved_dm(submission_type, submission_id):
+    model, generate_embed, label, _ = APPROVED_SUBMISSION_TYPES[submission_type]
+    submission = model.get_by_id(submission_id)
+    submitter = await outbound.fetch_user(User.get_by_id(submission.user_id).discord_id, Priority.NOTIFY)
+    await dm_submission(submitter, generate_embed, submission, f"Approved! {label} Submission ID:")
+
+
+@outbox.handler("close_submission_channel")
+async def close_approved_submission_channel(submission_type, submission_id):
+    model = APPROVED_SUBMISSION_TYPES[submission_type][0]
+    submission = model.get_by_id(submission_id)
+    try:
+        channel = await outbound.fetch_channel(submission.discord_channel_id, Priority.CLEANUP)
+        if discord_bot.is_open_submission_channel(channel):
+            await outbound.close_submission_channel(channel, reason="Submission Approved")
+    except discord.errors.NotFound:
+        pass
+
+
+@outbox.handler("canon_post", retry_timeouts=False)
+async def post_canon_submission(submission_type, submission_id):
+    model, generate_embed, label, channel_name = APPROVED_SUBMISSION_TYPES[submission_type]
+    submission = model.get_by_id(submission_id)
+    await post_submission(channel_name, generate_embed, submission, f"Canon {label} Submission - ID:")
+
+
+@outbox.handler("make_changes")
+async def make_changes(submission_type, submission_id):
+    """Open a changes channel asked for from a process not running the guild's shard, and DM the submitter a link."""
+    model, _, label, _ = APPROVED_SUBMISSION_TYPES[submission_type]
+    submission = model.get_by_id(submission_id)
+    if submission.approved:
+        return
+    try:
+        channel = await outbound.fetch_channel(submission.discord_channel_id, Priority.NOTIFY)
+    except discord.errors.NotFound:
+        channel = None
+    # Already open if this is a retry
+    if not (channel and discord_bot.is_open_submission_channel(channel)):
+        channel = await open_changes_channel(submission_type, submission)
+    submitter = await outbound.fetch_user(User.get_by_id(submission.user_id).discord_id, Priority.NOTIFY)
+    await outbound.send_dm(submitter, content=f"Make your changes to {label} Submission #{submission.id} in "
+                                              f"{channel.mention}")
+
+
+async def open_changes_channel(submission_type, submission):
+    """Open a channel for the submitter to make changes to submission in, from a process running its guild's shard."""
+    model, generate_embed, label, _ = APPROVED_SUBMISSION_TYPES[submission_type]
+    submitter = await bot.fetch_user(User.get_by_id(user_id=submission.user_id).discord_id)
+    channel = await discord_bot.create_submission_channel(bot.get_guild(submission.guild_id),
+                                                          f"{label.lower()}-{submission.id}-edits", submitter)
+    model.make_edits(submission.id, channel.id)
+    view = EarningReviewEditSubmitButtons() if model is EarningSubmission else SpendingReviewEditSubmitButtons()
+    await channel.send(embed=await generate_embed(submission, f"Making Changes to {label} Submission"), view=view)
+    return channel
+
+
+async def generate_leaderboard_embed(page, guild_id=None):
+    guild_id = guild_or_default(guild_id)
+    cached = leaderboard_pages.get(guild_id, {}).get(page)
+    if cached is not None and time.monotonic() - cached[0] < config.LEADERBOARD_PAGE_CACHE_SECONDS:
+        return cached[1]
+    generation = invalidation.generation(guild_id)
+    leaderboard_db_users = User.get_leaderboard(page, guild_id=guild_id)
     leaderboard_text = ""
     leaderboard = []
     max_place_len = 0
@@ -77,19 +166,162 @@ async def generate_leaderboard_embed(page):
         leaderboard_text += f"#{place}{' ' * (max_place_len - len(str(place)))} | {points}{' ' * (max_points_len - len(str(points)))} - {name}\n"
     embed = discord.Embed(title=f"Leaderboard - Page {page}")
     embed.add_field(name="", value=f"```{leaderboard_text}```")
+    # Not cached if the standings changed while the page was rendered
+    if config.LEADERBOARD_PAGE_CACHE_SECONDS and invalidation.generation(guild_id) == generation:
+        leaderboard_pages.setdefault(guild_id, {})[page] = (time.monotonic(), embed)
+    return embed
+
+
+def forget_leaderboard_pages(guild_id):
+    leaderboard_pages.pop(guild_id, None)
+
+
+invalidation.listen(invalidation.STANDINGS, forget_leaderboard_pages)
+invalidation.listen(invalidation.VISIBILITY, forget_leaderboard_pages)
+
+
+async def generate_rank_embed(user: User):
+    rank, total, first_place, rows = User.get_rank(user)
+    if rank is None:
+        return None
+    leaderboard = []
+    max_place_len = 0
+    max_points_len = 0
+    for index, db_user in enumerate(rows):
+        discord_user = await bot.fetch_user(db_user.discord_id)
+        place = first_place + index
+        points = db_user.judgement_points
+        leaderboard.append({"place": place, "points": points, "marker": "▶" if db_user.id == user.id else " ",
+                            "name": f"{discord_user.name}{'#' + discord_user.discriminator if discord_user.discriminator != '0' else ''}"})
+        if len(str(place)) > max_place_len:
+            max_place_len = len(str(place))
+        if len(str(points)) > max_points_len:
+            max_points_len = len(str(points))
+    leaderboard_text = ""
+    for leader in leaderboard:
+        place = leader["place"]
+        points = leader["points"]
+        leaderboard_text += f"{leader['marker']}#{place}{' ' * (max_place_len - len(str(place)))} | {points}{' ' * (max_points_len - len(str(points)))} - {leader['name']}\n"
+    embed = discord.Embed(title=f"Rank #{rank} of {total}")
+    embed.add_field(name="", value=f"```{leaderboard_text}```")
+    return embed
+
+
+async def generate_leaderboard_history_embed(page, period, start_day, end_day, user: User = None, guild_id=None):
+    embed = discord.Embed(title=f"Leaderboard History - Page {page}")
+    embed.add_field(name="Period", value=f"{period} ({start_day.isoformat()} to {end_day.isoformat()})", inline=False)
+    if user:
+        history = LeaderboardSnapshot.get_user_history(user.id, start_day)
+        discord_user = await bot.fetch_user(int(user.discord_id))
+        embed.add_field(name="User", value=discord_user.mention, inline=False)
+        if not history:
+            embed.add_field(name="Rank", value="Not on the leaderboard in this period", inline=False)
+            return embed
+        first, last = history[0], history[-1]
+        embed.add_field(name="Rank", value=f"#{first.rank} → #{last.rank}")
+        embed.add_field(name="Points", value=f"{first.judgement_points} → {last.judgement_points}")
+        embed.add_field(name="Best Rank", value=f"#{min(row.rank for row in history)}")
+        return embed
+    rows = LeaderboardSnapshot.get_movement(start_day, end_day, page=page, guild_id=guild_id)
+    leaderboard = []
+    max_place_len = 0
+    max_move_len = 0
+    max_points_len = 0
+    for row in rows:
+        user = await bot.fetch_user(row.discord_id)
+        if row.previous_rank is None:
+            move = "new"
+        elif row.previous_rank == row.rank:
+            move = "-"
+        else:
+            move = f"{'▲' if row.previous_rank > row.rank else '▼'}{abs(row.previous_rank - row.rank)}"
+        points = f"{row.judgement_points} ({row.judgement_points - (row.previous_points or 0):+})"
+        leaderboard.append({"place": row.rank, "move": move, "points": points,
+                            "name": f"{user.name}{'#' + user.discriminator if user.discriminator != '0' else ''}"})
+        max_place_len = max(max_place_len, len(str(row.rank)))
+        max_move_len = max(max_move_len, len(move))
+        max_points_len = max(max_points_len, len(points))
+    leaderboard_text = ""
+    for leader in leaderboard:
+        place = leader["place"]
+        move = leader["move"]
+        points = leader["points"]
+        leaderboard_text += f"#{place}{' ' * (max_place_len - len(str(place)))} {move}{' ' * (max_move_len - len(move))} | {points}{' ' * (max_points_len - len(points))} - {leader['name']}\n"
+    embed.add_field(name="", value=f"```{leaderboard_text}```", inline=False)
+    return embed
+
+
+REVIEW_QUEUE_MODELS = {"Earning Submissions": EarningSubmission, "Spending Submissions": SpendingSubmission}
+
+
+async def generate_review_queue_embed(record_type, after=None, guild_id=None):
+    model = REVIEW_QUEUE_MODELS[record_type]
+    rows = model.get_review_queue(after=after, limit=11, guild_id=guild_id)
+    embed = discord.Embed(title=f"Review Queue - {record_type}")
+    embed.add_field(name="Awaiting Review", value=str(model.count_pending_review(guild_id=guild_id)), inline=False)
+    queue_text = ""
+    for row in rows[:10]:
+        amount = f"{row.points_lodged} Points" if model is EarningSubmission else f"{row.cost} Points"
+        queue_text += f"**#{row.id}** {row.timestamp.isoformat(sep=' ')} | {amount} | <@{row.discord_id}> | <#{row.discord_channel_id}>\n"
+    embed.add_field(name="Oldest First", value=queue_text or "Nothing to review", inline=False)
+    if len(rows) > 10:
+        embed.set_footer(text=f"Next after #{rows[9].id}")
+    return embed
+
+
+async def generate_outbox_embed():
+    embed = discord.Embed(title="Outbox")
+    counts = Outbox.count_by_status()
+    for status in OutboxStatus:
+        embed.add_field(name=status.name.title(), value=str(counts.get(status.name, 0)))
+    dead_text = ""
+    for row in Outbox.get_dead():
+        dead_text += f"**#{row.id}** {row.kind} | {row.attempts} attempts | {(row.last_error or '')[:100]}\n"
+    embed.add_field(name="Recently Dead-Lettered", value=dead_text or "None", inline=False)
+    return embed
+
+
+async def generate_guild_settings_embed(guild_id):
+    embed = discord.Embed(title="Server Settings")
+    for name, channel_id in GuildSettings.get(guild_id).items():
+        label = name.removesuffix("_CHANNEL_ID").replace("_", " ").title()
+        embed.add_field(name=label, value=f"<#{channel_id}>" if channel_id else "Not Set", inline=False)
+    return embed
+
+
+async def generate_stats_embed(period, start=None, user: User = None, guild_id=None):
+    totals = DailyLedgerRollup.totals(user_id=user.id if user else None, start=start, guild_id=guild_id)
+    embed = discord.Embed(title=f"Judgement Point Stats - {period}")
+    if user:
+        discord_user = await bot.fetch_user(int(user.discord_id))
+        embed.add_field(name="User", value=discord_user.mention, inline=False)
+    embed.add_field(name="Earned", value=f"{totals.earned} Points")
+    embed.add_field(name="Spent", value=f"{totals.spent} Points")
+    embed.add_field(name="Admin Adjusted",
+                    value=f"{'+' if totals.admin_adjusted > 0 else ''}{totals.admin_adjusted} Points")
+    embed.add_field(name="Transactions", value=str(totals.transaction_count))
+    if not user:
+        embed.add_field(name="Active Users", value=str(totals.active_users))
+        earners_text = ""
+        for index, db_user in enumerate(DailyLedgerRollup.top_earners(start=start, guild_id=guild_id)):
+            discord_user = await bot.fetch_user(db_user.discord_id)
+            earners_text += f"#{index + 1} | {db_user.earned} - {discord_user.name}\n"
+        embed.add_field(name="Top Earners", value=f"```{earners_text}```" if earners_text else "Nobody yet",
+                        inline=False)
     return embed
 
 
 async def generate_transaction_log_embed(page, interaction: discord.Interaction = None, user: User = None):
     if interaction:
         user_discord_id = interaction.message.embeds[0].author.url.split("/")[-1]
-        user = User.get_or_create(user_discord_id)
+        user = User.get_or_create(user_discord_id, interaction.guild_id)
     db_transactions = TransactionLog.search_by_user(user.id, page=page)
-    transactions = [{"id": "ID", "ts": "Timestamp", "amount": "Amount", "ref": "Reference"}]
+    transactions = [{"id": "ID", "ts": "Timestamp", "amount": "Amount", "balance": "Balance", "ref": "Reference"}]
     log_text = ""
     max_id_len = len(transactions[0]["id"])
     max_ts_len = len(transactions[0]["ts"])
     max_amount_len = len(transactions[0]["amount"])
+    max_balance_len = len(transactions[0]["balance"])
     max_ref_len = len(transactions[0]["ref"])
     for index, db_txn in enumerate(db_transactions):
         ref = ""
@@ -101,21 +333,24 @@ async def generate_transaction_log_embed(page, interaction: discord.Interaction
             ref = f"Spend Sub #{db_txn.spending_submission_id}"
         transactions.append({"id": db_txn.id, "ts": db_txn.timestamp.isoformat(),
                              "amount": f"{'+' if db_txn.judgement_points > 0 else ''}{db_txn.judgement_points}",
-                             "ref": ref})
+                             "balance": db_txn.balance_after if db_txn.balance_after is not None else "", "ref": ref})
         if len(str(transactions[-1]["id"])) > max_id_len:
             max_id_len = len(str(transactions[-1]["id"]))
         if len(str(transactions[-1]["ts"])) > max_ts_len:
             max_ts_len = len(str(transactions[-1]["ts"]))
         if len(str(transactions[-1]["amount"])) > max_amount_len:
             max_amount_len = len(str(transactions[-1]["amount"]))
+        if len(str(transactions[-1]["balance"])) > max_balance_len:
+            max_balance_len = len(str(transactions[-1]["balance"]))
         if len(str(transactions[-1]["ref"])) > max_ref_len:
             max_ref_len = len(str(transactions[-1]["ref"]))
     for txn in transactions:
         id = txn["id"]
         ts = txn["ts"]
         amount = txn["amount"]
+        balance = txn["balance"]
         ref = txn["ref"]
-        log_text += f"{id}{' ' * (max_id_len - len(str(id)))} | {ts}{' ' * (max_ts_len - len(str(ts)))} | {amount}{' ' * (max_amount_len - len(str(amount)))} | {ref}\n"
+        log_text += f"{id}{' ' * (max_id_len - len(str(id)))} | {ts}{' ' * (max_ts_len - len(str(ts)))} | {amount}{' ' * (max_amount_len - len(str(amount)))} | {balance}{' ' * (max_balance_len - len(str(balance)))} | {ref}\n"
     embed = discord.Embed(title=f"Transaction Log - Page {page}")
     embed.add_field(name="", value=f"```{log_text}```")
     discord_user = await bot.fetch_user(int(user.discord_id))
@@ -138,7 +373,7 @@ async def generate_admin_transaction_embed(transaction, title):
 
 
 async def generate_admin_transaction_log_embed(page, interaction: discord.Interaction = None, target: User = None,
-                                               admin: User = None):
+                                               admin: User = None, guild_id=None):
     embed = discord.Embed(title=f"Admin Transaction Log - Page {page}")
     target_discord = None
     if target:
@@ -149,16 +384,17 @@ async def generate_admin_transaction_log_embed(page, interaction: discord.Intera
         admin_discord = await bot.fetch_user(admin.discord_id)
         embed.add_field(name="Admin User", value=admin_discord.mention, inline=False)
     if interaction:
+        guild_id = interaction.guild_id
         for field in interaction.message.embeds[0].fields:
             if field.name == "Target User":
                 target_discord_id = field.value.strip("<@>")
                 target_discord = await bot.fetch_user(int(target_discord_id))
-                target = User.get_or_create(target_discord_id)
+                target = User.get_or_create(target_discord_id, guild_id)
             elif field.name == "Admin User":
                 admin_discord_id = field.value.strip("<@>")
                 admin_discord = await bot.fetch_user(int(admin_discord_id))
-                admin = User.get_or_create(admin_discord_id)
-    db_transactions = AdminTransaction.search(target=target, admin=admin, page=page)
+                admin = User.get_or_create(admin_discord_id, guild_id)
+    db_transactions = AdminTransaction.search(target=target, admin=admin, page=page, guild_id=guild_id)
     transactions = [{"id": "ID", "ts": "Timestamp", "amount": "Amount", "by": "By", "on": "On"}]
     log_text = ""
     max_id_len = len(transactions[0]["id"])
@@ -211,14 +447,15 @@ async def generate_admin_transaction_log_embed(page, interaction: discord.Intera
     return embed
 
 
-async def generate_users_embed(page, interaction: discord.Interaction = None, admin=None):
+async def generate_users_embed(page, interaction: discord.Interaction = None, admin=None, guild_id=None):
     if interaction:
+        guild_id = interaction.guild_id
         user_type = interaction.message.embeds[0].fields[0].value
         if user_type == "Bot Admins":
             admin = True
         elif user_type == "Standard Users":
             admin = True
-    db_users = User.get_users(page, admin)
+    db_users = User.get_users(page, admin, guild_id=guild_id)
     users = [{"id": "ID", "vis": "Visible", "role": "Bot Role", "name": "Name"}]
     log_text = ""
     max_id_len = len(users[0]["id"])
@@ -404,13 +641,12 @@ class EarningReviewEditSubmitButtons(discord.ui.View):
         await interaction.response.defer(ephemeral=True)
         submission = EarningSubmission.get_by_channel_id(interaction.channel.id)
         EarningSubmission.submit(interaction.channel.id)
-        await interaction.user.send(
-            embeds=[await generate_earning_embed(submission, f"Submitted! Earning Submission ID:")])
-        channel = bot.get_channel(config.EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID)
-        await channel.send(embeds=[await generate_earning_embed(submission, f"New Earning Submission -")],
-                           view=EarningApproveDenyButtons())
         await interaction.followup.send("Submitted!")
-        await bot.get_channel(interaction.channel_id).delete(reason="Submission Completed")
+        await outbound.fan_out(
+            dm_submission(interaction.user, generate_earning_embed, submission, f"Submitted! Earning Submission ID:"),
+            post_submission("EARNING_SUBMISSIONS_REVIEW_CHANNEL_ID", generate_earning_embed, submission,
+                            f"New Earning Submission -", view=EarningApproveDenyButtons()),
+            outbound.close_submission_channel(interaction.channel, reason="Submission Completed"))
 
 
 class EarningApproveDenyButtons(discord.ui.View):
@@ -423,7 +659,7 @@ class EarningApproveDenyButtons(discord.ui.View):
         style=ButtonStyle.danger,
     )
     async def deny_callback(self, button, interaction):
-        calling_user = User.get_or_create(interaction.user.id)
+        calling_user = User.get_or_create(interaction.user.id, interaction.guild_id)
         if not calling_user.is_admin:
             await interaction.response.send_message("You are not authorized to perform this action")
             return
@@ -441,7 +677,7 @@ class EarningApproveDenyButtons(discord.ui.View):
         style=ButtonStyle.success
     )
     async def approve_callback(self, button, interaction: discord.Interaction):
-        calling_user = User.get_or_create(interaction.user.id)
+        calling_user = User.get_or_create(interaction.user.id, interaction.guild_id)
         if not calling_user.is_admin:
             await interaction.response.send_message("You are not authorized to perform this action")
             return
@@ -450,21 +686,12 @@ class EarningApproveDenyButtons(discord.ui.View):
         if submission.approved:
             await interaction.followup.send(f"Earning Submission #{submission.id} has already been approved!")
         else:
-            EarningSubmission.approve(submission.id)
-            TransactionLog.create_from_earning_submission(submission)
-            submitter = await bot.fetch_user(User.get_by_id(submission.user_id).discord_id)
-            await submitter.send(embeds=[await generate_earning_embed(submission, f"Approved! Earning Submission ID:")])
-            await interaction.followup.send(f"Approved Earning Submission #{submission.id}")
-            try:
-                sub_channel = await bot.fetch_channel(int(submission.discord_channel_id))
-                await sub_channel.delete(reason="Submission Approved")
-            except discord.errors.NotFound:
-                pass
-            try:
-                app_channel = await bot.fetch_channel(int(config.EARNING_SUBMISSIONS_APPROVED_CHANNEL_ID))
-                await app_channel.send(embed=await generate_earning_embed(submission, "Canon Earning Submission - ID:"))
-            except discord.errors.NotFound:
-                await interaction.followup.send("Error: Unable to find Earning Submissions Approved Channel")
+            # The DM, channel cleanup and canon post are queued in the approval's transaction and sent by outbox
+            if EarningSubmission.approve_and_post(submission):
+                await interaction.followup.send(f"Approved Earning Submission #{submission.id}")
+                outbox.wake()
+            else:
+                await interaction.followup.send(f"Earning Submission #{submission.id} has already been approved!")
 
 
 class EarningDenyReason(discord.ui.Modal):
@@ -473,7 +700,7 @@ class EarningDenyReason(discord.ui.Modal):
         self.add_item(discord.ui.InputText(label="Denial Reason", style=InputTextStyle.multiline))
 
     async def callback(self, interaction: discord.Interaction):
-        calling_user = User.get_or_create(interaction.user.id)
+        calling_user = User.get_or_create(interaction.user.id, interaction.guild_id)
         if not calling_user.is_admin:
             await interaction.response.send_message("You are not authorized to perform this action")
             return
@@ -481,11 +708,12 @@ class EarningDenyReason(discord.ui.Modal):
         submission = EarningSubmission.get_by_id(interaction.message.embeds[0].title.split("#")[1])
         EarningSubmission.deny(submission.id, self.children[0].value)
         submission = EarningSubmission.get_by_id(interaction.message.embeds[0].title.split("#")[1])
-        submitter = await bot.fetch_user(User.get_by_id(submission.user_id).discord_id)
-        await submitter.send(embeds=[await generate_earning_embed(submission, f"Denied! Earning Submission ID:")],
-                             view=EarningMakeChangesButton())
         await interaction.followup.send(
             f"Denied Earning Submission #{submission.id}\n**Reason:**\n{self.children[0].value}")
+        submitter = await outbound.fetch_user(User.get_by_id(submission.user_id).discord_id, Priority.NOTIFY)
+        await outbound.fan_out(
+            dm_submission(submitter, generate_earning_embed, submission, f"Denied! Earning Submission ID:",
+                          view=EarningMakeChangesButton()))
 
 
 class EarningMakeChangesButton(discord.ui.View):
@@ -506,33 +734,20 @@ class EarningMakeChangesButton(discord.ui.View):
         else:
             try:
                 channel = await bot.fetch_channel(int(submission.discord_channel_id))
-                await interaction.followup.send(f"Already Making Changes: {channel.mention}")
             except discord.errors.NotFound:
-                submitter = await bot.fetch_user(User.get_by_id(user_id=submission.user_id).discord_id)
-                guild = bot.get_guild(int(config.DISCORD_SERVER_ID))
-                if guild:
-                    role_everyone = await discord_bot.get_role_by_name("@everyone")
-                    channel = await (
-                        guild.create_text_channel(
-                            f"earning-{submission.id}-edits",
-                            overwrites={
-                                role_everyone: PermissionOverwrite.from_pair(
-                                    Permissions.none(),
-                                    Permissions.all()
-                                ),
-                                submitter: PermissionOverwrite.from_pair(
-                                    Permissions(DP.SEND_MESSAGES | DP.VIEW_CHANNEL),
-                                    Permissions(~(DP.SEND_MESSAGES | DP.VIEW_CHANNEL))
-                                )
-                            },
-                            category=await discord_bot.get_or_create_category("submissions")
-                        )
-                    )
-                    EarningSubmission.make_edits(submission.id, channel.id)
-                    await channel.send(
-                        embed=await generate_earning_embed(submission, f"Making Changes to Earning Submission"),
-                        view=EarningReviewEditSubmitButtons())
+                channel = None
+            if channel and discord_bot.is_open_submission_channel(channel):
+                await interaction.followup.send(f"Already Making Changes: {channel.mention}")
+            else:
+                if bot.get_guild(submission.guild_id):
+                    channel = await open_changes_channel(EarningSubmission.__tablename__, submission)
                     await interaction.followup.send(channel.mention)
+                else:
+                    # Pressed in a DM, which reaches the process running shard 0 rather than the guild's shard
+                    Outbox.enqueue_changes(EarningSubmission.__tablename__, submission.id, submission.discord_channel_id,
+                                           submission.guild_id)
+                    await interaction.followup.send("A channel is being opened for your changes, you will be sent a "
+                                                    "link to it here")
 
 
 class PaginationButtons(discord.ui.View):
@@ -582,14 +797,15 @@ class LeaderboardPaginationButtons(PaginationButtons):
     namespace = "leaderboard"
 
     def __init__(self):
-        super().__init__(lambda page, interaction=None: generate_leaderboard_embed(page), LeaderboardPaginationButtons)
+        super().__init__(lambda page, interaction=None: generate_leaderboard_embed(page, interaction.guild_id),
+                         LeaderboardPaginationButtons)
 
 
 class TransactionLogPaginationButtons(PaginationButtons):
     namespace = "transaction_log"
 
     def permission_check(self, interaction):
-        return User.get_or_create(interaction.user.id).is_admin
+        return User.get_or_create(interaction.user.id, interaction.guild_id).is_admin
 
     def __init__(self):
         super().__init__(lambda page, interaction=None: generate_transaction_log_embed(page, interaction=interaction),
@@ -600,7 +816,7 @@ class AdminTransactionLogPaginationButtons(PaginationButtons):
     namespace = "admin_transaction_log"
 
     def permission_check(self, interaction):
-        return User.get_or_create(interaction.user.id).is_admin
+        return User.get_or_create(interaction.user.id, interaction.guild_id).is_admin
 
     def __init__(self):
         super().__init__(
@@ -612,7 +828,7 @@ class UserPaginationButtons(PaginationButtons):
     namespace = "users"
 
     def permission_check(self, interaction):
-        return User.get_or_create(interaction.user.id).is_admin
+        return User.get_or_create(interaction.user.id, interaction.guild_id).is_admin
 
     def __init__(self):
         super().__init__(lambda page, interaction=None: generate_users_embed(page, interaction=interaction),
@@ -782,13 +998,12 @@ class SpendingReviewEditSubmitButtons(discord.ui.View):
         await interaction.response.defer(ephemeral=True)
         submission = SpendingSubmission.get_by_channel_id(interaction.channel.id)
         SpendingSubmission.submit(interaction.channel_id)
-        await interaction.user.send(
-            embeds=[await generate_spending_embed(submission, f"Submitted! Spending Submission ID:")])
-        channel = await bot.fetch_channel(config.SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID)
-        await channel.send(embeds=[await generate_spending_embed(submission, f"New Spending Submission -")],
-                           view=SpendingApproveDenyButtons())
         await interaction.followup.send("Submitted!")
-        await bot.get_channel(interaction.channel_id).delete(reason="Submission Completed")
+        await outbound.fan_out(
+            dm_submission(interaction.user, generate_spending_embed, submission, f"Submitted! Spending Submission ID:"),
+            post_submission("SPENDING_SUBMISSIONS_REVIEW_CHANNEL_ID", generate_spending_embed, submission,
+                            f"New Spending Submission -", view=SpendingApproveDenyButtons()),
+            outbound.close_submission_channel(interaction.channel, reason="Submission Completed"))
 
 
 class SpendingApproveDenyButtons(discord.ui.View):
@@ -824,23 +1039,12 @@ class SpendingApproveDenyButtons(discord.ui.View):
             await interaction.followup.send(
                 f"User does not have enough Judgement Points! Current balance is: `{user.judgement_points}` Points")
         else:
-            SpendingSubmission.approve(submission.id)
-            TransactionLog.create_from_spending_submission(submission)
-            submitter = await bot.fetch_user(User.get_by_id(submission.user_id).discord_id)
-            await submitter.send(
-                embeds=[await generate_spending_embed(submission, f"Approved! Spending Submission ID:")])
-            await interaction.followup.send(f"Approved Spending Submission #{submission.id}")
-            try:
-                sub_channel = await bot.fetch_channel(int(submission.discord_channel_id))
-                await sub_channel.delete(reason="Submission Approved")
-            except discord.errors.NotFound:
-                pass
-            try:
-                app_channel = await bot.fetch_channel(int(config.SPENDING_SUBMISSIONS_APPROVED_CHANNEL_ID))
-                await app_channel.send(
-                    embed=await generate_spending_embed(submission, "Canon Spending Submission - ID:"))
-            except discord.errors.NotFound:
-                await interaction.followup.send("Error: Unable to find Spending Submissions Approved Channel")
+            # The DM, channel cleanup and canon post are queued in the approval's transaction and sent by outbox
+            if SpendingSubmission.approve_and_post(submission):
+                await interaction.followup.send(f"Approved Spending Submission #{submission.id}")
+                outbox.wake()
+            else:
+                await interaction.followup.send(f"Spending Submission #{submission.id} has already been approved!")
 
 
 class SpendingDenyReason(discord.ui.Modal):
@@ -853,11 +1057,12 @@ class SpendingDenyReason(discord.ui.Modal):
         submission = SpendingSubmission.get_by_id(interaction.message.embeds[0].title.split("#")[1])
         SpendingSubmission.deny(submission.id, self.children[0].value)
         submission = SpendingSubmission.get_by_id(interaction.message.embeds[0].title.split("#")[1])
-        submitter = await bot.fetch_user(User.get_by_id(submission.user_id).discord_id)
-        await submitter.send(embeds=[await generate_spending_embed(submission, f"Denied! Spending Submission ID:")],
-                             view=SpendingMakeChangesButton())
         await interaction.followup.send(
             f"Denied Spending Submission #{submission.id}\n**Reason:**\n{self.children[0].value}")
+        submitter = await outbound.fetch_user(User.get_by_id(submission.user_id).discord_id, Priority.NOTIFY)
+        await outbound.fan_out(
+            dm_submission(submitter, generate_spending_embed, submission, f"Denied! Spending Submission ID:",
+                          view=SpendingMakeChangesButton()))
 
 
 class SpendingMakeChangesButton(discord.ui.View):
@@ -878,33 +1083,46 @@ class SpendingMakeChangesButton(discord.ui.View):
         else:
             try:
                 channel = await bot.fetch_channel(int(submission.discord_channel_id))
-                await interaction.followup.send(f"Already Making Changes: {channel.mention}")
             except discord.errors.NotFound:
-                submitter = await bot.fetch_user(User.get_by_id(user_id=submission.user_id).discord_id)
-                guild = bot.get_guild(int(config.DISCORD_SERVER_ID))
-                if guild:
-                    role_everyone = await discord_bot.get_role_by_name("@everyone")
-                    channel = await (
-                        guild.create_text_channel(
-                            f"spending-{submission.id}-edits",
-                            overwrites={
-                                role_everyone: PermissionOverwrite.from_pair(
-                                    Permissions.none(),
-                                    Permissions.all()
-                                ),
-                                submitter: PermissionOverwrite.from_pair(
-                                    Permissions(DP.SEND_MESSAGES | DP.VIEW_CHANNEL),
-                                    Permissions(~(DP.SEND_MESSAGES | DP.VIEW_CHANNEL))
-                                )
-                            },
-                            category=await discord_bot.get_or_create_category("submissions")
-                        )
-                    )
-                    SpendingSubmission.make_edits(submission.id, channel.id)
-                    await channel.send(
-                        embed=await generate_spending_embed(submission, f"Making Changes to Spending Submission"),
-                        view=SpendingReviewEditSubmitButtons())
+                channel = None
+            if channel and discord_bot.is_open_submission_channel(channel):
+                await interaction.followup.send(f"Already Making Changes: {channel.mention}")
+            else:
+                if bot.get_guild(submission.guild_id):
+                    channel = await open_changes_channel(SpendingSubmission.__tablename__, submission)
                     await interaction.followup.send(channel.mention)
+                else:
+                    # Pressed in a DM, which reaches the process running shard 0 rather than the guild's shard
+                    Outbox.enqueue_changes(SpendingSubmission.__tablename__, submission.id, submission.discord_channel_id,
+                                           submission.guild_id)
+                    await interaction.followup.send("A channel is being opened for your changes, you will be sent a "
+                                                    "link to it here")
+
+
+class ReviewQueueButtons(discord.ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @discord.ui.button(
+        custom_id="nyn:review_queue:next",
+        label="Next",
+        style=ButtonStyle.secondary
+    )
+    async def next_callback(self, button, interaction: discord.Interaction):
+        calling_user = User.get_or_create(interaction.user.id, interaction.guild_id)
+        if not calling_user.is_admin:
+            await interaction.response.send_message("You are not authorized to perform this action")
+            return
+        await interaction.response.defer(ephemeral=True)
+        embed = interaction.message.embeds[0]
+        if not embed.footer or not embed.footer.text:
+            await interaction.followup.send("There are no more submissions in the Review Queue")
+            return
+        record_type = embed.title.split(" - ", 1)[1]
+        after = int(embed.footer.text.split("#")[-1])
+        await interaction.followup.send(
+            embed=await generate_review_queue_embed(record_type, after=after, guild_id=interaction.guild_id),
+            view=ReviewQueueButtons())
 
 
 def register_views(bot):
@@ -923,3 +1141,4 @@ def register_views(bot):
     bot.add_view(SpendingReviewEditSubmitButtons())
     bot.add_view(SpendingApproveDenyButtons())
     bot.add_view(SpendingMakeChangesButton())
+    bot.add_view(ReviewQueueButtons())